@@ -0,0 +1,254 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Generator for synthetic (but realistic) notebooks, for benchmarking.
+
+The generated notebook looks like a real document root:
+
+    <output_dir>/
+        notebook/                                   The document root.
+            index.md
+            2016_Copenhagen/
+                RS001_Initial_DNA_origami_folding/
+                    RS001.md                        Experiment document, with YFM and %pico% variables.
+                    RS001_analysis1.md              Additional documents.
+                    analysis.py
+                    data/RS001_run01.dat            Large data files (sparse, except for the first 64 kB).
+                RS002_.../
+            2017_Aarhus/
+                ...
+        templates/                                  Jinja templates, incl. a recursive navigation tree.
+            RS_experiment.jinja
+            index.jinja
+
+The content is generated from a seeded random number generator, so the same parameters always produce
+the same notebook (and benchmark results from different commits can be compared).
+
+Usage:
+    $ python benchmarks/notebook_generator.py /tmp/notebook --years 3 --experiments-per-year 100
+
+"""
+
+import os
+import random
+import datetime
+
+import click
+
+CITIES = ('Copenhagen', 'Aarhus', 'Pasadena', 'Boston', 'Munich', 'Cambridge')
+
+TITLE_WORDS = (
+    'DNA', 'origami', 'folding', 'annealing', 'ramp', 'gel', 'electrophoresis', 'AFM', 'TEM', 'imaging',
+    'PAINT', 'staple', 'purification', 'PEG', 'precipitation', 'ligation', 'PCR', 'Nanoimager', 'demo',
+    'HPLC', 'kinetics', 'titration', 'MgCl2', 'buffer', 'screen', 'yield', 'optimization', 'test', 'repeat',
+)
+
+WORDS = (
+    'sample', 'buffer', 'incubated', 'overnight', 'at', 'room', 'temperature', 'the', 'and', 'with', 'of',
+    'was', 'were', 'band', 'lane', 'gel', 'structure', 'yield', 'folded', 'aggregates', 'concentration',
+    'measured', 'nanodrop', 'absorbance', 'excess', 'staples', 'removed', 'by', 'filtration', 'spin',
+    'columns', 'image', 'analysis', 'shows', 'expected', 'shape', 'scaffold', 'mix', 'ratio', 'in', 'for',
+)
+
+EXPERIMENT_TEMPLATE = """\
+<!DOCTYPE html>
+{%- macro render_nodes(nodes) %}
+<ul>
+{%- for node in nodes %}
+<li><a href="{{ node.url_path }}">{{ node.name or node.fs_path.stem }}</a>{% if node.children %}{{ render_nodes(node.children) }}{% endif %}</li>
+{%- endfor %}
+</ul>
+{%- endmacro %}
+<html lang="en">
+<head>
+    <meta charset="utf-8" />
+    <title>{% if meta.title %}{{ meta.title }} | {% endif %}Zepto ELN</title>
+</head>
+<body>
+<nav id="navigation-tree">{{ render_nodes(navigation_tree or []) }}</nav>
+<header>
+    <h1>{{ meta.title }}</h1>
+    <p>{{ meta.expid }}, {{ meta.startdate }}, tags: {{ (meta.tags or [])|join(', ') }}</p>
+</header>
+<main>
+{{ content }}
+</main>
+</body>
+</html>
+"""
+
+INDEX_TEMPLATE = """\
+<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8" /><title>{{ meta.title }}</title></head>
+<body>
+<main>
+{{ content }}
+</main>
+</body>
+</html>
+"""
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _paragraph(rng):
+    sentences = [_words(rng, rng.randint(6, 18)).capitalize() + "." for _ in range(rng.randint(2, 6))]
+    return " ".join(sentences)
+
+
+def make_document(rng, expid, title, startdate, tags, paragraphs=20, template='RS_experiment'):
+    """ Return the text of an experiment document, with YFM, %pico% variables, lists, a table, and code.
+
+    Args:
+        rng: `random.Random` instance.
+        expid, title, startdate, tags: Metadata for the YFM.
+        paragraphs: The approximate number of paragraphs.
+        template: The template name given in the YFM.
+
+    Returns:
+        str
+    """
+    lines = [
+        "---",
+        f"title: {title}",
+        f"expid: {expid}",
+        "author: RS",
+        f"startdate: {startdate.isoformat()}",
+        f"tags: [{', '.join(tags)}]",
+        f"template: {template}",
+        "---",
+        "",
+        "# %meta.title%",
+        "",
+        "Experiment %meta.expid%, started %meta.startdate%, file %basename%.",
+        "",
+    ]
+    sections = ['Aim', 'Materials', 'Procedure', 'Results', 'Discussion', 'Conclusion']
+    per_section = max(paragraphs // len(sections), 1)
+    for section in sections:
+        lines += [f"## {section}", ""]
+        for _ in range(per_section):
+            lines += [_paragraph(rng), ""]
+        if section == 'Materials':
+            lines += ["| Reagent | Stock | Volume (ul) |", "|---|---|---|"]
+            lines += [f"| {rng.choice(WORDS)} | {rng.randint(1, 100)} uM | {rng.randint(1, 50)} |"
+                      for _ in range(rng.randint(4, 10))]
+            lines += [""]
+        elif section == 'Procedure':
+            lines += [f"{i}. {_words(rng, rng.randint(5, 12)).capitalize()}." for i in range(1, rng.randint(5, 12))]
+            lines += ["", "```python", "import numpy as np",
+                      f"yields = np.array([{', '.join(str(rng.randint(1, 99)) for _ in range(8))}])",
+                      "print(yields.mean())", "```", ""]
+        elif section == 'Results':
+            lines += [f"![Gel image, lane {i}](data/{expid}_gel{i}.png){{: .gel-image}}" for i in range(1, 3)]
+            lines += [""]
+    return "\n".join(lines) + "\n"
+
+
+def _write_data_file(path, size, rng):
+    """ Write a data file of `size` bytes; only the first 64 kB is written, the rest is a sparse hole. """
+    with open(path, 'wb') as fh:
+        fh.write(rng.getrandbits(8 * min(size, 2**16)).to_bytes(min(size, 2**16), 'little'))
+        fh.truncate(size)
+
+
+def generate_notebook(
+        output_dir, years=3, experiments_per_year=50, extra_documents=1, paragraphs=20,
+        data_files=1, data_file_size=2**20, first_year=2016, seed=0,
+):
+    """ Generate a synthetic notebook (document root and templates) in `output_dir`.
+
+    Args:
+        output_dir: Directory to create the notebook in; the document root is `<output_dir>/notebook`,
+            and the templates are in `<output_dir>/templates`.
+        years: Number of year folders, e.g. `2016_Copenhagen`.
+        experiments_per_year: Number of experiment folders per year folder, e.g. `RS001_Initial_DNA_origami`.
+        extra_documents: Number of additional Markdown documents in each experiment folder.
+        paragraphs: Approximate number of paragraphs per document.
+        data_files: Number of data files per experiment folder.
+        data_file_size: The size (bytes) of each data file.
+        first_year: The first year.
+        seed: Seed for the random number generator.
+
+    Returns:
+        dict with 'document_root', 'template_dir', 'documents' (list of Markdown files, relative to the
+        document root), 'pages' (URL paths of the experiment pages), 'abbreviations' (list of
+        (abbreviated path, expanded path) tuples, e.g. ('2016/RS001', '2016_Copenhagen/RS001_.../RS001')),
+        'data_files' (URL paths), and 'nbytes' (total size of the Markdown documents).
+    """
+    rng = random.Random(seed)
+    document_root = os.path.join(output_dir, 'notebook')
+    template_dir = os.path.join(output_dir, 'templates')
+    os.makedirs(document_root, exist_ok=True)
+    os.makedirs(template_dir, exist_ok=True)
+    with open(os.path.join(template_dir, 'RS_experiment.jinja'), 'w', encoding='utf-8') as fh:
+        fh.write(EXPERIMENT_TEMPLATE)
+    with open(os.path.join(template_dir, 'index.jinja'), 'w', encoding='utf-8') as fh:
+        fh.write(INDEX_TEMPLATE)
+
+    notebook = {
+        'document_root': document_root, 'template_dir': template_dir,
+        'documents': [], 'pages': [], 'abbreviations': [], 'data_files': [], 'nbytes': 0,
+    }
+
+    def write_document(relpath, text):
+        with open(os.path.join(document_root, relpath), 'w', encoding='utf-8') as fh:
+            fh.write(text)
+        notebook['documents'].append(relpath)
+        notebook['nbytes'] += len(text.encode('utf-8'))
+
+    write_document('index.md', "---\ntitle: Notebook\ntemplate: index\n---\n\n# %meta.title%\n\n"
+                   + _paragraph(rng) + "\n")
+    width = max(3, len(str(years * experiments_per_year)))
+    expnum = 0
+    for year in range(first_year, first_year + years):
+        year_dir = f"{year}_{CITIES[(year - first_year) % len(CITIES)]}"
+        for _ in range(experiments_per_year):
+            expnum += 1
+            expid = f"RS{expnum:0{width}d}"
+            title_words = rng.sample(TITLE_WORDS, rng.randint(2, 5))
+            exp_dir = f"{year_dir}/{expid}_{'_'.join(title_words)}"
+            os.makedirs(os.path.join(document_root, exp_dir, 'data'), exist_ok=True)
+            startdate = datetime.date(year, 1, 1) + datetime.timedelta(days=rng.randint(0, 364))
+            tags = rng.sample(TITLE_WORDS, 2)
+            title = f"{expid} {' '.join(title_words)}"
+            write_document(f"{exp_dir}/{expid}.md", make_document(rng, expid, title, startdate, tags, paragraphs))
+            for i in range(1, extra_documents + 1):
+                write_document(f"{exp_dir}/{expid}_analysis{i}.md", make_document(
+                    rng, expid, f"{title} - analysis {i}", startdate, tags, max(paragraphs // 2, 1)))
+            with open(os.path.join(document_root, exp_dir, 'analysis.py'), 'w', encoding='utf-8') as fh:
+                fh.write(f"# Analysis of {expid}\nimport numpy as np\n")
+            for i in range(1, data_files + 1):
+                data_file = f"{exp_dir}/data/{expid}_run{i:02d}.dat"
+                _write_data_file(os.path.join(document_root, data_file), data_file_size, rng)
+                notebook['data_files'].append(data_file)
+            notebook['pages'].append(f"{exp_dir}/{expid}")
+            notebook['abbreviations'].append((f"{year}/{expid}", f"{exp_dir}/{expid}"))
+    return notebook
+
+
+@click.command()
+@click.argument('output-dir', type=click.Path(file_okay=False))
+@click.option('--years', type=int, default=3, show_default=True, help="Number of year folders.")
+@click.option('--experiments-per-year', type=int, default=50, show_default=True)
+@click.option('--extra-documents', type=int, default=1, show_default=True,
+              help="Additional Markdown documents per experiment.")
+@click.option('--paragraphs', type=int, default=20, show_default=True, help="Paragraphs per document.")
+@click.option('--data-files', type=int, default=1, show_default=True, help="Data files per experiment.")
+@click.option('--data-file-size', type=int, default=2**20, show_default=True, help="Size of each data file (bytes).")
+@click.option('--seed', type=int, default=0, show_default=True)
+def cli(output_dir, years, experiments_per_year, extra_documents, paragraphs, data_files, data_file_size, seed):
+    """ Generate a synthetic notebook in OUTPUT_DIR. """
+    notebook = generate_notebook(
+        output_dir, years=years, experiments_per_year=experiments_per_year, extra_documents=extra_documents,
+        paragraphs=paragraphs, data_files=data_files, data_file_size=data_file_size, seed=seed)
+    print(f"Generated {len(notebook['documents'])} documents ({notebook['nbytes'] / 2**20:.1f} MiB) and "
+          f"{len(notebook['data_files'])} data files in {notebook['document_root']}")
+
+
+if __name__ == '__main__':
+    cli()
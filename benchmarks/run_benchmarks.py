@@ -0,0 +1,403 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Benchmark suite for Zepto ELN.
+
+Generates a synthetic notebook (see `notebook_generator.py`), then measures the main code paths:
+
+* `page_tree.*`: Building the navigation tree, with `get_page_tree_recursive()` and with the
+    (warm) `PageTreeIndex` used by the server.
+* `expand.*`: Abbreviated path expansion (e.g. `2016/RS001`), with `expand_abbreviated_path()` and with the
+    (warm) `CachedPathExpander` used by the server.
+* `yfm.*`: Parsing YAML front-matter with `parse_yfm()`, with and without the memoized YAML loading.
+* `compile.document`: Compiling a Markdown document (incl. pico substitution and template) with
+    `compile_markdown_document()`.
+* `serve.*`: End-to-end requests to `serve_file` through Flask's test client: compiling a page (cold cache),
+    cached pages, conditional (304) requests, abbreviation redirects, raw data files (full and range), and 404s.
+
+Results (per-operation timings: min, median, mean, p95, max) are written as JSON, together with the git commit,
+Python version, and the notebook parameters, so results from different commits can be compared:
+
+    $ python benchmarks/run_benchmarks.py --scale small -o before.json
+    $ git checkout <other commit>
+    $ python benchmarks/run_benchmarks.py --scale small -o after.json --compare before.json
+
+The benchmarks run against the `zepto_eln` package in this checkout (not an installed version).
+A tiny notebook is benchmarked (one pass, no timing checks) by the test suite, in `tests/test_benchmarks.py`,
+so the benchmarks keep working as the code changes.
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import platform
+import tempfile
+import datetime
+import statistics
+import subprocess
+
+import click
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from notebook_generator import generate_notebook  # noqa: E402 (sys.path must be set first)
+
+RESULTS_FORMAT = 1
+
+# Notebook size presets (parameters for `generate_notebook()`):
+SCALES = {
+    'small': {'years': 2, 'experiments_per_year': 25, 'paragraphs': 10, 'data_file_size': 2**20},
+    'medium': {'years': 4, 'experiments_per_year': 100, 'paragraphs': 20, 'data_file_size': 16 * 2**20},
+    'large': {'years': 10, 'experiments_per_year': 250, 'paragraphs': 40, 'data_file_size': 256 * 2**20},
+}
+
+# Navigation tree options used by the benchmarks; like the server's default, but including all year folders:
+TREE_OPTIONS = {'depth': 4, 'include_files': ['*.md'], 'include_dirs': ['[0-9][0-9][0-9][0-9]_*']}
+
+# Maximum number of distinct inputs (documents, paths) per benchmark, to bound the run time on large notebooks:
+MAX_SAMPLES = 50
+
+BENCHMARKS = {}  # name -> function(notebook) -> Case
+
+
+class Case:
+    """ A benchmark case: a list of operations, each timed separately.
+
+    Args:
+        operations: List of functions (called without arguments) to time.
+        setup: Function called (untimed) before each operation, e.g. to clear a cache.
+        warmup: Run all operations once before timing them (e.g. to fill caches).
+    """
+
+    def __init__(self, operations, setup=None, warmup=True):
+        self.operations = operations
+        self.setup = setup
+        self.warmup = warmup
+
+
+def benchmark(name):
+    """ Decorator registering a benchmark function, which takes the notebook dict and returns a `Case`. """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _sample(items, n=MAX_SAMPLES):
+    """ Return up to `n` items, evenly spread over `items`. """
+    items = list(items)
+    if len(items) <= n:
+        return items
+    step = len(items) / n
+    return [items[int(i * step)] for i in range(n)]
+
+
+@benchmark('page_tree.recursive')
+def bench_page_tree_recursive(notebook):
+    from zepto_eln.eln_server.path_utils import get_page_tree_recursive
+    root = notebook['document_root']
+    return Case([lambda: get_page_tree_recursive(root, rel_root=root, **TREE_OPTIONS)], warmup=False)
+
+
+@benchmark('page_tree.index_warm')
+def bench_page_tree_index(notebook):
+    from zepto_eln.eln_server.page_tree_index import PageTreeIndex
+    from zepto_eln.eln_server.dir_listing_cache import DirectoryListingCache
+    from zepto_eln.eln_server import default_settings
+    root = notebook['document_root']
+    index = PageTreeIndex(
+        check_interval=default_settings.PAGE_TREE_CHECK_INTERVAL,
+        listing_cache=DirectoryListingCache(check_interval=default_settings.DIRECTORY_LISTING_CHECK_INTERVAL))
+    return Case([lambda: index.get_page_tree(root, rel_root=root, **TREE_OPTIONS)])
+
+
+@benchmark('expand.uncached')
+def bench_expand(notebook):
+    from zepto_eln.eln_server.path_utils import expand_abbreviated_path
+    root = notebook['document_root']
+    return Case([(lambda abbrev=abbrev: expand_abbreviated_path(abbrev, root))
+                 for abbrev, _ in _sample(notebook['abbreviations'])], warmup=False)
+
+
+@benchmark('expand.cached')
+def bench_expand_cached(notebook):
+    from zepto_eln.eln_server.path_utils import CachedPathExpander
+    root = notebook['document_root']
+    expander = CachedPathExpander()
+    return Case([(lambda abbrev=abbrev: expander.expand(abbrev, root))
+                 for abbrev, _ in _sample(notebook['abbreviations'])])
+
+
+def _read_documents(notebook):
+    documents = []
+    for relpath in _sample(notebook['documents']):
+        with open(os.path.join(notebook['document_root'], relpath), encoding='utf-8') as fh:
+            documents.append(fh.read())
+    return documents
+
+
+@benchmark('yfm.parse')
+def bench_parse_yfm(notebook):
+    from zepto_eln.md_utils import yfm
+    return Case([(lambda raw=raw: yfm.parse_yfm(raw)) for raw in _read_documents(notebook)],
+                setup=yfm._load_yfm_text.cache_clear, warmup=False)
+
+
+@benchmark('yfm.parse_memoized')
+def bench_parse_yfm_memoized(notebook):
+    from zepto_eln.md_utils import yfm
+    return Case([(lambda raw=raw: yfm.parse_yfm(raw)) for raw in _read_documents(notebook)])
+
+
+@benchmark('compile.document')
+def bench_compile_document(notebook):
+    from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
+    from zepto_eln.eln_server.path_utils import get_page_tree_recursive
+    root = notebook['document_root']
+    navigation_tree = get_page_tree_recursive(root, rel_root=root, **TREE_OPTIONS)['children']
+
+    def compile_page(path):
+        compile_markdown_document(
+            path, outputfn=False, template_dir=notebook['template_dir'],
+            template_vars={'navigation_tree': navigation_tree, 'request_path': '/', 'documents_root_url': '/'})
+
+    return Case([(lambda path=os.path.join(root, page + '.md'): compile_page(path))
+                 for page in _sample(notebook['pages'])])
+
+
+def _get_server_app(notebook):
+    """ Import the server app for the notebook (once; the app is configured when it is imported). """
+    os.environ['ZEPTO_ELN_DOCUMENT_ROOT'] = notebook['document_root'] + os.sep
+    os.environ['ZEPTO_ELN_TEMPLATE_DIR'] = notebook['template_dir']
+    from zepto_eln.eln_server import eln_server_app
+    from zepto_eln.md_utils.log_setup import configure_logging
+    configure_logging('WARNING')
+    eln_server_app.app.config['NAVIGATION_TREE_OPTIONS'] = TREE_OPTIONS
+    return eln_server_app
+
+
+def _get(client, url, headers=None, expected_status=200):
+    response = client.get(url, headers=headers)
+    response.get_data()  # Consume streamed responses (e.g. raw files).
+    response.close()
+    if response.status_code != expected_status:
+        raise RuntimeError(f"GET {url}: Expected status {expected_status}, got {response.status_code}.")
+    return response
+
+
+@benchmark('serve.page_compile')
+def bench_serve_page_compile(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    return Case([(lambda page=page: _get(client, '/' + page)) for page in _sample(notebook['pages'])],
+                setup=server.compiled_page_cache.invalidate)
+
+
+@benchmark('serve.page_cached')
+def bench_serve_page_cached(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    return Case([(lambda page=page: _get(client, '/' + page)) for page in _sample(notebook['pages'])])
+
+
+@benchmark('serve.page_not_modified')
+def bench_serve_page_not_modified(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    operations = []
+    for page in _sample(notebook['pages']):
+        etag = _get(client, '/' + page).headers.get('ETag')
+        if etag is None:
+            continue  # Conditional requests are disabled in the server settings.
+        operations.append(lambda page=page, etag=etag: _get(
+            client, '/' + page, headers={'If-None-Match': etag}, expected_status=304))
+    return Case(operations)
+
+
+@benchmark('serve.abbreviation_redirect')
+def bench_serve_redirect(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    return Case([(lambda abbrev=abbrev: _get(client, '/' + abbrev, expected_status=302))
+                 for abbrev, _ in _sample(notebook['abbreviations'])])
+
+
+@benchmark('serve.raw_file')
+def bench_serve_raw_file(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    return Case([(lambda path=path: _get(client, '/' + path))
+                 for path in _sample(notebook['data_files'], n=10)])
+
+
+@benchmark('serve.raw_file_range')
+def bench_serve_raw_file_range(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    headers = {'Range': 'bytes=1000-65535'}
+    return Case([(lambda path=path: _get(client, '/' + path, headers=headers, expected_status=206))
+                 for path in _sample(notebook['data_files'])])
+
+
+@benchmark('serve.not_found')
+def bench_serve_not_found(notebook):
+    server = _get_server_app(notebook)
+    client = server.app.test_client()
+    return Case([(lambda i=i: _get(client, f'/1999/RS{i}', expected_status=404)) for i in range(10)])
+
+
+def run_case(case, repeat):
+    """ Run a benchmark case, and return a dict with statistics of the operation durations (seconds). """
+    if case.warmup:
+        for operation in case.operations:
+            operation()
+    durations = []
+    for _ in range(repeat):
+        for operation in case.operations:
+            if case.setup is not None:
+                case.setup()
+            start = time.perf_counter()
+            operation()
+            durations.append(time.perf_counter() - start)
+    if not durations:
+        return {'n': 0}
+    durations.sort()
+    return {
+        'n': len(durations),
+        'min': durations[0],
+        'median': statistics.median(durations),
+        'mean': statistics.fmean(durations),
+        'p95': durations[min(int(0.95 * len(durations)), len(durations) - 1)],
+        'max': durations[-1],
+        'total': sum(durations),
+    }
+
+
+def get_git_info():
+    """ Return dict with the 'commit' and 'dirty' state of the checkout (None values if git is not available). """
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--', 'zepto_eln'))}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def run_benchmarks(notebook, names, repeat=5, echo=print):
+    """ Run the named benchmarks on the notebook, and return dict of name -> statistics. """
+    results = {}
+    for name in names:
+        case = BENCHMARKS[name](notebook)
+        results[name] = stats = run_case(case, repeat)
+        if stats['n']:
+            echo(f"{name:32} {stats['n']:6d} ops  median {stats['median'] * 1000:9.3f} ms"
+                 f"  p95 {stats['p95'] * 1000:9.3f} ms")
+        else:
+            echo(f"{name:32} (no operations)")
+    return results
+
+
+def compare_results(results, baseline, threshold=0.10, echo=print):
+    """ Print the change in median time for each benchmark in both `results` and `baseline`.
+
+    Returns:
+        List of names of benchmarks that got slower by more than `threshold` (fraction).
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base or not base.get('n') or not stats.get('n'):
+            continue
+        change = stats['median'] / base['median'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  improvement'
+        echo(f"{name:32} {base['median'] * 1000:9.3f} -> {stats['median'] * 1000:9.3f} ms  ({change:+7.1%}){flag}")
+    return regressions
+
+
+@click.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', show_default=True,
+              help="Size of the generated notebook.")
+@click.option('--years', type=int, help="Override the number of year folders of the scale preset.")
+@click.option('--experiments-per-year', type=int, help="Override the number of experiments per year.")
+@click.option('--repeat', '-r', type=int, default=5, show_default=True, help="Timed passes over each case.")
+@click.option('--only', '-k', 'patterns', multiple=True,
+              help="Only run benchmarks matching this glob pattern, e.g. 'serve.*' (can be given multiple times).")
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help="Write results to this JSON file (default: benchmarks/results/<timestamp>_<commit>.json).")
+@click.option('--compare', 'baseline_file', type=click.Path(exists=True, dir_okay=False),
+              help="Compare the results with a previous results file.")
+@click.option('--threshold', type=float, default=0.10, show_default=True,
+              help="Slow-down (fraction of the baseline median) reported as a regression.")
+@click.option('--workdir', type=click.Path(file_okay=False),
+              help="Generate the notebook here (and keep it); default is a temporary directory.")
+def cli(scale, years, experiments_per_year, repeat, patterns, output, baseline_file, threshold, workdir):
+    """ Run the benchmarks on a generated notebook and write the results as JSON. """
+    names = [name for name in BENCHMARKS if not patterns or any(fnmatch.fnmatch(name, pat) for pat in patterns)]
+    params = dict(SCALES[scale])
+    if years is not None:
+        params['years'] = years
+    if experiments_per_year is not None:
+        params['experiments_per_year'] = experiments_per_year
+    tmpdir = None
+    if workdir is None:
+        workdir = tmpdir = tempfile.mkdtemp(prefix='zepto_eln_bench_')
+    # Keep the server's lock files, template bytecode, etc. out of the user's cache directory:
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    try:
+        start = time.perf_counter()
+        notebook = generate_notebook(workdir, **params)
+        print(f"Generated {len(notebook['documents'])} documents and {len(notebook['data_files'])} data files"
+              f" in {time.perf_counter() - start:.1f} s.", file=sys.stderr)
+        results = run_benchmarks(notebook, names, repeat=repeat)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    git_info = get_git_info()
+    report = {
+        'format': RESULTS_FORMAT,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git': git_info,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'notebook': params,
+        'repeat': repeat,
+        'results': results,
+    }
+    if output is None:
+        commit = (git_info['commit'] or 'unknown')[:10] + ('-dirty' if git_info['dirty'] else '')
+        output = os.path.join(BENCHMARKS_DIR, 'results',
+                              f"{re.sub(r'[^0-9T]', '', report['timestamp'])}_{scale}_{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if baseline_file:
+        with open(baseline_file, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        if baseline.get('notebook') != params:
+            print("WARNING: The baseline was run on a notebook with different parameters.", file=sys.stderr)
+        print(f"\nMedian time per operation, compared to {baseline_file} "
+              f"({(baseline.get('git') or {}).get('commit')}):")
+        regressions = compare_results(results, baseline['results'], threshold=threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -48,6 +48,7 @@ setup(
         'console_scripts': [
             # console_scripts should all be lower-case, else you may get an error when uninstalling:
             # 'rsenv=rsenv.rsenv_cli:rsenv_cli',
+            'zepto-eln=zepto_eln.eln_cli.eln_cli:cli',
             # 'zepto-eln-server:zepto_eln.eln_server.eln_server_app:cli',
             # Edit: Use the flask runner to run the server app:
             #   $ activate <environment>
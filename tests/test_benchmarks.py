@@ -0,0 +1,57 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Smoke test for the benchmark suite (`benchmarks/`): Generate a tiny notebook and run every benchmark once,
+so the benchmarks keep working as the code they measure changes. This doesn't check any timings.
+
+The benchmarks are run in a subprocess, since the server app is configured (document root, template dir)
+when it is first imported.
+
+"""
+
+import os
+import sys
+import json
+import importlib.util
+import subprocess
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+
+
+def load_benchmark_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BENCHMARKS_DIR, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_notebook_generator_is_reproducible(tmp_path):
+    generate_notebook = load_benchmark_module('notebook_generator').generate_notebook
+    params = {'years': 2, 'experiments_per_year': 2, 'data_file_size': 2**10}
+    first = generate_notebook(str(tmp_path / 'first'), **params)
+    second = generate_notebook(str(tmp_path / 'second'), **params)
+    assert len(first['documents']) == 1 + 2 * 2 * 2  # index.md, and an experiment and an analysis document each.
+    assert first['abbreviations'][0] == ('2016/RS001', first['pages'][0])
+    for relpath in first['documents']:
+        with open(os.path.join(first['document_root'], relpath), encoding='utf-8') as fh1, \
+                open(os.path.join(second['document_root'], relpath), encoding='utf-8') as fh2:
+            assert fh1.read() == fh2.read()
+
+
+def test_run_benchmarks_smoke(tmp_path, monkeypatch):
+    output = tmp_path / 'results.json'
+    cmd = [sys.executable, os.path.join(BENCHMARKS_DIR, 'run_benchmarks.py'),
+           '--scale', 'small', '--years', '1', '--experiments-per-year', '3', '--repeat', '1',
+           '--workdir', str(tmp_path / 'work'), '-o', str(output)]
+    subprocess.run(cmd, check=True, capture_output=True, timeout=300)
+    results = json.loads(output.read_text(encoding='utf-8'))['results']
+    monkeypatch.syspath_prepend(BENCHMARKS_DIR)  # For `run_benchmarks`' import of `notebook_generator`.
+    names = load_benchmark_module('run_benchmarks').BENCHMARKS
+    assert sorted(results) == sorted(names)
+    assert all(stats['n'] > 0 for stats in results.values())
+    # Comparing with a baseline (here, the same results) reports no regressions:
+    completed = subprocess.run(cmd[:-2] + ['-o', str(tmp_path / 'again.json'), '--compare', str(output),
+                                           '--threshold', '1000'], capture_output=True, text=True, timeout=300)
+    assert completed.returncode == 0, completed.stderr
+    assert "REGRESSION" not in completed.stdout
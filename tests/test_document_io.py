@@ -0,0 +1,44 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for metadata-only document loading in `zepto_eln.md_utils.document_io`,
+which reads just the head of each document (up to the closing front-matter marker).
+
+"""
+
+from zepto_eln.md_utils.yfm import parse_yfm
+from zepto_eln.md_utils.document_io import (
+    read_document_head, load_document, load_document_metadata, load_all_documents_metadata)
+
+
+def test_read_document_head(tmp_path):
+    path = tmp_path / 'doc.md'
+    path.write_text("\n---\ntitle: Test\n---\n# Heading\n" + "Body\n" * 1000, encoding='utf-8')
+    assert read_document_head(str(path)) == "\n---\ntitle: Test\n---\n"
+
+
+def test_read_document_head_without_front_matter(tmp_path):
+    path = tmp_path / 'doc.md'
+    path.write_text("# Heading\n\n---\n\nBody\n", encoding='utf-8')
+    head = read_document_head(str(path))
+    assert head == "# Heading\n"
+    assert parse_yfm(head)[0] == {}
+
+
+def test_load_document_metadata_matches_load_document(tmp_path):
+    path = tmp_path / 'RS532.md'
+    path.write_text("---\ntitle: Test\nexpid: RS532\n---\n# Heading\n\n%meta.title%\n", encoding='utf-8')
+    assert load_document_metadata(str(path)) == load_document(str(path))['meta']
+    meta = load_document_metadata(str(path), add_fileinfo_to_meta=False)
+    assert (meta['title'], meta['expid'], meta['yfm_err']) == ('Test', 'RS532', None)
+
+
+def test_load_all_documents_metadata_finds_nested_documents(tmp_path):
+    nested = tmp_path / '2018_Aarhus' / 'RS532_Test'
+    nested.mkdir(parents=True)
+    (tmp_path / 'index.md').write_text("---\ntitle: Index\n---\n", encoding='utf-8')
+    (nested / 'RS532.md').write_text("---\ntitle: RS532\n---\n", encoding='utf-8')
+    (nested / 'notes.txt').write_text("---\ntitle: Not a document\n---\n", encoding='utf-8')
+    metadata = load_all_documents_metadata(str(tmp_path), add_fileinfo_to_meta=False)
+    assert sorted(meta['title'] for meta in metadata) == ['Index', 'RS532']
@@ -0,0 +1,97 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.fs_watcher`: the polling watcher's snapshot diff, subscriptions,
+and change events from a running watcher.
+
+"""
+
+import os
+import queue
+
+from zepto_eln.md_utils.fs_watcher import FileEvent, PollingWatcher, start_file_watcher
+
+
+def p(*parts):
+    return os.path.join('root', *parts)
+
+
+# Snapshot entries are (is_dir, mtime_ns, size, inode):
+OLD = {
+    p('2018'): (True, 100, 0, 1),
+    p('2018', 'RS532.md'): (False, 100, 10, 2),
+    p('2018', 'RS533.md'): (False, 100, 10, 3),
+    p('2018', 'data'): (True, 100, 0, 4),
+    p('2018', 'data', 'run1.dat'): (False, 100, 1000, 5),
+    p('index.md'): (False, 100, 10, 6),
+}
+
+
+def test_diff_unchanged():
+    assert PollingWatcher.diff(OLD, dict(OLD)) == []
+
+
+def test_diff_created_deleted_modified():
+    new = dict(OLD)
+    del new[p('index.md')]
+    new[p('2018', 'RS534.md')] = (False, 200, 10, 7)
+    new[p('2018', 'RS532.md')] = (False, 200, 10, 2)  # mtime changed.
+    new[p('2018', 'RS533.md')] = (False, 100, 20, 3)  # size changed.
+    new[p('2018')] = (True, 200, 0, 1)  # Directory mtime changes are not reported.
+    assert PollingWatcher.diff(OLD, new) == [
+        FileEvent('deleted', p('index.md'), False),
+        FileEvent('created', p('2018', 'RS534.md'), False),
+        FileEvent('modified', p('2018', 'RS532.md'), False),
+        FileEvent('modified', p('2018', 'RS533.md'), False),
+    ]
+
+
+def test_diff_moved_file():
+    new = dict(OLD)
+    new[p('2018', 'RS532_renamed.md')] = new.pop(p('2018', 'RS532.md'))
+    assert PollingWatcher.diff(OLD, new) == [
+        FileEvent('moved', p('2018', 'RS532.md'), False, p('2018', 'RS532_renamed.md'))]
+
+
+def test_diff_moved_directory_is_a_single_event():
+    new = dict(OLD)
+    new[p('2018', 'raw_data')] = new.pop(p('2018', 'data'))
+    new[p('2018', 'raw_data', 'run1.dat')] = new.pop(p('2018', 'data', 'run1.dat'))
+    assert PollingWatcher.diff(OLD, new) == [
+        FileEvent('moved', p('2018', 'data'), True, p('2018', 'raw_data'))]
+
+
+def test_scan_excludes_hidden_entries(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'RS532.md').write_text("x")
+    (tmp_path / '.git').mkdir()
+    (tmp_path / '.git' / 'HEAD').write_text("x")
+    (tmp_path / 'sub' / '.RS532.md.tmp').write_text("x")
+    snapshot = PollingWatcher(str(tmp_path)).scan()
+    assert sorted(snapshot) == [str(tmp_path / 'sub'), str(tmp_path / 'sub' / 'RS532.md')]
+    assert snapshot[str(tmp_path / 'sub')][0] is True
+
+
+def test_subscription_patterns():
+    watcher = PollingWatcher('root')
+    md_events, file_events = [], []
+    watcher.subscribe(md_events.append, patterns=['*.md'])
+    watcher.subscribe(file_events.append, include_dirs=False)
+    events = [FileEvent('modified', p('index.md'), False), FileEvent('created', p('data.bin'), False),
+              FileEvent('moved', p('a.txt'), False, p('a.md')), FileEvent('deleted', p('2018'), True)]
+    for event in events:
+        watcher.publish(event)
+    assert md_events == [events[0], events[2], events[3]]
+    assert file_events == events[:3]
+
+
+def test_polling_watcher_publishes_events(tmp_path):
+    events = queue.Queue()
+    watcher = start_file_watcher(str(tmp_path), backend='polling', poll_interval=0.01)
+    try:
+        watcher.subscribe(events.put)
+        (tmp_path / 'RS532.md').write_text("x")
+        assert events.get(timeout=10) == FileEvent('created', str(tmp_path / 'RS532.md'), False)
+    finally:
+        watcher.stop()
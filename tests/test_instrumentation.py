@@ -0,0 +1,153 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.instrumentation`: histogram buckets, per-request timings
+(`timed`, `RequestTimer`, Server-Timing header), the slow-request log, counters,
+and the Prometheus text format.
+
+"""
+
+import io
+import threading
+
+from zepto_eln.md_utils import instrumentation
+from zepto_eln.md_utils.instrumentation import (
+    Counter, Histogram, Labeled, RequestTimer, SlowRequestLog, Timings, timed, format_prometheus)
+
+
+def test_histogram_buckets_are_cumulative_and_inclusive():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 1.0, 5.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    # Bucket upper bounds are inclusive (`le`), and the +Inf bucket counts everything:
+    assert snapshot['buckets'] == [(0.1, 2), (1.0, 4), (float('inf'), 5)]
+    assert snapshot['count'] == 5
+    assert snapshot['sum'] == 6.65
+
+
+def test_histogram_quantile():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.05,) * 9 + (0.5,):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.95) == 1.0
+
+
+def test_histogram_sums_across_threads():
+    histogram = Histogram(buckets=(1.0,))
+    threads = [threading.Thread(target=lambda: [histogram.observe(0.5) for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.snapshot()['buckets'] == [(1.0, 4000), (float('inf'), 4000)]
+
+
+def test_labeled_creates_one_metric_per_label():
+    labeled = Labeled(Histogram)
+    assert labeled.get('read') is labeled.get('read')
+    labeled.get('yfm')
+    assert [label for label, _ in labeled.items()] == ['read', 'yfm']
+
+
+def test_timed_outside_request_is_a_noop():
+    assert instrumentation.get_current_timings() is None
+    with timed('read'):
+        pass
+
+
+def test_request_timer(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'STAGE_DURATIONS', Labeled(Histogram))
+    timer = RequestTimer()
+    timings = timer.start()
+    assert instrumentation.get_current_timings() is timings
+    for _ in range(2):
+        with timed('read'):
+            pass
+    with timed('markdown'):
+        pass
+    assert timer.finish() is timings
+    assert instrumentation.get_current_timings() is None
+    assert list(timings.stages) == ['read', 'markdown']
+    assert timings.total >= sum(timings.stages.values())
+    assert {stage: h.snapshot()['count'] for stage, h in instrumentation.STAGE_DURATIONS.items()} == {
+        'markdown': 1, 'read': 1, 'total': 1}
+
+
+def test_server_timing_header():
+    timings = Timings()
+    timings.add('read', 0.0012)
+    timings.add('read', 0.0003)
+    timings.total = 0.01
+    assert timings.server_timing() == "read;dur=1.50, total;dur=10.00"
+    assert timings.format() == "total=10.0ms read=1.5ms"
+
+
+def test_slow_request_log():
+    stream = io.StringIO()
+    log = SlowRequestLog(threshold=0.5, stream=stream)
+    fast, slow = Timings(), Timings()
+    fast.total, slow.total = 0.1, 0.75
+    assert not log.log('GET', '/fast', 200, fast)
+    assert log.log('GET', '/slow', 200, slow)
+    assert log.count == 1
+    assert stream.getvalue().endswith(" SLOW GET /slow 200 total=750.0ms\n")
+
+
+def test_counter_sums_across_threads():
+    counter = Counter()
+    threads = [threading.Thread(target=lambda: [counter.inc(2) for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.value() == 8000
+
+
+def test_format_prometheus_counter_and_gauge():
+    counter = Counter()
+    counter.inc(3)
+    text = format_prometheus([
+        ('zepto_requests_total', 'counter', "Number of requests.", counter, None),
+        ('zepto_cache_bytes', 'gauge', "Bytes in cache.", 1.5, None),
+    ])
+    assert text == (
+        "# HELP zepto_requests_total Number of requests.\n"
+        "# TYPE zepto_requests_total counter\n"
+        "zepto_requests_total 3\n"
+        "# HELP zepto_cache_bytes Bytes in cache.\n"
+        "# TYPE zepto_cache_bytes gauge\n"
+        "zepto_cache_bytes 1.5\n"
+    )
+
+
+def test_format_prometheus_labeled_histogram():
+    durations = Labeled(lambda: Histogram(buckets=(0.5,)))
+    durations.get('markdown').observe(0.25)
+    durations.get('compile "x"').observe(2.0)
+    lines = format_prometheus([
+        ('zepto_stage_seconds', 'histogram', "Stage durations.", durations, 'stage'),
+    ]).splitlines()
+    assert lines == [
+        '# HELP zepto_stage_seconds Stage durations.',
+        '# TYPE zepto_stage_seconds histogram',
+        'zepto_stage_seconds_bucket{stage="compile \\"x\\"",le="0.5"} 0',
+        'zepto_stage_seconds_bucket{stage="compile \\"x\\"",le="+Inf"} 1',
+        'zepto_stage_seconds_sum{stage="compile \\"x\\""} 2',
+        'zepto_stage_seconds_count{stage="compile \\"x\\""} 1',
+        'zepto_stage_seconds_bucket{stage="markdown",le="0.5"} 1',
+        'zepto_stage_seconds_bucket{stage="markdown",le="+Inf"} 1',
+        'zepto_stage_seconds_sum{stage="markdown"} 0.25',
+        'zepto_stage_seconds_count{stage="markdown"} 1',
+    ]
+
+
+def test_format_prometheus_dict_of_counters():
+    counters = {'page': Counter(), 'raw': Counter()}
+    counters['raw'].inc()
+    text = format_prometheus([('zepto_route_total', 'counter', "Requests per route.", counters, 'route')])
+    assert 'zepto_route_total{route="page"} 0\n' in text
+    assert 'zepto_route_total{route="raw"} 1\n' in text
@@ -0,0 +1,94 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.metadata_index.MetadataIndex`: incremental updates, lookups,
+persistence, and background updates.
+
+"""
+
+import os
+import time
+
+import pytest
+
+from zepto_eln.md_utils.metadata_index import MetadataIndex
+
+
+def write_document(path, text, mtime_ns=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def basedir(tmp_path):
+    root = tmp_path / 'root'
+    write_document(str(root / '2018_Aarhus' / 'RS532_Test' / 'RS532.md'),
+                   "---\nexpid: RS532\ntags: [DNA, AFM]\n---\n", mtime_ns=2 * 10**18)
+    write_document(str(root / '2018_Aarhus' / 'RS532_Test' / 'RS532_analysis.md'),
+                   "---\nexpid: RS532\n---\n", mtime_ns=10**18)
+    write_document(str(root / 'index.md'), "# No front matter\n")
+    return str(root)
+
+
+@pytest.fixture
+def index(basedir, tmp_path):
+    index = MetadataIndex(basedir, index_file=str(tmp_path / 'index.sqlite'))
+    yield index
+    index.close()
+
+
+def test_update_and_lookup(index):
+    stats = index.update()
+    assert (stats['added_or_changed'], stats['removed']) == (3, 0)
+    assert len(index) == 3
+    # Most recently modified first:
+    assert index.lookup('expid', 'RS532') == [
+        '2018_Aarhus/RS532_Test/RS532.md', '2018_Aarhus/RS532_Test/RS532_analysis.md']
+    assert index.lookup('expid', 'rs532') == index.lookup('expid', 'RS532')  # Case-insensitive.
+    assert index.lookup('tags', 'afm') == ['2018_Aarhus/RS532_Test/RS532.md']
+    assert index.lookup('expid', 'RS999') == []
+
+
+def test_incremental_update(index, basedir):
+    index.update()
+    assert index.update()['added_or_changed'] == 0
+    write_document(os.path.join(basedir, '2018_Aarhus', 'RS532_Test', 'RS532_analysis.md'),
+                   "---\nexpid: RS533\n---\n", mtime_ns=3 * 10**18)
+    write_document(os.path.join(basedir, '2019', 'RS600.md'), "---\nexpid: RS600\n---\n")
+    os.remove(os.path.join(basedir, '2018_Aarhus', 'RS532_Test', 'RS532.md'))
+    stats = index.update()
+    assert (stats['added_or_changed'], stats['removed']) == (2, 1)
+    assert index.lookup('expid', 'RS532') == []
+    assert index.lookup('tags', 'DNA') == []
+    assert index.lookup('expid', 'RS533') == ['2018_Aarhus/RS532_Test/RS532_analysis.md']
+    assert index.lookup('expid', 'RS600') == ['2019/RS600.md']
+
+
+def test_index_is_persistent(index, basedir, tmp_path):
+    index.update()
+    reopened = MetadataIndex(basedir, index_file=str(tmp_path / 'index.sqlite'))
+    try:
+        assert reopened.lookup('expid', 'RS532')
+        assert reopened.update()['added_or_changed'] == 0
+    finally:
+        reopened.close()
+
+
+def test_update_if_stale(index):
+    assert index.update_if_stale(max_age=60) is not None
+    assert index.update_if_stale(max_age=60) is None
+
+
+def test_schedule_update(index, basedir):
+    index.update()
+    write_document(os.path.join(basedir, '2019', 'RS600.md'), "---\nexpid: RS600\n---\n")
+    index.schedule_update(min_interval=60)  # Updated less than 60 s ago; does nothing.
+    index.schedule_update()
+    deadline = time.monotonic() + 10
+    while not index.lookup('expid', 'RS600') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.lookup('expid', 'RS600') == ['2019/RS600.md']
@@ -0,0 +1,77 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.output_writer`: write-if-changed, atomic writes, and the background writer.
+
+"""
+
+import os
+import stat
+
+import pytest
+
+from zepto_eln.md_utils.output_writer import BackgroundWriter, write_if_changed, write_output_file
+from zepto_eln.md_utils.instrumentation import OUTPUT_FILES_WRITTEN
+
+
+def test_write_if_changed(tmp_path):
+    path = str(tmp_path / 'page.html')
+    assert write_if_changed(path, "<p>one</p>")
+    inode = os.stat(path).st_ino
+    assert not write_if_changed(path, "<p>one</p>")
+    assert os.stat(path).st_ino == inode  # Not rewritten.
+    assert write_if_changed(path, "<p>two</p>")
+    assert open(path, encoding='utf-8').read() == "<p>two</p>"
+    assert write_if_changed(path, "<p>two</p>", force=True)
+
+
+def test_unchanged_file_is_touched(tmp_path):
+    path = str(tmp_path / 'page.html')
+    write_if_changed(path, "<p>one</p>")
+    os.utime(path, ns=(10**9, 10**9))
+    assert not write_if_changed(path, "<p>one</p>")
+    assert os.stat(path).st_mtime_ns > 10**9
+    os.utime(path, ns=(10**9, 10**9))
+    assert not write_if_changed(path, "<p>one</p>", touch=False)
+    assert os.stat(path).st_mtime_ns == 10**9
+
+
+def test_file_changed_by_someone_else_is_rewritten(tmp_path):
+    path = str(tmp_path / 'page.html')
+    write_if_changed(path, "<p>one</p>")
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write("<p>two</p>")  # Same size, different content.
+    os.utime(path, ns=(10**9, 10**9))
+    assert write_if_changed(path, "<p>one</p>")
+    assert open(path, encoding='utf-8').read() == "<p>one</p>"
+
+
+def test_atomic_write_keeps_permissions_and_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / 'page.html')
+    write_if_changed(path, "<p>one</p>")
+    os.chmod(path, 0o640)
+    write_if_changed(path, "<p>two</p>")
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(tmp_path) == ['page.html']
+
+
+def test_background_writer_coalesces_writes(tmp_path):
+    path = str(tmp_path / 'page.html')
+    writer = BackgroundWriter(delay=60)
+    written_before = OUTPUT_FILES_WRITTEN.value()
+    writer.submit(path, "<p>one</p>")
+    writer.submit(path, "<p>two</p>")
+    assert not os.path.exists(path)  # Delayed...
+    assert writer.flush(timeout=10)  # ...until flushed.
+    assert open(path, encoding='utf-8').read() == "<p>two</p>"
+    assert OUTPUT_FILES_WRITTEN.value() - written_before == 1
+
+
+def test_write_output_file_policies(tmp_path):
+    path = str(tmp_path / 'page.html')
+    assert write_output_file(path, "<p>one</p>", write_policy='if-changed')
+    assert not write_output_file(path, "<p>one</p>", write_policy='if-changed')
+    assert write_output_file(path, "<p>one</p>", write_policy='always')
+    with pytest.raises(ValueError):
+        write_output_file(path, "<p>one</p>", write_policy='sometimes')
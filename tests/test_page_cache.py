@@ -0,0 +1,145 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.eln_server.page_cache.CompiledPageCache`: validation against the page's sources,
+the LRU byte budget, the bounded dependency records, and the on-disk `.html` cache.
+
+"""
+
+import os
+import sys
+
+import pytest
+
+from zepto_eln.eln_server.page_cache import CompiledPageCache
+
+
+def set_mtime(path, mtime_ns):
+    # Set the mtime explicitly, so the tests don't depend on the filesystem's timestamp resolution:
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = []
+    for name in ('a', 'b', 'c'):
+        path = tmp_path / f'{name}.md'
+        path.write_text(f"# {name}\n", encoding='utf-8')
+        paths.append(str(path))
+    template = tmp_path / 'page.jinja'
+    template.write_text("{{ content }}", encoding='utf-8')
+    return paths, str(template)
+
+
+def test_get_and_put(sources):
+    (a, b, _), template = sources
+    cache = CompiledPageCache()
+    assert cache.get(a) is None
+    cache.put(a, "<p>a</p>", [a, template])
+    assert cache.get(a) == "<p>a</p>"
+    assert cache.get(b) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entry_is_invalidated_by_changed_dependency(sources):
+    (a, _, _), template = sources
+    cache = CompiledPageCache()
+    cache.put(a, "<p>a</p>", [a, template])
+    set_mtime(template, 10**18)
+    assert cache.get(a) is None
+    assert len(cache) == 0
+    cache.put(a, "<p>a</p>", [a, template])
+    with open(a, 'a', encoding='utf-8') as fh:
+        fh.write("More text.\n")
+    assert cache.get(a) is None
+
+
+def test_entry_is_invalidated_by_tree_version(sources):
+    (a, b, _), template = sources
+    cache = CompiledPageCache()
+    cache.put(a, "<p>a</p>", [a], tree_version=1)
+    cache.put(b, "<p>b</p>", [b], tree_version=None)  # Doesn't embed the navigation tree.
+    assert cache.get(a, tree_version=1) == "<p>a</p>"
+    assert cache.get(a, tree_version=2) is None
+    assert cache.get(b, tree_version=2) == "<p>b</p>"
+
+
+def test_byte_budget_evicts_least_recently_used(sources):
+    (a, b, c), _ = sources
+    html = "x" * 1000
+    cache = CompiledPageCache(max_bytes=2 * sys.getsizeof(html))
+    cache.put(a, html, [a])
+    cache.put(b, html, [b])
+    cache.get(a)  # a is now more recently used than b.
+    cache.put(c, html, [c])
+    assert cache.get(b) is None
+    assert cache.get(a) == html and cache.get(c) == html
+    assert cache.nbytes <= cache.max_bytes
+    assert cache.evictions == 1
+
+
+def test_page_larger_than_budget_is_not_cached(sources):
+    (a, _, _), _ = sources
+    cache = CompiledPageCache(max_bytes=100)
+    cache.put(a, "x" * 1000, [a])
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_records_outlive_entries_but_are_bounded(sources):
+    (a, b, c), template = sources
+    cache = CompiledPageCache(max_bytes=sys.getsizeof(""), max_records=2)  # Room for a single page.
+    cache.put(a, "", [a, template], tree_version=3)
+    cache.put(b, "", [b])
+    assert cache.get(a) is None  # Evicted...
+    dependencies, uses_tree = cache.get_dependencies(a)  # ...but the record is kept.
+    assert set(dependencies) == {a, template} and uses_tree
+    cache.get_dependencies(a)  # a is now more recently used than b.
+    cache.put(c, "", [c])
+    assert cache.stats()['records'] == 2
+    assert cache.get_dependencies(b) is None
+    assert cache.get_dependencies(a) is not None
+    set_mtime(template, 10**18)
+    assert cache.get_dependencies(a) is None
+
+
+def test_disk_cache(sources):
+    (a, _, _), _ = sources
+    cache = CompiledPageCache(use_disk_cache=True)
+    html_file = cache.get_html_file(a)
+    assert html_file == os.path.splitext(a)[0] + '.html'
+    with open(html_file, 'w', encoding='utf-8') as fh:
+        fh.write("<p>from disk</p>")
+    set_mtime(a, 10**18)
+    set_mtime(html_file, 2 * 10**18)
+    assert cache.get(a) == "<p>from disk</p>"
+    assert cache.get(a, newer_than=lambda: 3e9) is None  # E.g. a template changed after the html was written.
+    set_mtime(a, 3 * 10**18)
+    assert cache.get(a) is None
+    assert cache.disk_hits == 1
+
+
+def test_invalidate_dependents(sources):
+    (a, b, c), template = sources
+    cache = CompiledPageCache()
+    cache.put(a, "<p>a</p>", [a, template])
+    cache.put(b, "<p>b</p>", [b, template])
+    cache.put(c, "<p>c</p>", [c])
+    assert cache.get_dependents(template) == sorted([a, b])
+    assert cache.invalidate_dependents(template) == 2
+    assert cache.get(a) is None and cache.get(b) is None
+    assert cache.get(c) == "<p>c</p>"
+    assert cache.get_dependents(template) == []
+    assert cache.invalidate_dependents(template) == 0
+
+
+def test_invalidate(sources):
+    (a, b, _), template = sources
+    cache = CompiledPageCache()
+    cache.put(a, "<p>a</p>", [a, template])
+    cache.put(b, "<p>b</p>", [b, template])
+    cache.invalidate(a)
+    assert cache.get(a) is None and cache.get_dependencies(a) is None
+    assert cache.get_dependents(template) == [b]
+    cache.invalidate()
+    assert len(cache) == 0 and cache.nbytes == 0 and cache.get_dependents(template) == []
@@ -0,0 +1,67 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.eln_server.path_utils.CachedPathExpander`: abbreviated path expansion,
+and invalidation of memoized expansions (and misses) when directories change.
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.eln_server.dir_listing_cache import DirectoryListingCache
+from zepto_eln.eln_server.path_utils import CachedPathExpander
+
+
+def touch_dir(path, mtime_ns):
+    # Set the directory mtime explicitly, so the test doesn't depend on the filesystem's timestamp resolution:
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def root(tmp_path):
+    exp_dir = tmp_path / '2018_Aarhus' / 'RS532_Test_experiment'
+    exp_dir.mkdir(parents=True)
+    (exp_dir / 'RS532.md').write_text("---\nexpid: RS532\n---\n")
+    return str(tmp_path)
+
+
+def test_expand(root):
+    expander = CachedPathExpander(DirectoryListingCache(check_interval=0))
+    assert expander.expand('2018/RS532', root=root) == '2018_Aarhus/RS532_Test_experiment/RS532'
+    assert expander.expand('2018/RS532', root=root) == '2018_Aarhus/RS532_Test_experiment/RS532'
+    assert (expander.hits, expander.misses) == (1, 1)
+
+
+def test_memoized_expansion_is_invalidated_when_directory_changes(root):
+    expander = CachedPathExpander(DirectoryListingCache(check_interval=0))
+    assert expander.expand('2018/RS5', root=root) == '2018_Aarhus/RS532_Test_experiment/RS532'
+    # A new year folder that sorts first changes the expansion of '2018':
+    os.mkdir(os.path.join(root, '2018_Aaa'))
+    touch_dir(root, 10**18)
+    with pytest.raises(RuntimeError):
+        expander.expand('2018/RS5', root=root)
+    assert expander.hits == 0
+
+
+def test_memoized_miss_is_invalidated_when_directory_changes(root):
+    expander = CachedPathExpander(DirectoryListingCache(check_interval=0))
+    with pytest.raises(RuntimeError):
+        expander.expand('2019/RS600', root=root)
+    with pytest.raises(RuntimeError):
+        expander.expand('2019/RS600', root=root)
+    assert expander.hits == 1
+    exp_dir = os.path.join(root, '2019_Pasadena', 'RS600_New')
+    os.makedirs(exp_dir)
+    open(os.path.join(exp_dir, 'RS600.md'), 'w').close()
+    touch_dir(root, 10**18)
+    assert expander.expand('2019/RS600', root=root) == '2019_Pasadena/RS600_New/RS600'
+
+
+def test_memo_size_is_bounded(root):
+    expander = CachedPathExpander(DirectoryListingCache(check_interval=0), memo_size=2)
+    for path in ('2018/RS532', '2018/RS5', '2018_Aarhus/RS5', '2018/RS532_Test_experiment'):
+        expander.expand(path, root=root)
+    assert len(expander._memo) == 2
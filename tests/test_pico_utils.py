@@ -0,0 +1,58 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.pico_utils.substitute_pico_variables` (single-pass %variable% substitution).
+
+"""
+
+import pytest
+
+from zepto_eln.md_utils.pico_utils import substitute_pico_variables
+
+
+class CountingDict(dict):
+    """ dict counting the number of lookups of each key. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = {}
+
+    def __getitem__(self, key):
+        self.lookups[key] = self.lookups.get(key, 0) + 1
+        return super().__getitem__(key)
+
+
+def test_substitute():
+    template_vars = {'meta': {'title': 'Folding', 'expid': 'RS532'}, 'basename': 'RS532.md'}
+    content = "# %meta.title%\n\n%meta.expid% (%basename%): %meta.title% again.\n"
+    assert substitute_pico_variables(content, template_vars) == (
+        "# Folding\n\nRS532 (RS532.md): Folding again.\n")
+
+
+def test_each_placeholder_is_resolved_once():
+    template_vars = CountingDict(meta={'expid': 'RS532'}, basename='RS532.md')
+    substitute_pico_variables("%meta.expid% " * 100 + "%basename% %basename%", template_vars)
+    assert template_vars.lookups == {'meta': 1, 'basename': 1}
+
+
+def test_substituted_values_are_not_substituted_again():
+    template_vars = {'meta': {'title': '%meta.expid%', 'expid': 'RS532'}}
+    assert substitute_pico_variables("%meta.title%", template_vars) == "%meta.expid%"
+
+
+def test_unresolved_placeholders_are_left_as_is():
+    content = "100% sure that %meta.missing% and %nothing% stay, 50%."
+    assert substitute_pico_variables(content, {'meta': {}}) == content
+    assert substitute_pico_variables(content, {'meta': {}}, errors='log') == content
+    with pytest.raises(KeyError):
+        substitute_pico_variables(content, {'meta': {}}, errors='raise')
+    with pytest.raises(ValueError):
+        substitute_pico_variables(content, {'meta': {}}, errors='ignore')
+
+
+def test_varfmt():
+    template_vars = {'meta': {'expid': 'RS532', 'tags': ['a', 'b']}}
+    assert substitute_pico_variables("%meta.expid%", template_vars, varfmt="<{sub}>") == "<RS532>"
+    varfmt = {'meta.tags': "{sub[0]}+{sub[1]}", 'meta.expid': "{var}"}
+    assert substitute_pico_variables("%meta.expid%: %meta.tags%", template_vars, varfmt=varfmt) == "RS532: a+b"
@@ -0,0 +1,119 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.eln_server.raw_files`: Range header parsing, range resolution, and
+conditional/range responses (206, multipart/byteranges, 416, If-Range).
+
+"""
+
+import pytest
+from werkzeug.http import http_date
+from werkzeug.test import EnvironBuilder
+
+from zepto_eln.eln_server.raw_files import parse_byte_ranges, resolve_ranges, send_raw_file
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('bytes=0-499', [(0, 500)]),
+    ('bytes=500-', [(500, None)]),
+    ('bytes=-100', [(-100, None)]),
+    ('bytes=900-999, 0-9', [(900, 1000), (0, 10)]),
+    ('BYTES = 1-2', [(1, 3)]),
+    ('items=0-10', None),
+    ('bytes=10-5', None),
+    ('bytes=-0', None),
+    ('bytes=a-b', None),
+    ('bytes=5', None),
+])
+def test_parse_byte_ranges(value, expected):
+    assert parse_byte_ranges(value) == expected
+
+
+def test_resolve_ranges_merges_and_clips():
+    byte_ranges = [(900, 2000), (-50, None), (0, 10), (10, 20), (5, 15)]
+    assert resolve_ranges(byte_ranges, 1024) == [(0, 20), (900, 1024)]
+    assert resolve_ranges([(2000, None)], 1024) == []
+    assert resolve_ranges([(-5000, None)], 1024) == [(0, 1024)]
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'data.bin'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def get(fs_path, headers=None):
+    environ = EnvironBuilder(path='/data.bin', headers=headers or {}).get_environ()
+    response = send_raw_file(fs_path, environ, chunk_size=100)
+    try:
+        return response, b''.join(response.response) if response.response else b''
+    finally:
+        response.close()
+
+
+def test_full_file(data_file):
+    response, body = get(data_file)
+    assert response.status_code == 200
+    assert body == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_not_modified(data_file):
+    response, _ = get(data_file)
+    response, body = get(data_file, {'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert body == b''
+
+
+def test_single_range(data_file):
+    response, body = get(data_file, {'Range': 'bytes=1000-'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 1000-1023/1024'
+    assert int(response.headers['Content-Length']) == len(body) == 24
+    assert body == DATA[1000:]
+
+
+def test_multiple_ranges(data_file):
+    response, body = get(data_file, {'Range': 'bytes=0-9,-10'})
+    assert response.status_code == 206
+    content_type = response.headers['Content-Type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1].encode()
+    assert int(response.headers['Content-Length']) == len(body)
+    assert body.endswith(b'\r\n--' + boundary + b'--\r\n')
+    parts = body.split(b'--' + boundary)
+    assert parts[0] == b''
+    assert parts[1] == (b'\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 0-9/1024\r\n\r\n'
+                        + DATA[:10] + b'\r\n')
+    assert parts[2] == (b'\r\nContent-Type: application/octet-stream\r\nContent-Range: bytes 1014-1023/1024\r\n\r\n'
+                        + DATA[-10:] + b'\r\n')
+
+
+def test_unsatisfiable_range(data_file):
+    response, body = get(data_file, {'Range': 'bytes=5000-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */1024'
+
+
+def test_malformed_range_sends_full_file(data_file):
+    response, body = get(data_file, {'Range': 'bytes=10-5'})
+    assert response.status_code == 200
+    assert body == DATA
+
+
+def test_if_range(data_file):
+    response, _ = get(data_file)
+    etag = response.headers['ETag']
+    response, body = get(data_file, {'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert body == DATA[:10]
+    # The file has changed since the client got its ETag; send the full (new) file:
+    response, body = get(data_file, {'Range': 'bytes=0-9', 'If-Range': '"stale-etag"'})
+    assert response.status_code == 200
+    assert body == DATA
+    response, body = get(data_file, {'Range': 'bytes=0-9', 'If-Range': http_date(0)})
+    assert response.status_code == 200
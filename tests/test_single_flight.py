@@ -0,0 +1,98 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.single_flight.SingleFlight` (coalescing concurrent calls for the same key).
+
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from zepto_eln.md_utils import single_flight
+from zepto_eln.md_utils.single_flight import SingleFlight
+from zepto_eln.eln_server import default_settings
+
+
+def test_concurrent_calls_are_coalesced():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def compile_page():
+        calls.append(1)
+        release.wait(10)
+        return "<p>page</p>"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, 'RS532.md', compile_page) for _ in range(8)]
+        while flight.calls < 8:
+            threading.Event().wait(0.001)
+        release.set()
+        results = [future.result(timeout=10) for future in futures]
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert {result for result, _ in results} == {"<p>page</p>"}
+    assert flight.stats() == {'calls': 8, 'shared': 7, 'lock_waits': 0}
+
+
+def test_exceptions_are_shared():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fail():
+        release.wait(10)
+        raise ValueError("Could not compile")
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flight.do, 'RS532.md', fail) for _ in range(4)]
+        while flight.calls < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=10)
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('a', lambda: 2) == (2, False)
+    assert flight.do('b', lambda: 3) == (3, False)
+    assert flight.stats()['shared'] == 0
+
+
+def test_no_lock_files_by_default(tmp_path, monkeypatch):
+    # Single-process servers only coalesce within the process; lock files are opt-in:
+    assert default_settings.COMPILE_LOCK_DIR is None
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    flight = SingleFlight()
+    flight.do('RS532.md', lambda: 1)
+    assert os.listdir(tmp_path) == []
+
+
+def test_lock_files_are_bounded(tmp_path):
+    lock_dir = tmp_path / 'locks'
+    flight = SingleFlight(lock_dir=str(lock_dir), lock_stripes=4)
+    for i in range(100):
+        assert flight.do(f'page{i}.md', lambda: i) == (i, False)
+    assert 0 < len(os.listdir(lock_dir)) <= 4
+    assert flight.get_lock_file('page1.md') == flight.get_lock_file('page1.md')
+
+
+@pytest.mark.skipif(single_flight.fcntl is None, reason="Requires fcntl.flock")
+def test_after_wait_is_used_when_lock_was_held(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    # Another process (simulated by a separate open file description) holds the key's lock file:
+    fd = os.open(flight.get_lock_file('RS532.md'), os.O_RDWR | os.O_CREAT)
+    single_flight.fcntl.flock(fd, single_flight.fcntl.LOCK_EX)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(flight.do, 'RS532.md', lambda: "compiled", after_wait=lambda: "from disk")
+        threading.Event().wait(0.05)
+        assert not future.done()
+        single_flight.fcntl.flock(fd, single_flight.fcntl.LOCK_UN)
+        os.close(fd)
+        assert future.result(timeout=10) == ("from disk", False)
+    assert flight.stats()['lock_waits'] == 1
+    # Without waiting, `func` is called:
+    assert flight.do('RS532.md', lambda: "compiled", after_wait=lambda: "from disk") == ("compiled", False)
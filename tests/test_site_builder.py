@@ -0,0 +1,119 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.site_builder.build_site` (incremental static site builds using the build
+manifest), and the `zepto-eln build` command.
+
+"""
+
+import os
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from zepto_eln.md_utils.site_builder import build_site
+from zepto_eln.eln_cli.eln_cli import cli
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / 'root'
+    (root / '2018_Aarhus').mkdir(parents=True)
+    (root / 'index.md').write_text("---\ntitle: Index\n---\n# %meta.title%\n", encoding='utf-8')
+    (root / '2018_Aarhus' / 'RS532.md').write_text(
+        "---\ntitle: RS532\ntemplate: experiment\n---\nText\n", encoding='utf-8')
+    templates = tmp_path / 'templates'
+    templates.mkdir()
+    (templates / 'index.jinja').write_text("index: {{ content }}", encoding='utf-8')
+    (templates / 'experiment.jinja').write_text("experiment: {{ meta.title }}", encoding='utf-8')
+    return {'root': str(root), 'templates': str(templates), 'manifest': str(tmp_path / 'manifest.json')}
+
+
+def build(site, **kwargs):
+    stats = build_site(site['root'], template_dir=site['templates'], manifest_file=site['manifest'],
+                       processes=1, **kwargs)
+    assert stats['errors'] == []
+    return stats
+
+
+def read(path):
+    with open(path, encoding='utf-8') as fh:
+        return fh.read()
+
+
+def test_build(site):
+    stats = build(site)
+    assert (stats['pages'], stats['compiled'], stats['skipped'], stats['written']) == (2, 2, 0, 2)
+    assert read(os.path.join(site['root'], 'index.html')) == "index: <h1>Index</h1>"
+    assert read(os.path.join(site['root'], '2018_Aarhus', 'RS532.html')) == "experiment: RS532"
+    manifest = json.loads(read(site['manifest']))
+    assert sorted(manifest['pages']) == ['2018_Aarhus/RS532.md', 'index.md']
+    assert sorted(manifest['templates']) == [
+        os.path.join(site['templates'], name) for name in ('experiment.jinja', 'index.jinja')]
+
+
+def test_incremental_build(site):
+    build(site)
+    stats = build(site)
+    assert (stats['compiled'], stats['skipped']) == (0, 2)
+    # Touched, but unchanged content:
+    source = os.path.join(site['root'], 'index.md')
+    os.utime(source, ns=(10**18, 10**18))
+    assert build(site)['compiled'] == 0
+    with open(source, 'a', encoding='utf-8') as fh:
+        fh.write("More text.\n")
+    assert build(site)['compiled'] == 1
+    assert build(site, force=True)['compiled'] == 2
+
+
+def test_template_change_rebuilds_dependent_pages(site):
+    build(site)
+    with open(os.path.join(site['templates'], 'experiment.jinja'), 'w', encoding='utf-8') as fh:
+        fh.write("changed: {{ meta.title }}")
+    stats = build(site)
+    assert (stats['compiled'], stats['skipped']) == (1, 1)
+    assert read(os.path.join(site['root'], '2018_Aarhus', 'RS532.html')) == "changed: RS532"
+
+
+def test_missing_output_is_rebuilt(site):
+    build(site)
+    os.remove(os.path.join(site['root'], 'index.html'))
+    assert build(site)['compiled'] == 1
+    assert os.path.isfile(os.path.join(site['root'], 'index.html'))
+
+
+def test_output_of_deleted_source_is_removed(site):
+    build(site, encodings=('gzip',))
+    assert os.path.isfile(os.path.join(site['root'], '2018_Aarhus', 'RS532.html.gz'))
+    os.remove(os.path.join(site['root'], '2018_Aarhus', 'RS532.md'))
+    stats = build(site, encodings=('gzip',))
+    assert (stats['pages'], stats['removed']) == (1, 1)
+    assert os.listdir(os.path.join(site['root'], '2018_Aarhus')) == []
+    assert sorted(json.loads(read(site['manifest']))['pages']) == ['index.md']
+
+
+def test_output_dir(site, tmp_path):
+    output_dir = tmp_path / 'site'
+    build(site, output_dir=str(output_dir))
+    assert read(output_dir / '2018_Aarhus' / 'RS532.html') == "experiment: RS532"
+    assert not os.path.exists(os.path.join(site['root'], 'index.html'))
+
+
+def test_build_command_uses_server_settings(site, tmp_path, monkeypatch):
+    settings_file = tmp_path / 'settings.py'
+    settings_file.write_text(
+        "NAVIGATION_TREE_OPTIONS = {'depth': 4, 'include_files': ['*.md'], 'include_dirs': ['2019*']}\n")
+    monkeypatch.setenv('ZEPTO_ELN_SERVER_SETTINGS', str(settings_file))
+    monkeypatch.delenv('ZEPTO_ELN_TEMPLATE_DIR', raising=False)
+    with open(os.path.join(site['templates'], 'index.jinja'), 'w', encoding='utf-8') as fh:
+        fh.write("{% for node in navigation_tree %}[{{ node.url_path }}]{% endfor %}")
+    runner = CliRunner()
+    result = runner.invoke(cli, ['build', site['root'], '--manifest', site['manifest']])
+    assert result.exit_code == 2 and "Missing option '--template-dir'" in result.output
+    result = runner.invoke(
+        cli, ['build', site['root'], '--template-dir', site['templates'], '--manifest', site['manifest']])
+    assert result.exit_code == 0, result.output
+    # The default NAVIGATION_TREE_OPTIONS include '2018*' directories, the settings file's options don't:
+    assert read(os.path.join(site['root'], 'index.html')) == "[/index]"
@@ -0,0 +1,85 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.templating`: template lookup by name and by explicit template file,
+and tracking of the templates (and variables) a rendered page depends on.
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.md_utils.templating import (
+    apply_template_file_to_document, get_template_dependencies, get_template_environment)
+
+
+def make_document(**meta):
+    return {'meta': meta, 'html_content': '<p>Hello</p>'}
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    (tmp_path / 'index.jinja').write_text("index: {{ content }}", encoding='utf-8')
+    (tmp_path / 'RS_experiment.jinja').write_text("experiment: {{ meta.expid }}", encoding='utf-8')
+    (tmp_path / 'secret.txt').write_text("secret", encoding='utf-8')
+    return str(tmp_path)
+
+
+def test_template_from_yfm(template_dir):
+    document = make_document(expid='RS532', template='RS_experiment')
+    assert apply_template_file_to_document(document, template_dir=template_dir) == "experiment: RS532"
+    assert document['template_file'].endswith('RS_experiment.jinja')
+
+
+def test_default_template(template_dir):
+    assert apply_template_file_to_document(make_document(), template_dir=template_dir) == "index: <p>Hello</p>"
+
+
+def test_template_name_only_selects_template_files(template_dir):
+    with pytest.raises(FileNotFoundError):
+        apply_template_file_to_document(make_document(template='secret.txt'), template_dir=template_dir)
+
+
+def test_explicit_template_file(tmp_path):
+    # An explicitly given template file is used regardless of its extension:
+    template_file = tmp_path / 'other' / 'page.html'
+    template_file.parent.mkdir()
+    template_file.write_text("page: {{ content }}", encoding='utf-8')
+    document = make_document()
+    assert apply_template_file_to_document(document, template=str(template_file)) == "page: <p>Hello</p>"
+    assert document['template_file'] == str(template_file)
+
+
+def test_template_dependencies(tmp_path):
+    (tmp_path / 'base.jinja').write_text("<nav>{{ navigation_tree }}</nav>{% block main %}{% endblock %}")
+    (tmp_path / 'footer.jinja').write_text("{{ meta.author }}")
+    (tmp_path / 'page.jinja').write_text(
+        "{% extends 'base.jinja' %}{% block main %}{{ content }}{% include 'footer.jinja' %}{% endblock %}")
+    document = make_document(template='page')
+    apply_template_file_to_document(document, template_dir=str(tmp_path))
+    assert document['template_files'] == [
+        str(tmp_path / name) for name in ('page.jinja', 'footer.jinja', 'base.jinja')]
+    assert document['template_variables'] == {'content', 'meta', 'navigation_tree'}
+
+
+def test_template_dependencies_are_updated_when_template_changes(tmp_path):
+    template = tmp_path / 'page.jinja'
+    template.write_text("{{ content }}")
+    (tmp_path / 'footer.jinja').write_text("footer")
+    env = get_template_environment(str(tmp_path))
+    assert get_template_dependencies(env, 'page.jinja') == ([str(template)], {'content'})
+    template.write_text("{{ content }}{% include 'footer.jinja' %}")
+    os.utime(template, ns=(10**18, 10**18))
+    assert get_template_dependencies(env, 'page.jinja') == (
+        [str(template), str(tmp_path / 'footer.jinja')], {'content'})
+
+
+def test_dynamic_include_depends_on_all_templates(template_dir):
+    with open(os.path.join(template_dir, 'dynamic.jinja'), 'w', encoding='utf-8') as fh:
+        fh.write("{% include meta.part %}")
+    document = make_document(template='dynamic', part='index.jinja')
+    apply_template_file_to_document(document, template_dir=template_dir)
+    assert sorted(document['template_files']) == sorted(
+        os.path.join(template_dir, name) for name in ('dynamic.jinja', 'index.jinja', 'RS_experiment.jinja'))
@@ -0,0 +1,51 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Tests for `zepto_eln.md_utils.yfm.parse_yfm`, in particular for documents without
+(or with malformed) YAML front matter.
+
+"""
+
+from zepto_eln.md_utils.yfm import parse_yfm
+
+
+def test_parse_yfm():
+    yfm, content, err = parse_yfm("---\ntitle: Test\ntags: [a, b]\n---\n\n# Heading\n")
+    assert yfm == {'title': 'Test', 'tags': ['a', 'b']}
+    assert content == "\n\n# Heading\n"
+    assert err is None
+
+
+def test_parse_yfm_returns_copy():
+    text = "---\ntags: [a]\n---\n"
+    parse_yfm(text)[0]['tags'].append('b')
+    assert parse_yfm(text)[0] == {'tags': ['a']}
+
+
+def test_parse_yfm_without_front_matter():
+    text = "# Heading\n\nJust text.\n"
+    yfm, content, err = parse_yfm(text)
+    assert yfm == {}
+    assert content == text
+    assert err.n_errors == 1
+
+
+def test_parse_yfm_horizontal_rules_are_not_front_matter():
+    text = "# Heading\n\nText\n\n---\n\nMore text\n\n---\n\nEnd\n"
+    yfm, content, err = parse_yfm(text)
+    assert yfm == {}
+    assert content == text
+    assert err.n_errors == 1
+
+
+def test_parse_yfm_single_marker():
+    yfm, content, err = parse_yfm("---\ntitle: Test\n")
+    assert yfm == {}
+    assert err.n_errors == 1
+
+
+def test_parse_yfm_yaml_error():
+    yfm, content, err = parse_yfm("---\ntitle: [unclosed\n---\nText\n")
+    assert yfm == {}
+    assert err.n_errors >= 1
@@ -0,0 +1,144 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Command line interface for Zepto ELN.
+
+Commands:
+* `zepto-eln build`: Compile all Markdown documents in the document root to HTML files (static site),
+    e.g. for serving the notebook with a plain web server (nginx `try_files $uri $uri.html`).
+* `zepto-eln watch`: Build, then watch the document root and templates, and re-compile pages as files change.
+
+The document root and template directory default to the `ZEPTO_ELN_DOCUMENT_ROOT` and `ZEPTO_ELN_TEMPLATE_DIR`
+environment variables, and the settings (e.g. `NAVIGATION_TREE_OPTIONS`) are loaded from the
+`ZEPTO_ELN_SERVER_SETTINGS` file, as used by the server app.
+
+"""
+
+import os
+import sys
+import click
+
+from zepto_eln.eln_server.settings import load_settings
+from zepto_eln.eln_server.path_utils import get_page_tree_recursive
+from zepto_eln.eln_server.page_tree_index import PageTreeIndex
+from zepto_eln.md_utils.site_builder import build_site, format_build_stats, WatchBuilder
+from zepto_eln.md_utils.fs_watcher import start_file_watcher, WATCHER_BACKENDS
+from zepto_eln.md_utils.log_setup import configure_logging
+
+
+def _strip_quotes(ctx, param, value):
+    # In case the environment variable has been defined with quotation marks:
+    return value.strip('"') if value else value
+
+
+@click.group()
+@click.option('--log-level', envvar='ZEPTO_ELN_LOG_LEVEL',
+              type=click.Choice(['DEBUG', 'INFO', 'WARNING', 'ERROR'], case_sensitive=False),
+              help="Log level; DEBUG logs the details of every compiled document. [default: LOG_LEVEL setting]")
+@click.pass_context
+def cli(ctx, log_level):
+    """ Zepto ELN: Flat-file Markdown-based electronic laboratory notebook. """
+    try:
+        ctx.obj = settings = load_settings()
+    except OSError as exc:
+        raise click.ClickException(f"Could not load settings: {exc}")
+    configure_logging(log_level or settings['LOG_LEVEL'])
+
+
+@cli.command()
+@click.argument('document-root', envvar='ZEPTO_ELN_DOCUMENT_ROOT', callback=_strip_quotes,
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--template-dir', envvar='ZEPTO_ELN_TEMPLATE_DIR', callback=_strip_quotes,
+              type=click.Path(exists=True, file_okay=False), required=True,
+              help="Template directory (default: the ZEPTO_ELN_TEMPLATE_DIR environment variable).")
+@click.option('--output-dir', '-o', type=click.Path(file_okay=False),
+              help="Write HTML files to this directory, instead of next to the Markdown files.")
+@click.option('--processes', '-j', type=int, default=None, help="Number of worker processes (default: CPU count).")
+@click.option('--chunksize', type=int, default=16, show_default=True, help="Pages per batch sent to a worker.")
+@click.option('--compress', 'encodings', multiple=True, type=click.Choice(['gzip', 'br']),
+              help="Also write compressed files (e.g. `page.html.gz`, for nginx `gzip_static`). Can be repeated.")
+@click.option('--manifest', 'manifest_file', type=click.Path(dir_okay=False),
+              help="Build manifest file (default: in the user's cache directory).")
+@click.option('--force', is_flag=True, help="Re-compile all pages, ignoring the build manifest.")
+@click.pass_obj
+def build(settings, document_root, template_dir, output_dir, processes, chunksize, encodings, manifest_file, force):
+    """ Compile all Markdown documents in DOCUMENT_ROOT to HTML files.
+
+    Only pages whose source, templates, or navigation tree have changed since the last build are compiled.
+    """
+    document_root = os.path.abspath(document_root)
+    navigation_tree = get_page_tree_recursive(
+        document_root, rel_root=document_root, **settings['NAVIGATION_TREE_OPTIONS'])['children']
+    stats = build_site(
+        document_root, navigation_tree=navigation_tree, template_dir=template_dir, output_dir=output_dir,
+        processes=processes, chunksize=chunksize, encodings=encodings, manifest_file=manifest_file, force=force,
+        template_bytecode_cache_dir=settings['TEMPLATE_BYTECODE_CACHE_DIR'],
+    )
+    print(format_build_stats(stats), file=sys.stderr)
+    if stats['errors']:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('document-root', envvar='ZEPTO_ELN_DOCUMENT_ROOT', callback=_strip_quotes,
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--template-dir', envvar='ZEPTO_ELN_TEMPLATE_DIR', callback=_strip_quotes,
+              type=click.Path(exists=True, file_okay=False), required=True,
+              help="Template directory (default: the ZEPTO_ELN_TEMPLATE_DIR environment variable).")
+@click.option('--output-dir', '-o', type=click.Path(file_okay=False),
+              help="Write HTML files to this directory, instead of next to the Markdown files.")
+@click.option('--processes', '-j', type=int, default=None, help="Worker processes for the initial build.")
+@click.option('--compress', 'encodings', multiple=True, type=click.Choice(['gzip', 'br']),
+              help="Also write compressed files (e.g. `page.html.gz`, for nginx `gzip_static`). Can be repeated.")
+@click.option('--manifest', 'manifest_file', type=click.Path(dir_okay=False),
+              help="Build manifest file (default: in the user's cache directory).")
+@click.option('--backend', type=click.Choice(['auto'] + list(WATCHER_BACKENDS)), default='auto', show_default=True,
+              help="File watcher backend.")
+@click.option('--poll-interval', type=float, default=0.5, show_default=True,
+              help="Seconds between scans, for the 'polling' watcher backend.")
+@click.pass_obj
+def watch(settings, document_root, template_dir, output_dir, processes, encodings, manifest_file, backend,
+          poll_interval):
+    """ Build DOCUMENT_ROOT, then re-compile pages whenever documents or templates change.
+
+    Parsed documents and the navigation tree are kept in memory, so only the affected pages are re-compiled.
+    """
+    document_root = os.path.abspath(document_root)
+    page_tree_index = PageTreeIndex(check_interval=float('inf'))
+
+    def get_navigation_tree():
+        return page_tree_index.get_page_tree(
+            document_root, rel_root=document_root, **settings['NAVIGATION_TREE_OPTIONS'])['children']
+
+    stats = build_site(
+        document_root, navigation_tree=get_navigation_tree(), template_dir=template_dir, output_dir=output_dir,
+        processes=processes, encodings=encodings, manifest_file=manifest_file,
+        template_bytecode_cache_dir=settings['TEMPLATE_BYTECODE_CACHE_DIR'],
+    )
+    print(format_build_stats(stats), file=sys.stderr)
+    builder = WatchBuilder(
+        document_root, get_navigation_tree, invalidate_navigation_tree=page_tree_index.invalidate,
+        template_dir=template_dir, output_dir=output_dir, encodings=encodings,
+        template_bytecode_cache_dir=settings['TEMPLATE_BYTECODE_CACHE_DIR'],
+        manifest_file=stats['manifest_file'],
+    )
+    watcher = start_file_watcher(
+        [document_root, template_dir], backend=backend, poll_interval=poll_interval)
+    watcher.subscribe(builder.on_event)
+    print(f"Watching {document_root} ({watcher.backend} file watcher); press Ctrl+C to stop.", file=sys.stderr)
+    try:
+        builder.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+    latency = builder.latency_stats()
+    if latency['count']:
+        print(f"Save to HTML latency over {latency['count']} changes: mean {latency['mean']:.3f} s,"
+              f" p50 {latency['p50']:.3f} s, p95 {latency['p95']:.3f} s, max {latency['max']:.3f} s.",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    cli()
@@ -53,11 +53,12 @@ The functionality is very simple:
 * The app has an option to save the compiled HTML from `file.md` to `file.html`,
     (if
 
-* We may also support various metadata directives, e.g.:
+* We also support metadata directives, e.g.:
     `/eln_server/expid:RS532
-    This will serve the last indexed markdown file with `expid: RS532` metadata entry.
-    This requires keeping a persistent index and indexing files either when they are changed,
-    or running the indexing as-needed, or re-indexing the files periodically.
+    This will redirect to the most recently modified markdown file with `expid: RS532` metadata entry.
+    This uses a persistent SQLite index (see `md_utils.metadata_index`), which is updated incrementally
+    (based on file mtimes) in a background thread every `METADATA_INDEX_UPDATE_INTERVAL` seconds,
+    on file watcher events, and (rate-limited) after a lookup fails.
 
 
 Alternative names:
@@ -0,0 +1,97 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Default settings for the Zepto ELN server app.
+
+Override these by pointing the `ZEPTO_ELN_SERVER_SETTINGS` environment variable to a settings file.
+
+"""
+
+# Directory listings cache:
+# Trust cached directory listings for this many seconds before checking the directory mtime again.
+DIRECTORY_LISTING_CHECK_INTERVAL = 1.0
+
+# Navigation tree (page tree) index:
+# How often (seconds) the in-memory navigation tree is re-validated against the directory mtimes.
+PAGE_TREE_CHECK_INTERVAL = 2.0
+# Parameters for the navigation tree (see `get_page_tree_recursive`); also used by `zepto-eln build`:
+NAVIGATION_TREE_OPTIONS = {'depth': 4, 'include_files': ['*.md'], 'include_dirs': ['2018*']}
+
+# File watcher:
+# Watch the document root and template directory, and invalidate cached directory listings, navigation trees,
+# and template lists on change events, instead of re-validating them against directory mtimes.
+# One of 'auto', 'inotify', 'watchdog', 'polling', or None to disable the watcher.
+FILE_WATCHER = None
+# Time (seconds) between scans, if the 'polling' watcher backend is used:
+FILE_WATCHER_POLL_INTERVAL = 1.0
+
+# Raw files (e.g. data files), sent with support for conditional and byte-range requests:
+# Read files in chunks of this size (bytes) when streaming ranges; bounds the memory used per download.
+RAW_FILE_CHUNK_SIZE = 256 * 2**10
+# Requests for more (non-overlapping) ranges than this are answered with the full file:
+RAW_FILE_MAX_RANGES = 64
+
+# Compiled pages cache:
+# Memory budget (bytes) for the in-memory compiled pages cache.
+COMPILED_PAGE_CACHE_MAX_BYTES = 64 * 2**20
+# Maximum number of pages whose recorded dependencies are kept (after eviction) for answering conditional requests.
+COMPILED_PAGE_CACHE_MAX_RECORDS = 10000
+# Serve the compiled `.html` file next to the Markdown file if it is newer than the Markdown file,
+# the templates, and the navigation tree.
+COMPILED_PAGE_DISK_CACHE = False
+
+# Concurrent requests for the same page are coalesced, so the page is only compiled once ("single-flight").
+# Directory for lock files, used to also coalesce compilation across server processes (e.g. gunicorn workers).
+# None = only within each process (enough for a single-process server);
+# 'auto' = in the user's cache directory (~/.cache/zepto_eln/locks/), for multi-worker deployments.
+COMPILE_LOCK_DIR = None
+# Number of lock files in COMPILE_LOCK_DIR; pages are hashed into these, so the directory stays bounded:
+COMPILE_LOCK_STRIPES = 256
+
+# Compressed variants of compiled pages, chosen by the request's Accept-Encoding header:
+# Content encodings to offer, in order of preference; 'br' requires the `brotli` package. Use () to disable.
+# Each compiled page is compressed at most once per encoding, and kept with the page in the memory cache.
+PAGE_COMPRESSION_ENCODINGS = ('br', 'gzip')
+# Don't compress pages smaller than this (characters):
+PAGE_COMPRESSION_MIN_SIZE = 1024
+# Also write the compressed variants next to the compiled `.html` file (e.g. `RS532.html.gz`), e.g. for a
+# reverse proxy serving precompressed files directly (nginx `gzip_static`), and for the on-disk cache:
+PAGE_COMPRESSION_WRITE_FILES = False
+
+# How to write the compiled `.html` file: 'always', 'if-changed' (only if content changed), or
+# 'deferred' (if changed, by a background writer thread). Files are always written atomically.
+HTML_WRITE_POLICY = 'if-changed'
+
+# Templates:
+# Directory for Jinja's bytecode cache, so templates are not re-compiled after a restart (None to disable).
+TEMPLATE_BYTECODE_CACHE_DIR = None
+
+# Logging:
+# Log level for the zepto_eln loggers; 'DEBUG' logs details of every request (path expansion, template lookup, etc.):
+LOG_LEVEL = 'INFO'
+
+# Request timing:
+# Add a `Server-Timing` header with the timing breakdown of each request, i.e. the time spent on each stage:
+# tree (navigation tree), expand (path expansion), read, yfm, pico, markdown, template, write, and compress.
+SERVER_TIMING_HEADER = True
+# Log requests slower than this (seconds), with their timing breakdown; None to disable.
+SLOW_REQUEST_THRESHOLD = 1.0
+# Append the slow-request log to this file; None = write to stderr.
+SLOW_REQUEST_LOG_FILE = None
+
+# Serve metrics (request counts and latencies, compiles, bytes read/written, cache sizes) at `/_metrics`,
+# in the Prometheus text format:
+METRICS_ENABLED = True
+
+# Metadata index, used for `<field>:<value>` lookups, e.g. `/expid:RS532`:
+# SQLite index file; None = per-document-root file in the user's cache directory (~/.cache/zepto_eln/).
+METADATA_INDEX_FILE = None
+# Re-scan the document root for changed documents in a background thread every this many seconds:
+METADATA_INDEX_UPDATE_INTERVAL = 60
+# If a lookup didn't find anything, schedule a background re-scan if the index is older than this (seconds):
+METADATA_INDEX_MISS_UPDATE_INTERVAL = 5
+# Seconds to wait for a lock on the SQLite index file (e.g. held by another server process):
+METADATA_INDEX_TIMEOUT = 30
+# Number of processes used to parse changed documents when updating the index:
+METADATA_INDEX_PROCESSES = 1
@@ -0,0 +1,156 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+In-memory cache of directory listings, validated by directory mtime.
+
+A directory's mtime changes whenever an entry is added, removed, or renamed within it,
+so a single `stat` of the directory tells us if a cached listing is still valid.
+With a non-zero `check_interval`, cached listings are trusted for that many seconds without any
+filesystem calls at all.
+
+The cached listings are used for:
+* Building the navigation tree (`page_tree_index`).
+* Expanding abbreviated paths (`path_utils.CachedPathExpander`), using a sorted name list with bisect
+    for prefix lookups.
+* Values derived from a directory's listing, e.g. the index file of each directory, which are computed once
+    per listing (see `DirectoryListing.get_derived`), and thus only re-computed when the directory changes.
+
+"""
+
+import os
+import bisect
+import threading
+import time
+
+
+class DirectoryListing:
+    """ A cached listing of a single directory. """
+
+    __slots__ = ('dirpath', 'mtime_ns', 'checked', 'entries', '_types', '_sorted_names', '_derived')
+
+    def __init__(self, dirpath, mtime_ns, checked, entries):
+        self.dirpath = dirpath
+        self.mtime_ns = mtime_ns
+        self.checked = checked
+        # List of (name, is_dir, is_file, is_symlink) tuples, in directory order:
+        self.entries = entries
+        self._types = None
+        self._sorted_names = None
+        self._derived = {}
+
+    @classmethod
+    def scan(cls, dirpath, mtime_ns, checked):
+        entries = []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    # DirEntry caches the type information from the directory read (d_type),
+                    # so these generally don't need a stat call (except for symlinks).
+                    entries.append((entry.name, entry.is_dir(), entry.is_file(), entry.is_symlink()))
+                except OSError:
+                    continue
+        return cls(dirpath, mtime_ns, checked, entries)
+
+    @property
+    def types(self):
+        """ dict of name -> (is_dir, is_file). """
+        if self._types is None:
+            self._types = {name: (is_dir, is_file) for name, is_dir, is_file, _ in self.entries}
+        return self._types
+
+    @property
+    def sorted_names(self):
+        if self._sorted_names is None:
+            self._sorted_names = sorted(name for name, _, _, _ in self.entries)
+        return self._sorted_names
+
+    def names_with_prefix(self, prefix):
+        """ Return all entry names starting with `prefix` (sorted), using bisect on the sorted names. """
+        names = self.sorted_names
+        i = bisect.bisect_left(names, prefix)
+        found = []
+        while i < len(names) and names[i].startswith(prefix):
+            found.append(names[i])
+            i += 1
+        return found
+
+    def get_derived(self, key, func):
+        """ Return a value derived from this listing, computing it with `func(listing)` on first use.
+
+        Derived values are stored with the listing, so they are discarded (and re-computed on demand)
+        when the directory changes and the listing is replaced.
+        If `func` raises an exception, the exception is stored and re-raised on subsequent calls.
+
+        Args:
+            key: Hashable key identifying the derived value, e.g. ('index_file', '.md').
+            func: Function taking the listing and returning the derived value.
+        """
+        try:
+            value = self._derived[key]
+        except KeyError:
+            try:
+                value = func(self)
+            except Exception as exc:
+                value = exc
+            self._derived[key] = value
+        if isinstance(value, Exception):
+            raise value.with_traceback(None)
+        return value
+
+
+class DirectoryListingCache:
+    """ Cache of directory listings, validated by each directory's mtime.
+
+    Args:
+        check_interval: Trust a cached listing without re-stat'ing the directory for this many seconds.
+            Use 0 to always stat the directory (but still avoid listing it if it hasn't changed).
+    """
+
+    def __init__(self, check_interval=0.0):
+        self.check_interval = check_interval
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def get_listing(self, dirpath):
+        """ Return the `DirectoryListing` for `dirpath`, re-scanning the directory only if it has changed.
+
+        Raises:
+            OSError (e.g. FileNotFoundError) if the directory cannot be stat'ed or listed.
+        """
+        now = time.monotonic()
+        listing = self._listings.get(dirpath)
+        if listing is not None and now - listing.checked < self.check_interval:
+            return listing
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            self.invalidate(dirpath)
+            raise
+        if listing is not None and listing.mtime_ns == mtime_ns:
+            listing.checked = now
+            return listing
+        listing = DirectoryListing.scan(dirpath, mtime_ns, now)
+        with self._lock:
+            self._listings[dirpath] = listing
+        return listing
+
+    def invalidate(self, dirpath=None, recursive=False):
+        """ Remove a single directory (or all directories, if dirpath is None) from the cache.
+
+        Args:
+            dirpath: The directory to remove.
+            recursive: Also remove all sub-directories of `dirpath`, e.g. if `dirpath` was moved or deleted.
+        """
+        with self._lock:
+            if dirpath is None:
+                self._listings.clear()
+                return
+            self._listings.pop(dirpath, None)
+            if recursive:
+                prefix = os.path.join(dirpath, '')
+                for path in [path for path in self._listings if path.startswith(prefix)]:
+                    del self._listings[path]
+
+    def __len__(self):
+        return len(self._listings)
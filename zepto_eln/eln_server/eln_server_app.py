@@ -28,40 +28,330 @@ You can also use a `wsgi.py` file to configure Flask.
 """
 
 import os
+import re
 import sys
-from pprint import pprint
-
-from flask import Flask, request, send_file, send_from_directory, redirect, url_for, abort, config
-
-
-from .path_utils import expand_abbreviated_path
+import logging
+import threading
+import datetime
+import urllib.parse
+
+from flask import Flask, request, redirect, abort, make_response, g
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+
+from .path_utils import CachedPathExpander
+from .dir_listing_cache import DirectoryListingCache
+from .page_tree_index import PageTreeIndex
+from .page_cache import CompiledPageCache, get_newest_mtime_in_dir, make_etag, get_last_modified
+from .raw_files import send_raw_file
+from zepto_eln.md_utils.metadata_index import MetadataIndex
 from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
-from . import default_settings
-
+from zepto_eln.md_utils.templating import invalidate_templates_in_dir
+from zepto_eln.md_utils.fs_watcher import start_file_watcher
+from zepto_eln.md_utils.compression import available_encodings, ENCODING_EXTENSIONS
+from zepto_eln.md_utils.output_writer import write_output_file
+from zepto_eln.md_utils.single_flight import SingleFlight, get_default_lock_dir
+from zepto_eln.md_utils.instrumentation import RequestTimer, SlowRequestLog, timed
+from zepto_eln.md_utils import instrumentation
+from zepto_eln.md_utils.instrumentation import Counter, Histogram, Labeled, format_prometheus
+from zepto_eln.md_utils.log_setup import configure_logging
+from .settings import load_settings
+
+logger = logging.getLogger(__name__)
 
 TEMPLATE_DIR = os.environ.get('ZEPTO_ELN_TEMPLATE_DIR')
 if TEMPLATE_DIR:
     # In case set ZEPTO_ELN_TEMPLATE_DIR has been defined with quotation marks:
     TEMPLATE_DIR = TEMPLATE_DIR.strip('"')
-print("TEMPLATE_DIR:", TEMPLATE_DIR, file=sys.stderr)
 
 
 app = Flask(__name__, template_folder=TEMPLATE_DIR)
 app.config.update(
     EXPLAIN_TEMPLATE_LOADING=True,
 )
-app.config.from_object(default_settings)
-try:
-    app.config.from_envvar('ZEPTO_ELN_SERVER_SETTINGS')
-except RuntimeError:
-    pass
+app.config.from_mapping(load_settings())
+configure_logging(app.config['LOG_LEVEL'])
+logger.info("TEMPLATE_DIR: %s", TEMPLATE_DIR)
+
+# In-memory directory listings, shared by the navigation tree index and the abbreviated path expansion:
+directory_listing_cache = DirectoryListingCache(check_interval=app.config['DIRECTORY_LISTING_CHECK_INTERVAL'])
+# Site-wide navigation tree index, kept in memory and updated incrementally:
+page_tree_index = PageTreeIndex(
+    check_interval=app.config['PAGE_TREE_CHECK_INTERVAL'], listing_cache=directory_listing_cache)
+# Abbreviated path expansion, e.g. `2018/RS532` -> `2018_Aarhus/RS532_Test_experiment/RS532`:
+path_expander = CachedPathExpander(listing_cache=directory_listing_cache)
+# Compiled pages cache, validated against the source, template, and navigation tree:
+compiled_page_cache = CompiledPageCache(
+    max_bytes=app.config['COMPILED_PAGE_CACHE_MAX_BYTES'],
+    max_records=app.config['COMPILED_PAGE_CACHE_MAX_RECORDS'],
+    use_disk_cache=app.config['COMPILED_PAGE_DISK_CACHE'],
+)
+# Single-flight compilation, so concurrent requests for the same page only compile it once:
+page_compilation = SingleFlight(
+    lock_dir=get_default_lock_dir() if app.config['COMPILE_LOCK_DIR'] == 'auto' else app.config['COMPILE_LOCK_DIR'],
+    lock_stripes=app.config['COMPILE_LOCK_STRIPES'])
+# Request metrics by route type ('markdown', 'raw', 'redirect', 'lookup', 'not_found', etc.), see `/_metrics`:
+request_counts = Labeled(Counter)
+request_durations = Labeled(Histogram)
+pages_compiled = Counter()
+raw_file_bytes_sent = Counter()
+
+# Log of slow requests, with their timing breakdown:
+slow_request_log = SlowRequestLog(
+    threshold=app.config['SLOW_REQUEST_THRESHOLD'], filename=app.config['SLOW_REQUEST_LOG_FILE'], stream=sys.stderr)
+
+# Persistent metadata indexes, for `<field>:<value>` lookups (one per document root):
+METADATA_LOOKUP_REGEX = re.compile(r'^\w+:[^/]+$')
+_metadata_indexes = {}
+_metadata_indexes_lock = threading.Lock()
+
+
+def get_metadata_index(document_root):
+    """ Return the metadata index for `document_root`, creating it on first use.
+
+    The index is kept current by a background thread (and by the file watcher, if running), so lookups
+    never wait for a scan of the document root - except the very first one, if the index is empty.
+    """
+    with _metadata_indexes_lock:
+        if document_root not in _metadata_indexes:
+            index = MetadataIndex(
+                document_root, index_file=app.config['METADATA_INDEX_FILE'],
+                processes=app.config['METADATA_INDEX_PROCESSES'],
+                timeout=app.config['METADATA_INDEX_TIMEOUT'])
+            if len(index) == 0:
+                index.update()
+            else:
+                index.schedule_update()  # Catch up on changes made while the server wasn't running.
+            index.start_background_updates(app.config['METADATA_INDEX_UPDATE_INTERVAL'])
+            _metadata_indexes[document_root] = index
+        return _metadata_indexes[document_root]
+
+
+# Optional file watcher, keeping the in-memory listings, navigation tree, and template list current:
+_file_watcher = None
+_file_watcher_lock = threading.Lock()
+_newest_template_mtime = None  # Cached while the file watcher is running.
+
+
+def on_document_change(event):
+    """ File watcher subscriber: Invalidate the cached listings of directories affected by `event`,
+    and compiled pages depending on changed files. """
+    for path in (event.path, event.dest_path):
+        if path is None:
+            continue
+        page_tree_index.invalidate(os.path.dirname(path))
+        if event.is_dir:
+            page_tree_index.invalidate(path, recursive=True)
+        else:
+            compiled_page_cache.invalidate_dependents(path)
+            if path.endswith('.md'):
+                for index in list(_metadata_indexes.values()):
+                    index.schedule_update()
+
+
+def on_template_change(event):
+    """ File watcher subscriber: Invalidate the template list and newest template mtime. """
+    global _newest_template_mtime
+    if TEMPLATE_DIR and any(path is not None and os.path.dirname(path) == os.path.normpath(TEMPLATE_DIR)
+                            for path in (event.path, event.dest_path)):
+        invalidate_templates_in_dir(TEMPLATE_DIR)
+        _newest_template_mtime = None
+
+
+def ensure_file_watcher(document_root):
+    """ Start the file watcher (if enabled by the `FILE_WATCHER` setting) on first use.
+
+    While the watcher is running, cached directory listings are trusted until the watcher invalidates them.
+    """
+    global _file_watcher
+    backend = app.config['FILE_WATCHER']
+    if not backend or _file_watcher is not None:
+        return
+    with _file_watcher_lock:
+        if _file_watcher is not None:
+            return
+        paths = [document_root] + ([TEMPLATE_DIR] if TEMPLATE_DIR else [])
+        try:
+            watcher = start_file_watcher(
+                paths, backend=backend, poll_interval=app.config['FILE_WATCHER_POLL_INTERVAL'])
+        except (OSError, RuntimeError) as exc:
+            logger.error("Could not start file watcher: %r; falling back to mtime-based cache validation.", exc)
+            _file_watcher = False
+            return
+        watcher.subscribe(on_document_change)
+        watcher.subscribe(on_template_change)
+        directory_listing_cache.check_interval = float('inf')
+        page_tree_index.check_interval = float('inf')
+        logger.info("Started %s file watcher for %s.", watcher.backend, paths)
+        _file_watcher = watcher
+
+
+def get_newest_template_mtime():
+    """ Return the newest mtime of the template files (cached while the file watcher is running). """
+    global _newest_template_mtime
+    if _newest_template_mtime is not None:
+        return _newest_template_mtime
+    newest = get_newest_mtime_in_dir(TEMPLATE_DIR)
+    if _file_watcher:
+        _newest_template_mtime = newest
+    return newest
+
+
+def get_page_validators(dependencies, uses_navigation_tree, tree_digest, encoding=None):
+    """ Return (etag, last_modified) HTTP validators for a compiled page with the given dependencies.
+
+    The ETag is specific to the content encoding, since compressed and uncompressed representations differ.
+    """
+    etag = make_etag(dependencies, tree_digest=tree_digest if uses_navigation_tree else None)
+    if encoding:
+        etag += '-' + encoding
+    last_modified = get_last_modified(
+        dependencies, newer_than=page_tree_index.last_changed if uses_navigation_tree else 0.0)
+    return etag, datetime.datetime.fromtimestamp(int(last_modified), tz=datetime.timezone.utc)
+
+
+def choose_page_encoding():
+    """ Choose the content encoding for a compiled page, based on the request's Accept-Encoding header.
+
+    Returns:
+        The encoding, e.g. 'br' or 'gzip', or None for no compression.
+    """
+    encodings = available_encodings(app.config['PAGE_COMPRESSION_ENCODINGS'])
+    if not encodings:
+        return None
+    encoding = request.accept_encodings.best_match(encodings + ['identity'], default='identity')
+    return None if encoding == 'identity' else encoding
+
+
+def make_page_response(html, validators=None, encoding=None, source_path=None):
+    """ Make response for a compiled page. With validators, conditional requests are answered with 304.
+
+    Args:
+        html: The compiled page.
+        validators: (etag, last_modified) tuple, see `get_page_validators()`.
+        encoding: Content encoding (e.g. 'gzip') to use, if the page isn't too small to be worth compressing.
+        source_path: The page's Markdown source file, used to look up cached compressed variants.
+    """
+    if encoding and len(html) >= app.config['PAGE_COMPRESSION_MIN_SIZE']:
+        with timed('compress'):
+            response = make_response(compiled_page_cache.get_variant(source_path, encoding, html))
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = make_response(html)
+    if app.config['PAGE_COMPRESSION_ENCODINGS']:
+        response.vary.add('Accept-Encoding')
+    if validators is not None:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Allow caching, but always re-validate, since pages change whenever the source is edited:
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+
+def write_compressed_page_files(source_path, html):
+    """ Write the compressed variants of a compiled page next to its `.html` file, e.g. `RS532.html.gz`. """
+    html_file = compiled_page_cache.get_html_file(source_path)
+    for encoding in available_encodings(app.config['PAGE_COMPRESSION_ENCODINGS']):
+        data = compiled_page_cache.get_variant(source_path, encoding, html)
+        with timed('write'):
+            write_output_file(
+                html_file + ENCODING_EXTENSIONS[encoding], data, write_policy=app.config['HTML_WRITE_POLICY'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = RequestTimer()
+    g.request_timer.start()
+
+
+@app.after_request
+def finish_request_timer(response):
+    """ Record the request's timing breakdown, add the `Server-Timing` header, and log the request if slow.
+
+    For streamed responses (e.g. raw files), the timings cover creating the response, not sending the body.
+    """
+    route_type = 'not_found' if response.status_code == 404 else g.get('route_type', 'other')
+    request_counts.get(route_type).inc()
+    timer = g.pop('request_timer', None)
+    if timer is None:
+        return response
+    timings = timer.finish()
+    request_durations.get(route_type).observe(timings.total)
+    if app.config['SERVER_TIMING_HEADER']:
+        response.headers['Server-Timing'] = timings.server_timing()
+    if app.config['SLOW_REQUEST_THRESHOLD'] is not None:
+        slow_request_log.log(request.method, request.path, response.status_code, timings)
+    return response
+
+
+@app.teardown_request
+def discard_request_timer(exc=None):
+    # If the request failed before `after_request`, finish the timer so the request context is reset:
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish()
 
 
 @app.route('/')
 def index():
+    g.route_type = 'index'
     return 'HOME PAGE'
 
 
+@app.route('/_metrics')
+def metrics():
+    """ Serve the server's metrics in the Prometheus text format. """
+    if not app.config['METRICS_ENABLED']:
+        return abort(404)
+    g.route_type = 'metrics'
+    page_cache_stats = compiled_page_cache.stats()
+    tree_stats = page_tree_index.stats()
+    single_flight_stats = page_compilation.stats()
+    families = [
+        ('zepto_eln_requests_total', 'counter', "Requests, by route type.", request_counts, 'route'),
+        ('zepto_eln_request_duration_seconds', 'histogram', "Request duration, by route type.",
+         request_durations, 'route'),
+        ('zepto_eln_stage_duration_seconds', 'histogram', "Time spent per request in each stage.",
+         instrumentation.STAGE_DURATIONS, 'stage'),
+        ('zepto_eln_pages_compiled_total', 'counter', "Markdown pages compiled.", pages_compiled, None),
+        ('zepto_eln_compiles_coalesced_total', 'counter', "Requests that shared a concurrent request's compile.",
+         single_flight_stats['shared'], None),
+        ('zepto_eln_compile_lock_waits_total', 'counter', "Compiles that waited for another process' lock.",
+         single_flight_stats['lock_waits'], None),
+        ('zepto_eln_page_cache_requests_total', 'counter', "Compiled page cache lookups, by result.",
+         {'hit': page_cache_stats['hits'], 'disk_hit': page_cache_stats['disk_hits'],
+          'miss': page_cache_stats['misses']}, 'result'),
+        ('zepto_eln_page_cache_evictions_total', 'counter', "Compiled pages evicted from the memory cache.",
+         page_cache_stats['evictions'], None),
+        ('zepto_eln_page_cache_entries', 'gauge', "Compiled pages in the memory cache.",
+         page_cache_stats['entries'], None),
+        ('zepto_eln_page_cache_bytes', 'gauge', "Size of the compiled pages in the memory cache.",
+         page_cache_stats['nbytes'], None),
+        ('zepto_eln_page_records', 'gauge', "Pages with recorded dependencies (for validators).",
+         page_cache_stats['records'], None),
+        ('zepto_eln_navigation_trees', 'gauge', "Memoized navigation trees.", tree_stats['trees'], None),
+        ('zepto_eln_navigation_tree_nodes', 'gauge', "Nodes in the memoized navigation trees.",
+         tree_stats['nodes'], None),
+        ('zepto_eln_directory_listings', 'gauge', "Cached directory listings.", len(directory_listing_cache), None),
+        ('zepto_eln_document_bytes_read_total', 'counter', "Bytes read from Markdown documents.",
+         instrumentation.DOCUMENT_BYTES_READ, None),
+        ('zepto_eln_output_bytes_written_total', 'counter', "Bytes written to output (HTML) files.",
+         instrumentation.OUTPUT_BYTES_WRITTEN, None),
+        ('zepto_eln_output_files_written_total', 'counter', "Output (HTML) files written.",
+         instrumentation.OUTPUT_FILES_WRITTEN, None),
+        ('zepto_eln_raw_file_bytes_sent_total', 'counter', "Bytes of raw files sent (by Content-Length).",
+         raw_file_bytes_sent, None),
+        ('zepto_eln_slow_requests_total', 'counter', "Requests logged as slow.", slow_request_log.count, None),
+    ]
+    response = make_response(format_prometheus(families))
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
 @app.route('/<path:path>')  # path: is a type specifier, allowing the rest to contain slashes.
 def serve_file(path, serve_html_file_if_newer=True, update_html_file=True):
     """
@@ -76,73 +366,136 @@ def serve_file(path, serve_html_file_if_newer=True, update_html_file=True):
         If you don't want to embed the content inside a HTML document, you need to return a custom request
         or otherwise create a non-string response.
     """
-    print("Serving path:", path, file=sys.stderr)
     try:
         document_root = os.environ['ZEPTO_ELN_DOCUMENT_ROOT']
     except KeyError:
         document_root = r"D:/Dropbox/_experiment_data/"
-        print("ZEPTO_ELN_DOCUMENT_ROOT environment variable not set; using default:", document_root, file=sys.stderr)
-    print("document_root:", document_root, file=sys.stderr)
+        logger.warning("ZEPTO_ELN_DOCUMENT_ROOT environment variable not set; using default: %s", document_root)
     fs_path = os.path.join(document_root, path)
-
-    print(" - Path:", path, file=sys.stderr)
-    # print(" - os.path.realpath(path):", os.path.realpath(path))
-    # print(" - os.path.abspath(path):", os.path.abspath(path))
-    print(" - Abspath:", fs_path, file=sys.stderr)
+    logger.debug("Serving path %r (%s) from document root %s", path, fs_path, document_root)
 
     assert fs_path.startswith(document_root)
+    ensure_file_watcher(document_root)
 
     if os.path.isfile(fs_path):
-        print("Sending directly-requested file:", fs_path, file=sys.stderr)
-        return send_from_directory(document_root, path)
+        g.route_type = 'raw'
+        logger.debug("Sending directly-requested file: %s", fs_path)
+        # Supports conditional requests (ETag/Last-Modified, 304) and byte-range requests (206), for e.g.
+        # resuming downloads of large data files, and seeking in videos:
+        raw_path = safe_join(document_root, path)
+        if raw_path is None:
+            return abort(404)
+        response = send_raw_file(
+            raw_path, request.environ,
+            chunk_size=app.config['RAW_FILE_CHUNK_SIZE'], max_ranges=app.config['RAW_FILE_MAX_RANGES'])
+        if request.method != 'HEAD':
+            raw_file_bytes_sent.inc(response.content_length or 0)
+        return response
     # md_filepath = fs_path + '.md'
     if os.path.isfile(fs_path + '.md'):
         # Request for showing compiled markdown document:
-        print("Requested HTML-compiled markdown document:", fs_path, file=sys.stderr)
-        if (serve_html_file_if_newer and os.path.isfile(fs_path+'.html') and False
-                and os.path.getmtime(fs_path+'.html') > os.path.getmtime(fs_path+'.md')):
-            print("Sending cached .html document:", fs_path+'.html', file=sys.stderr)
-            # return send_from_directory(document_root, fs_path+'.html')
-            html_file = fs_path+'.html'
-            return open(html_file).read()
-        else:
-            # Generate page tree:
-            from zepto_eln.eln_server.path_utils import get_page_tree_recursive
-            # not just pages, also folders. Maybe "navigation tree" or "sitemap" ?
-            navigation_tree = get_page_tree_recursive(
-                document_root, rel_root=document_root, depth=4, include_files=["*.md"], include_dirs=["2018*"],
-            )
-            # We just get a dict for the top/root element, but we actually just want the children:
-            navigation_tree = navigation_tree['children']  # or [navigation_tree] if you want a collapsible root
-            # print("navigation_tree:")
-            # pprint(navigation_tree)
-            template_vars = {
-                'navigation_tree': navigation_tree,
-                'request_path': '/' + path,
-                'documents_root_url': '/',  # aka `base_url` in e.g. pico?
-            }
+        g.route_type = 'markdown'
+        logger.debug("Requested HTML-compiled markdown document: %s", fs_path)
+        md_file = fs_path + '.md'
+        # Get page tree from the in-memory index (same result as `get_page_tree_recursive`):
+        # not just pages, also folders. Maybe "navigation tree" or "sitemap" ?
+        with timed('tree'):
+            navigation_tree = page_tree_index.get_page_tree(
+                document_root, rel_root=document_root, **app.config['NAVIGATION_TREE_OPTIONS'])
+            tree_digest = page_tree_index.get_tree_digest(navigation_tree)
+        tree_version = page_tree_index.version
+        # Conditional GET: If the page's recorded dependencies haven't changed, we can create the validators,
+        # and answer with 304 Not Modified, before looking up or compiling the page:
+        encoding = choose_page_encoding()
+        recorded = compiled_page_cache.get_dependencies(md_file)
+        validators = get_page_validators(*recorded, tree_digest=tree_digest, encoding=encoding) if recorded else None
+        if validators is not None and not is_resource_modified(
+                request.environ, etag=validators[0], last_modified=validators[1]):
+            logger.debug("Page not modified: %s", md_file)
+            return make_page_response('', validators)
+        html = compiled_page_cache.get(
+            md_file, tree_version=tree_version,
+            # Only used if serving the .html file is enabled and the page isn't in the memory cache:
+            newer_than=lambda: max(page_tree_index.last_changed, get_newest_template_mtime()),
+        ) if serve_html_file_if_newer else None
+        if html is not None:
+            logger.debug("Sending cached compiled document: %s", md_file)
+            return make_page_response(html, validators, encoding=encoding, source_path=md_file)
+        # We just get a dict for the top/root element, but we actually just want the children:
+        navigation_tree = navigation_tree['children']  # or [navigation_tree] if you want a collapsible root
+        # print("navigation_tree:")
+        # pprint(navigation_tree)
+        template_vars = {
+            'navigation_tree': navigation_tree,
+            'request_path': '/' + path,
+            'documents_root_url': '/',  # aka `base_url` in e.g. pico?
+        }
+
+        def compile_page():
+            # The page may have been compiled by another request, just before we became the leader:
+            html = compiled_page_cache.get(md_file, tree_version=tree_version, check_disk=False)
+            if html is not None:
+                return html, compiled_page_cache.get_dependencies(md_file)
             # Compile markdown document:
-            print("Compiling Markdown file:", fs_path+'.md', file=sys.stderr)
+            logger.debug("Compiling Markdown file: %s", md_file)
             # TODO: Do templating using Flasks Jinja system, which adds nice variables, e.g. request.url.
+            pages_compiled.inc()
             document = compile_markdown_document(
-                path=fs_path+'.md',
+                path=md_file,
                 outputfn='{filepath_noext}.html' if update_html_file else False,
                 template_dir=TEMPLATE_DIR,
                 template_vars=template_vars,
+                write_policy=app.config['HTML_WRITE_POLICY'],
+                template_bytecode_cache_dir=app.config['TEMPLATE_BYTECODE_CACHE_DIR'],
             )
-            print(f"Serving {fs_path} as compiled HTML ({len(document['html'])} characters)", file=sys.stderr)
-            return document['html']
+            # Only pages whose templates use the navigation tree need to be re-compiled when the tree changes:
+            uses_navigation_tree = 'navigation_tree' in document['template_variables']
+            compiled_page_cache.put(
+                md_file, document['html'], dependencies=document['dependencies'],
+                tree_version=tree_version if uses_navigation_tree else None)
+            if update_html_file and app.config['PAGE_COMPRESSION_WRITE_FILES']:
+                write_compressed_page_files(md_file, document['html'])
+            return document['html'], (document['dependencies'], uses_navigation_tree)
+
+        def get_page_compiled_by_other_process():
+            # Another server process has just compiled the page (we waited for its lock); use its `.html` file:
+            html = compiled_page_cache.get(
+                md_file, tree_version=tree_version, check_disk=update_html_file,
+                newer_than=lambda: max(page_tree_index.last_changed, get_newest_template_mtime()))
+            return (html, None) if html is not None else None
+
+        (html, recorded), shared = page_compilation.do(
+            md_file, compile_page, after_wait=get_page_compiled_by_other_process)
+        logger.debug("Serving %s as compiled HTML (%s characters%s)",
+                     fs_path, len(html), ', compiled by concurrent request' if shared else '')
+        validators = get_page_validators(*recorded, tree_digest=tree_digest, encoding=encoding) if recorded else None
+        return make_page_response(html, validators, encoding=encoding, source_path=md_file)
+    elif METADATA_LOOKUP_REGEX.match(path):
+        # Metadata lookup, e.g. `expid:RS532` - redirect to the most recently modified matching document:
+        g.route_type = 'lookup'
+        field, value = path.split(':', 1)
+        logger.debug("Looking up document with metadata %s: %r", field, value)
+        index = get_metadata_index(document_root)
+        found = index.lookup(field, value)
+        if not found:
+            # The document may have been created since the last update; refresh in the background
+            # (rate-limited, so a stream of misses doesn't trigger a stream of scans):
+            index.schedule_update(min_interval=app.config['METADATA_INDEX_MISS_UPDATE_INTERVAL'])
+            return abort(404)
+        return redirect('/' + urllib.parse.quote(os.path.splitext(found[0])[0]))
     else:
         # Try to see if we have an abbreviated path:
+        g.route_type = 'redirect'
         try:
-            print(f"Checking if path {path!r} is an abbreviated path...", file=sys.stderr)
-            expanded_path = expand_abbreviated_path(
-                path, root=document_root, return_index_for_dir=True, strip_indexfile_ext=True,
-                return_relpath=True, ensure_forwardslash=True)
-            print(f" - path abbreviation expansion found, redirecting to:", expanded_path, file=sys.stderr)
+            logger.debug("Checking if path %r is an abbreviated path...", path)
+            with timed('expand'):
+                expanded_path = path_expander.expand(
+                    path, root=document_root, return_index_for_dir=True, strip_indexfile_ext=True,
+                    return_relpath=True, ensure_forwardslash=True)
+            logger.debug(" - path abbreviation expansion found, redirecting to: %s", expanded_path)
             return redirect(expanded_path)
         except RuntimeError as exc:
-            print(f"ERROR, {path!r} could not be expanded:", repr(exc), file=sys.stderr)
+            logger.info("%r could not be expanded: %r", path, exc)
             return abort(404)  # , message=repr(exc))
 
     return f'<p>SOMETHING WENT WRONG!</p><p>{path}</p><p>{fs_path}</p><p>'
@@ -0,0 +1,327 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Cache for compiled (Markdown -> templated HTML) pages.
+
+Compiling a page involves reading the file, parsing the YAML front matter, Pico variable substitution,
+Markdown conversion, and rendering the Jinja template. For unchanged pages, none of that is necessary.
+
+Cache entries are validated against their dependencies, as recorded by `compile_markdown_document`:
+* The Markdown source file (mtime and size).
+* The template file used to render the page, and all templates it includes, imports, or extends (mtime and size).
+* The navigation tree version (see `PageTreeIndex.version`), but only for pages whose templates
+    actually use the navigation tree.
+
+The cache also keeps a reverse index (dependency -> pages), so that e.g. a file watcher can evict exactly
+the pages that depend on a changed template with `invalidate_dependents()`.
+
+Compressed variants (e.g. gzip and brotli) of each compiled page are created on first request and stored
+with the cached page, so each page is compressed at most once per compile (see `get_variant()`).
+
+The recorded dependencies of each page are kept (in a separate LRU, limited to `max_records` pages) even after
+the compiled page itself has been evicted, so HTTP validators (ETag and Last-Modified, see `make_etag()`)
+can be produced, and conditional requests answered, without compiling the page.
+
+Two cache levels are available:
+* In-memory LRU cache, limited by a total byte budget.
+* Optionally, the compiled `.html` file next to the Markdown source.
+    Since we don't know which template a page used without parsing it, an on-disk `.html` file is only
+    considered valid if it is newer than the source, all templates, and the last navigation tree change.
+
+"""
+
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+from zepto_eln.md_utils.document_io import file_signature
+from zepto_eln.md_utils.compression import compress, ENCODING_EXTENSIONS
+
+
+def make_etag(dependencies, tree_digest=None):
+    """ Make a strong ETag (without quotes) for a compiled page.
+
+    Args:
+        dependencies: dict of path -> file_signature(path), as recorded when the page was compiled.
+        tree_digest: Digest of the navigation tree, for pages that embed the navigation tree.
+
+    Returns:
+        ETag (hex str), which only depends on the given arguments, so it is the same across server restarts.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(dependencies):
+        digest.update(f"{path}\0{dependencies[path]}\0".encode('utf-8', 'surrogateescape'))
+    if tree_digest:
+        digest.update(tree_digest.encode())
+    return digest.hexdigest()
+
+
+def get_last_modified(dependencies, newer_than=0.0):
+    """ Return the newest mtime (in seconds) of the given dependencies (dict of path -> file_signature). """
+    return max([signature[0] / 1e9 for signature in dependencies.values() if signature] + [newer_than])
+
+
+def get_newest_mtime_in_dir(dirpath):
+    """ Return the newest mtime (in seconds) of `dirpath` and the files directly inside it. """
+    if not dirpath:
+        return 0.0
+    try:
+        newest = os.stat(dirpath).st_mtime
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    newest = max(newest, entry.stat().st_mtime)
+                except OSError:
+                    continue
+    except OSError:
+        return 0.0
+    return newest
+
+
+class CachedPage:
+    """ A compiled page, together with the signatures of everything it was compiled from. """
+
+    __slots__ = ('html', 'dependencies', 'tree_version', 'variants', 'nbytes')
+
+    def __init__(self, html, dependencies, tree_version=None):
+        self.html = html
+        self.dependencies = dependencies  # dict of path -> file_signature(path)
+        self.tree_version = tree_version
+        self.variants = {}  # encoding -> compressed html (bytes)
+        self.nbytes = sys.getsizeof(html)
+
+    def is_valid(self, tree_version=None):
+        # Pages that don't embed the navigation tree are stored with tree_version None.
+        if self.tree_version is not None and self.tree_version != tree_version:
+            return False
+        return all(file_signature(path) == signature for path, signature in self.dependencies.items())
+
+
+class CompiledPageCache:
+    """ LRU cache of compiled pages, keyed by the Markdown source path.
+
+    Args:
+        max_bytes: Approximate memory budget for the in-memory cache.
+        max_records: The maximum number of pages to keep the recorded dependencies of (for validators).
+        use_disk_cache: Also consider the compiled `.html` file next to the source as a cache entry.
+        disk_cache_ext: The extension of the compiled html files (replaces the `.md` extension).
+
+    """
+
+    def __init__(self, max_bytes=64*2**20, max_records=10000, use_disk_cache=False, disk_cache_ext='.html'):
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.use_disk_cache = use_disk_cache
+        self.disk_cache_ext = disk_cache_ext
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._dependents = {}  # dependency path -> set of source paths
+        # LRU of source path -> (dependencies, uses_navigation_tree); kept after eviction, up to max_records:
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source_path, tree_version=None, newer_than=0.0, check_disk=None):
+        """ Return the cached html for `source_path`, or None if missing or stale.
+
+        Args:
+            source_path: The Markdown source file.
+            tree_version: The current navigation tree version.
+            newer_than: For the on-disk cache, the html file must be newer than this
+                (e.g. the newest template or navigation tree mtime).
+                Can be a callable, which is only called if the on-disk cache is actually checked.
+            check_disk: Check the on-disk cache; defaults to `use_disk_cache`. Can be used to pick up a page
+                that another process has just compiled.
+
+        Returns:
+            html (str) or None.
+        """
+        entry = self._entries.get(source_path)
+        if entry is not None:
+            if entry.is_valid(tree_version=tree_version):
+                with self._lock:
+                    if source_path in self._entries:
+                        self._entries.move_to_end(source_path)
+                    self.hits += 1
+                return entry.html
+            self._remove(source_path, entry)
+        if check_disk or (check_disk is None and self.use_disk_cache):
+            html = self._get_from_disk(source_path, newer_than=newer_than() if callable(newer_than) else newer_than)
+            if html is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                return html
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_variant(self, source_path, encoding, html):
+        """ Return the compiled page `html` compressed with `encoding` (e.g. 'gzip' or 'br').
+
+        If `html` is the cached page for `source_path`, the compressed variant is created once and cached
+        along with the page. If the page was served from the on-disk cache, a compressed file next to the
+        `.html` file (e.g. `RS532.html.gz`) is used, if it is at least as new as the `.html` file.
+        Otherwise, `html` is compressed on the fly.
+
+        Returns:
+            Compressed html (bytes).
+        """
+        entry = self._entries.get(source_path)
+        if entry is not None and entry.html is html:
+            data = entry.variants.get(encoding)
+            if data is None:
+                data = compress(html, encoding)
+                with self._lock:
+                    if self._entries.get(source_path) is entry and encoding not in entry.variants:
+                        entry.variants[encoding] = data
+                        entry.nbytes += len(data)
+                        self.nbytes += len(data)
+            return data
+        if self.use_disk_cache:
+            html_file = self.get_html_file(source_path)
+            variant_file = html_file + ENCODING_EXTENSIONS[encoding]
+            try:
+                if os.path.getmtime(variant_file) >= os.path.getmtime(html_file):
+                    with open(variant_file, 'rb') as fd:
+                        return fd.read()
+            except OSError:
+                pass
+        return compress(html, encoding)
+
+    def get_html_file(self, source_path):
+        """ Return the compiled `.html` file for a Markdown source file (for the on-disk cache). """
+        return os.path.splitext(source_path)[0] + self.disk_cache_ext
+
+    def _get_from_disk(self, source_path, newer_than=0.0):
+        html_file = self.get_html_file(source_path)
+        try:
+            html_mtime = os.path.getmtime(html_file)
+            if html_mtime <= max(os.path.getmtime(source_path), newer_than):
+                return None
+            with open(html_file, encoding='utf-8') as fd:
+                return fd.read()
+        except OSError:
+            return None
+
+    def put(self, source_path, html, dependencies, tree_version=None):
+        """ Add a compiled page to the cache.
+
+        Args:
+            source_path: The Markdown source file (cache key).
+            html: The compiled html.
+            dependencies: dict of path -> file_signature(path), or a list of paths to take signatures of.
+                Signatures should preferably be taken *before* compiling, so that changes made during
+                compilation will invalidate the entry.
+            tree_version: The navigation tree version the page was compiled with,
+                or None if the page doesn't depend on the navigation tree.
+        """
+        if not isinstance(dependencies, dict):
+            dependencies = {path: file_signature(path) for path in dependencies if path}
+        entry = CachedPage(html, dependencies, tree_version=tree_version)
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(source_path)
+            self._records[source_path] = (entry.dependencies, tree_version is not None)
+            self._records.move_to_end(source_path)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+            self._entries[source_path] = entry
+            self.nbytes += entry.nbytes
+            for path in dependencies:
+                self._dependents.setdefault(path, set()).add(source_path)
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_dependencies(self, source_path):
+        """ Return the recorded dependencies of a page, if they are all unchanged since the page was compiled.
+
+        The record is available even if the compiled page has been evicted from the cache
+        (as long as it hasn't been evicted from the `max_records` most recently used records).
+
+        Returns:
+            (dependencies, uses_navigation_tree) tuple, or None if no current record exists.
+        """
+        record = self._records.get(source_path)
+        if record is None:
+            return None
+        dependencies, _ = record
+        if all(file_signature(path) == signature for path, signature in dependencies.items()):
+            with self._lock:
+                if source_path in self._records:
+                    self._records.move_to_end(source_path)
+            return record
+        return None
+
+    def _pop(self, source_path):
+        """ Remove entry and its reverse dependencies; must be called with the lock held. """
+        entry = self._entries.pop(source_path, None)
+        if entry is None:
+            return None
+        self.nbytes -= entry.nbytes
+        for path in entry.dependencies:
+            dependents = self._dependents.get(path)
+            if dependents is not None:
+                dependents.discard(source_path)
+                if not dependents:
+                    del self._dependents[path]
+        return entry
+
+    def _remove(self, source_path, expected=None):
+        with self._lock:
+            entry = self._entries.get(source_path)
+            if entry is not None and (expected is None or entry is expected):
+                self._pop(source_path)
+
+    def invalidate(self, source_path=None):
+        """ Remove a single page (or all pages, if source_path is None) from the in-memory cache. """
+        if source_path is not None:
+            self._remove(source_path)
+            with self._lock:
+                self._records.pop(source_path, None)
+            return
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+            self._records.clear()
+            self.nbytes = 0
+
+    def invalidate_dependents(self, path):
+        """ Remove all pages that depend on `path` (e.g. a template or a Markdown source file).
+
+        Returns:
+            The number of pages removed.
+        """
+        with self._lock:
+            source_paths = list(self._dependents.get(path, ()))
+            for source_path in source_paths:
+                self._pop(source_path)
+        return len(source_paths)
+
+    def get_dependents(self, path):
+        """ Return the source paths of all cached pages that depend on `path`. """
+        with self._lock:
+            return sorted(self._dependents.get(path, ()))
+
+    def stats(self):
+        """ Return a dict with cache hit/miss counters and size. """
+        return {
+            'entries': len(self._entries),
+            'records': len(self._records),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
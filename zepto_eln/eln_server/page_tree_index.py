@@ -0,0 +1,233 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+In-memory, incrementally updated index of the document tree, used to produce the navigation tree.
+
+`get_page_tree_recursive()` walks the document root with `os.listdir` and a handful of `stat` calls
+for every entry, on every page view. For large notebook trees, that walk dominates the request time.
+
+Instead, we keep:
+* A `DirectoryListingCache` (see `dir_listing_cache`), which holds the (name, type) listing of each directory
+    we have seen, together with the directory's mtime, so a single `stat` of the directory tells us if the
+    cached listing is still valid.
+* A `PageTreeIndex`, which builds the navigation tree from the cached listings and memoizes the result
+    per set of tree parameters. The tree is re-validated at most every `check_interval` seconds,
+    by stat'ing the directories included in the tree (one `stat` per directory, no `listdir`).
+    Only directories that have actually changed are re-listed.
+
+Within the check interval, getting the tree is just a dictionary lookup.
+If a file watcher is used to call `invalidate()` for changed directories, the check interval can be
+infinite, so the filesystem is only touched when something has actually changed.
+
+The produced tree has the same structure as the one returned by `get_page_tree_recursive()`.
+Returned trees are shared between requests and must be treated as read-only.
+
+"""
+
+import os
+import hashlib
+import threading
+import time
+
+from .path_utils import make_entry_filterfunc, make_file_node, make_folder_node
+from .dir_listing_cache import DirectoryListingCache
+
+
+class _TreeEntry:
+
+    __slots__ = ('tree', 'dir_mtimes', 'checked', 'digest')
+
+    def __init__(self, tree, dir_mtimes, checked, digest=None):
+        self.tree = tree
+        self.dir_mtimes = dir_mtimes  # dirpath -> mtime_ns of every directory the tree was built from.
+        self.checked = checked
+        self.digest = digest
+
+
+def page_tree_digest(tree):
+    """ Return a digest (hex str) of the tree's structure (url paths), which is stable across processes. """
+    digest = hashlib.blake2b(digest_size=16)
+
+    def update(node):
+        digest.update(node['url_path'].encode('utf-8', 'surrogateescape') + b'\0')
+        for child in node.get('children') or ():
+            update(child)
+        digest.update(b'\1')  # End of children.
+
+    update(tree)
+    return digest.hexdigest()
+
+
+def _freeze(value):
+    """ Make tree parameters hashable, so they can be used as cache key. """
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class PageTreeIndex:
+    """ Site-wide page tree index, built once and updated incrementally.
+
+    Args:
+        check_interval: How often (in seconds) to re-validate a memoized tree against the filesystem.
+        listing_cache: The `DirectoryListingCache` to use. A new one is created if not given.
+
+    Attributes:
+        version: Incremented every time a tree has changed.
+            Can be used as part of cache keys for output that embeds the navigation tree.
+        last_changed: The newest directory mtime (in seconds) seen by the index.
+            Unlike `version`, this is comparable across processes and server restarts.
+
+    """
+
+    def __init__(self, check_interval=2.0, listing_cache=None):
+        self.check_interval = check_interval
+        self.listing_cache = listing_cache if listing_cache is not None else DirectoryListingCache()
+        self.version = 0
+        self.last_changed = 0.0
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def get_page_tree(
+            self, path, rel_root=None,
+            depth=99,
+            include_dirs=True, include_files=True,
+            exclude_dirs="**/.*", exclude_files="**/.*", exclude_symlinks=False,
+            match_type="glob", match_rel_path=True, match_name_only=False,
+            remove_ext_for_files=('.md',),
+    ):
+        """ Get the page tree for `path`; drop-in replacement for `get_page_tree_recursive()`.
+
+        Args:
+            See `get_page_tree_recursive()`.
+
+        Returns:
+            Tree (dict) for the `path` folder; must not be modified by the caller.
+        """
+        path = os.path.normpath(str(path))
+        rel_root = os.path.normpath(str(rel_root)) if rel_root else None
+        key = (path, rel_root, depth,
+               _freeze(include_dirs), _freeze(include_files), _freeze(exclude_dirs), _freeze(exclude_files),
+               exclude_symlinks, match_type, match_rel_path, match_name_only, _freeze(remove_ext_for_files))
+
+        now = time.monotonic()
+        entry = self._trees.get(key)
+        if entry is not None:
+            if now - entry.checked < self.check_interval:
+                return entry.tree
+            if self._is_current(entry):
+                entry.checked = now
+                return entry.tree
+
+        with self._lock:
+            # Another thread may have re-built the tree while we were waiting for the lock:
+            entry = self._trees.get(key)
+            if entry is not None and entry.checked >= now:
+                return entry.tree
+            filterfunc = make_entry_filterfunc(
+                include_dirs=include_dirs, include_files=include_files,
+                exclude_dirs=exclude_dirs, exclude_files=exclude_files, exclude_symlinks=exclude_symlinks,
+                match_type=match_type,
+            )
+            dir_mtimes = {}
+            tree = self._build_folder_node(
+                path, rel_root=rel_root, depth=depth, filterfunc=filterfunc, dir_mtimes=dir_mtimes,
+                match_rel_path=match_rel_path, match_name_only=match_name_only,
+                remove_ext_for_files=remove_ext_for_files,
+            )
+            digest = None
+            if entry is not None and entry.tree == tree:
+                # Directories changed, but not the (filtered) tree, e.g. a compiled .html file was written:
+                tree, digest = entry.tree, entry.digest
+            else:
+                self.version += 1
+                if dir_mtimes:
+                    self.last_changed = max(self.last_changed, max(dir_mtimes.values()) / 1e9)
+            self._trees[key] = _TreeEntry(tree, dir_mtimes, time.monotonic(), digest=digest)
+        return tree
+
+    def get_tree_digest(self, tree):
+        """ Return the `page_tree_digest()` of a tree returned by `get_page_tree()`, computed once per tree.
+
+        Unlike `version`, the digest is the same across processes and server restarts for the same tree,
+        so it can be used for e.g. HTTP ETags.
+        """
+        for entry in list(self._trees.values()):
+            if entry.tree is tree:
+                if entry.digest is None:
+                    entry.digest = page_tree_digest(tree)
+                return entry.digest
+        return page_tree_digest(tree)
+
+    def _is_current(self, entry):
+        """ Check if all directories in a memoized tree are unchanged (one stat per directory). """
+        get_listing = self.listing_cache.get_listing
+        try:
+            return all(get_listing(dirpath).mtime_ns == mtime_ns for dirpath, mtime_ns in entry.dir_mtimes.items())
+        except OSError:
+            return False
+
+    def _build_folder_node(
+            self, dirpath, rel_root, depth, filterfunc, dir_mtimes,
+            match_rel_path, match_name_only, remove_ext_for_files,
+    ):
+        rel_path = os.path.relpath(dirpath, rel_root) if rel_root else dirpath
+        rel_path = '' if rel_path == '.' else rel_path.replace(os.sep, '/')
+        node = make_folder_node(dirpath, '/' + rel_path)
+        if depth <= 1:
+            return node
+        try:
+            listing = self.listing_cache.get_listing(dirpath)
+        except OSError:
+            # The directory was removed while we were building the tree.
+            return node
+        dir_mtimes[dirpath] = listing.mtime_ns
+        children = node['children']
+        for name, is_dir, is_file, is_symlink in listing.entries:
+            if not (is_dir or is_file):
+                continue  # Broken symlinks, sockets, etc.
+            child_rel_path = rel_path + '/' + name if rel_path else name
+            if match_name_only:
+                path_str = name
+            elif match_rel_path and rel_root:
+                path_str = child_rel_path
+            else:
+                path_str = os.path.join(dirpath, name).replace(os.sep, '/')
+            if not filterfunc(path_str, is_dir, is_symlink):
+                continue
+            child_path = os.path.join(dirpath, name)
+            if is_dir:
+                children.append(self._build_folder_node(
+                    child_path, rel_root=rel_root, depth=depth-1, filterfunc=filterfunc, dir_mtimes=dir_mtimes,
+                    match_rel_path=match_rel_path, match_name_only=match_name_only,
+                    remove_ext_for_files=remove_ext_for_files,
+                ))
+            else:
+                children.append(make_file_node(
+                    child_path, '/' + child_rel_path, remove_ext_for_files=remove_ext_for_files))
+        return node
+
+    def stats(self):
+        """ Return a dict with the number of memoized trees, their total number of nodes, and the tree version. """
+        def count_nodes(node):
+            return 1 + sum(count_nodes(child) for child in node.get('children') or ())
+        entries = list(self._trees.values())
+        return {
+            'trees': len(entries),
+            'nodes': sum(count_nodes(entry.tree) for entry in entries),
+            'directories': sum(len(entry.dir_mtimes) for entry in entries),
+            'version': self.version,
+        }
+
+    def invalidate(self, dirpath=None, recursive=False):
+        """ Invalidate a directory listing (or everything), forcing a re-validation on the next request.
+
+        Args:
+            dirpath: The directory that has changed, or None to invalidate all listings.
+            recursive: Also invalidate all sub-directories of `dirpath`.
+        """
+        self.listing_cache.invalidate(dirpath, recursive=recursive)
+        with self._lock:
+            for entry in self._trees.values():
+                entry.checked = float('-inf')
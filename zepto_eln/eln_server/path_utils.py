@@ -11,8 +11,16 @@ import pathlib
 import urllib.parse
 import re
 import fnmatch
+import logging
+import threading
+from collections import OrderedDict
+
+from .dir_listing_cache import DirectoryListingCache
+
+logger = logging.getLogger(__name__)
 
 SRE_TYPE = type(re.compile(""))
+_DEFAULT_RE_FLAGS = re.compile("").flags
 
 
 def is_newer(this, another):
@@ -42,47 +50,65 @@ def longest_common_startstr(sa, sb):
     return ''.join(_iter())
 
 
+def choose_index_file(dirname, filenames, ext='.md', indexfn='index.md'):
+    """ Choose the index file for a directory, given the directory name and the names of the files in it.
+
+    This is either `indexfn` (e.g. `index.md`), a file named the same as the directory (plus extension),
+    or the file with the longest overlap with the directory's name.
+    The function does no filesystem calls, so the result can be cached per directory listing.
+
+    Args:
+        dirname: The name of the directory (not the full path).
+        filenames: The names of the (regular) files in the directory.
+        ext: Only consider files with this extension.
+        indexfn: Always use this file, if present.
+
+    Returns:
+        The filename (str) of the chosen index file, or None if no index file could be found.
+    """
+    files = list(filenames)
+    # filter by the correct extension:
+    if ext:
+        files = [fn for fn in files if fn.endswith(ext)]
+    if len(files) == 0:
+        return None
+    if indexfn in files:
+        return indexfn
+    exact_matches = [fn for fn in files if os.path.splitext(fn)[0] == dirname]
+    if exact_matches:
+        return exact_matches[0]
+    # sort by overlap first, then filename:
+    best_score, longest_match = max(
+        (len(longest_common_startstr(os.path.splitext(fn)[0], dirname)), fn) for fn in files)
+    if best_score > 0:
+        return longest_match  # use longest, i.e. the file that has the most in common with the parent dirname.
+    return None
+
+
 def find_index_file_for_dir(dirpath, ext='.md', strip_ext=True, indexfn='index.md', sep='/'):
     """ For a given directory, try to find a default index file.
     This is either `index.md`, or the file with the longest overlap with the parent directory's name.
+    See `choose_index_file()`.
 
     Args:
-        dirpath:
-        ext:
-        strip_ext:
-        indexfn:
+        dirpath: The directory to find an index file for.
+        ext: The extension of index files.
+        strip_ext: Remove the extension from the returned path.
+        indexfn: The name of the default index file.
+        sep: Separator used to join `dirpath` and the index filename.
 
     Returns:
+        Path to the index file (str), i.e. `dirpath` joined with the index filename.
 
+    Raises:
+        RuntimeError, if no index file could be found.
     """
-    # files = [fp for fp in [os.path.join(dirpath, fn) for fn in os.listdir(dirpath)] if os.path.isfile(fp)]
     files = [fn for fn in os.listdir(dirpath) if os.path.isfile(os.path.join(dirpath, fn))]
-    # filter by the correct extension:
-    if ext:
-        files = [fn for fn in files if fn.endswith(ext)]
-    if len(files) == 0:
+    found_fn = choose_index_file(os.path.basename(os.path.normpath(dirpath)), files, ext=ext, indexfn=indexfn)
+    if found_fn is None:
         raise RuntimeError("Could not find any index files for directory: " + dirpath)
-
-    if indexfn in files:
-        found_fn = indexfn
-    else:
-        pardirname = os.path.basename(dirpath)
-        exact_matches = [fn for fn in files if os.path.split(fn)[0] == pardirname]
-        if exact_matches:
-            assert len(exact_matches) == 1
-            return exact_matches[0]
-        # sort by overlap first, then filename:
-        files_scored = sorted(
-            [(len(longest_common_startstr(os.path.splitext(fn)[0], pardirname)), fn) for fn in files], reverse=True)
-        # matching_files = [fn for score, fn in files_scored if score > 0]  # has best match first
-        best_score, longest_match = files_scored[0]
-        if best_score > 0:
-            found_fn = longest_match  # use longest, i.e. the file that has the most in common with the parent dirname.
-        else:
-            raise RuntimeError("Could not find any index files for directory: " + dirpath)
-    if strip_ext:
+    if strip_ext and ext:
         found_fn = found_fn.rsplit(ext, 1)[0]
-
     return sep.join([dirpath, found_fn])
 
 
@@ -109,30 +135,24 @@ def find_path_expansion(abbrev, rel=None, pathsep='/'):
     if pathsep is None:
         pathsep = '/'  # This works on both windows and posix.
     abbrev = os.path.normpath(abbrev)
-    print("abbrev, rel:", abbrev, rel)
     if rel is None:
         rel, abbrev = os.path.split(abbrev)
-        print("rel, abbrev:", rel, abbrev)
     else:
         rel = os.path.normpath(rel)
-        print("norm rel:", rel)
+    logger.debug("Finding expansion of abbrev %r in %r.", abbrev, rel)
     assert os.path.isdir(rel)
     # pardirname = os.path.basename(rel)  # No, using parent dirname is for finding index files, not expanding abbrevs.
     # print("pardirname:", pardirname)
     cand_elems = os.listdir(rel)
-    print("cand_elems:", cand_elems)
     cand_paths = [pathsep.join([rel, cand]) for cand in cand_elems if cand.startswith(abbrev)]
-    print("cand_paths:")
-    print("\n".join(cand_paths))
+    logger.debug(" - candidates: %s", cand_paths)
     if cand_paths:
         # cands now has the rel dirpath prefix:
         md_files = [cand for cand in cand_paths if cand.endswith('.md') and os.path.isfile(cand)]
-        print("md_files:", md_files)
         # Return the shortest file or directory that starts with the abbreviated abbrev part:
         if md_files:
             return md_files[0]
         dirs = [cand for cand in cand_paths if os.path.isdir(cand)]
-        print("dirs:", dirs)
         if dirs:
             return dirs[0]
     raise RuntimeError(f"Could not find any abbrev expansion for abbrev: {abbrev!r}.")
@@ -200,72 +220,250 @@ def expand_abbreviated_path(
 
     """
     expanded_path = os.path.normpath(root)
-    print(f"\n\nStarting expansion of path {path!r}from {expanded_path!r}...")
+    logger.debug("Starting expansion of path %r from %r...", path, expanded_path)
     for part in path.split(pathsep):
-        print("expanded_path, path:", expanded_path, path)
         part_path = os.path.join(expanded_path, part)
-        print(" - path_part:", part_path)
         if os.path.exists(part_path):
             # The part is not abbreviated, just append and move to next part:
             expanded_path = part_path
-            print(" - path_part exists, expanded_path is now ", expanded_path)
         else:
             # Try to find path expansion for the non-existing part:
             try:
-                print(f" - trying to find path expansion for path={part} using rel={expanded_path}.")
                 expanded_path = find_path_expansion(part, rel=expanded_path, pathsep=pathsep)
-                print(f" - SUCCESS! expanded_path is now {expanded_path!r}.")
             except RuntimeError as exc:
-                print("Could not find path expansion for path:", path)
-                print(" - Breakdown at:", expanded_path)
-                print(" - Next part:", part)
+                logger.debug("Could not find path expansion for path %r; breakdown at %r, next part %r.",
+                             path, expanded_path, part)
                 raise exc
+        logger.debug(" - expanded_path is now %r.", expanded_path)
     if os.path.isdir(expanded_path) and return_index_for_dir:
-        print(f"Expanded path {expanded_path!r} is a directory; finding index file...")
         expanded_path = find_index_file_for_dir(expanded_path, ext=indexfile_ext, strip_ext=strip_indexfile_ext)
-        print(f" - expanded_path with index file:", expanded_path)
+        logger.debug(" - expanded_path with index file: %r", expanded_path)
     if return_relpath:
         expanded_path = os.path.relpath(expanded_path, start=root)
-        print(f" - expanded_path made relative to root:", expanded_path)
     if ensure_forwardslash and os.name == 'nt':
         # Ways to check OS: os.name, sys.platform, platform.system(), psutil.WINDOWS/OSX/LINUX
         expanded_path = expanded_path.replace("\\", "/")
-        print(f" - expanded_path, after converting slashes:", expanded_path)
     return expanded_path
 
 
-def make_path_match_func(pat, match_type="glob"):
+class CachedPathExpander:
+    """ Cached version of `expand_abbreviated_path()`, using in-memory directory listings.
 
-    # print("Making pattern matching (sub-)function...")
+    Path parts are expanded using a prefix search (bisect on the sorted entry names) in the cached
+    listing of each directory, instead of `os.path.exists` + `os.listdir` + `isfile`/`isdir` per candidate.
+    On top of that, recent expansions (and misses, i.e. paths that could not be expanded) are memoized.
+    A memoized result is valid as long as none of the directories involved in the expansion have changed.
+    The index file of each directory is chosen once per directory listing (see `choose_index_file()`),
+    so it is only re-computed when the directory changes, regardless of how many files the directory holds.
 
-    if isinstance(pat, list):
-        matchfuncs = [make_path_match_func(pat) for pat in pat]
+    Args:
+        listing_cache: The `DirectoryListingCache` to use (a new one is created if not given).
+        memo_size: The maximum number of expansions (and misses) to remember.
 
-        def matcher(path):
-            return any(m(path) for m in matchfuncs)
-        return matcher
+    Examples:
+        >>> expander = CachedPathExpander()
+        >>> expander.expand('2018/RS532', root='/path/to/document_root')
+        '2018_Aarhus/RS532_Test_experiment/RS532'
+
+    """
 
+    def __init__(self, listing_cache=None, memo_size=1024):
+        self.listing_cache = listing_cache if listing_cache is not None else DirectoryListingCache()
+        self.memo_size = memo_size
+        self.hits = 0
+        self.misses = 0
+        self._memo = OrderedDict()  # key -> (result or RuntimeError, {dirpath: mtime_ns})
+        self._lock = threading.Lock()
+
+    def expand(
+            self, path, root, pathsep='/',
+            return_index_for_dir=True, indexfile_ext='.md', strip_indexfile_ext=True,
+            return_relpath=True, ensure_forwardslash=True
+    ):
+        """ Expand an abbreviated path; same arguments and return value as `expand_abbreviated_path()`.
+
+        Raises:
+            RuntimeError, if the path cannot be expanded.
+        """
+        key = (path, root, pathsep, return_index_for_dir, indexfile_ext, strip_indexfile_ext,
+               return_relpath, ensure_forwardslash)
+        memoized = self._memo.get(key)
+        if memoized is not None:
+            result, dir_mtimes = memoized
+            if self._is_current(dir_mtimes):
+                with self._lock:
+                    self.hits += 1
+                    if key in self._memo:
+                        self._memo.move_to_end(key)
+                if isinstance(result, RuntimeError):
+                    raise result
+                return result
+
+        dir_mtimes = {}
+        try:
+            result = self._expand(
+                path, root, pathsep=pathsep, dir_mtimes=dir_mtimes,
+                return_index_for_dir=return_index_for_dir, indexfile_ext=indexfile_ext,
+                strip_indexfile_ext=strip_indexfile_ext)
+        except RuntimeError as exc:
+            result = exc
+        else:
+            if return_relpath:
+                result = os.path.relpath(result, start=root)
+            if ensure_forwardslash and os.name == 'nt':
+                result = result.replace("\\", "/")
+        with self._lock:
+            self.misses += 1
+            self._memo[key] = (result, dir_mtimes)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        if isinstance(result, RuntimeError):
+            raise result
+        return result
+
+    def _is_current(self, dir_mtimes):
+        get_listing = self.listing_cache.get_listing
+        try:
+            return all(get_listing(dirpath).mtime_ns == mtime_ns for dirpath, mtime_ns in dir_mtimes.items())
+        except OSError:
+            return False
+
+    def _get_listing(self, dirpath, dir_mtimes):
+        try:
+            listing = self.listing_cache.get_listing(dirpath)
+        except OSError as exc:
+            raise RuntimeError(f"Could not list directory {dirpath!r}: {exc}")
+        dir_mtimes[dirpath] = listing.mtime_ns
+        return listing
+
+    def _expand(self, path, root, pathsep, dir_mtimes, return_index_for_dir, indexfile_ext, strip_indexfile_ext):
+        expanded_path = os.path.normpath(root)
+        is_dir = True
+        for part in path.split(pathsep):
+            if part in ('', '.', '..'):
+                expanded_path = os.path.join(expanded_path, part)
+                continue
+            if not is_dir:
+                raise RuntimeError(f"Could not find any abbrev expansion for abbrev: {part!r} ({expanded_path!r}"
+                                   f" is not a directory).")
+            listing = self._get_listing(expanded_path, dir_mtimes)
+            types = listing.types
+            if part in types:
+                # The part is not abbreviated, just append and move to next part:
+                expanded_path = os.path.join(expanded_path, part)
+                is_dir = types[part][0]
+                continue
+            # Find expansion for the abbreviated part; prefer Markdown files, then directories:
+            abbrev = os.path.normpath(part)
+            candidates = listing.names_with_prefix(abbrev)
+            expansion = (next((name for name in candidates if name.endswith('.md') and types[name][1]), None)
+                         or next((name for name in candidates if types[name][0]), None))
+            if expansion is None:
+                raise RuntimeError(f"Could not find any abbrev expansion for abbrev: {abbrev!r}.")
+            expanded_path = pathsep.join([os.path.normpath(expanded_path), expansion])
+            is_dir = types[expansion][0]
+        if is_dir and return_index_for_dir:
+            listing = self._get_listing(expanded_path, dir_mtimes)
+            index_fn = listing.get_derived(
+                ('index_file', indexfile_ext), lambda listing: self._choose_index_file(listing, ext=indexfile_ext))
+            if index_fn is None:
+                raise RuntimeError("Could not find any index files for directory: " + expanded_path)
+            if strip_indexfile_ext and indexfile_ext:
+                index_fn = index_fn.rsplit(indexfile_ext, 1)[0]
+            expanded_path = pathsep.join([expanded_path, index_fn])
+        return expanded_path
+
+    @staticmethod
+    def _choose_index_file(listing, ext='.md'):
+        dirname = os.path.basename(os.path.normpath(listing.dirpath))
+        filenames = [name for name, _, is_file, _ in listing.entries if is_file]
+        return choose_index_file(dirname, filenames, ext=ext)
+
+    def invalidate(self):
+        """ Forget all memoized expansions. """
+        with self._lock:
+            self._memo.clear()
+
+
+def _pattern_to_regex_str(pat, match_type="glob"):
+    """ Return regex string for a single str or compiled-regex pattern, or None if it cannot be combined. """
     if isinstance(pat, str):
         if match_type in ('glob', 'fnmatch'):
-            # def matcher(path):
-            #     return fnmatch.fnmatch(path, pat)
-            # Maybe better to just use compiled regex (although fnmatch does some other nice things)
-            pat = fnmatch.translate(pat)  # returns str, not compiled regex
-        # assume pat is now a regex string:
-        pat = re.compile(pat)
-        print(" - match pattern:", pat)
-
-    if isinstance(pat, SRE_TYPE):
-        def matcher(path):
-            # print("Matching: %s vs %s = %s" % (pat, path, pat.match(str(path))))
-            # path = path.as_posix()  # else '/' doesn't match path separator on windows. Sigh.
-            return bool(pat.match(path))
-        return matcher
+            # fnmatch.translate returns regex str, e.g. '(?s:.*\\.md)\\Z'
+            return fnmatch.translate(pat)
+        return pat
+    if isinstance(pat, SRE_TYPE) and isinstance(pat.pattern, str) and pat.flags == _DEFAULT_RE_FLAGS:
+        return pat.pattern
+    return None
+
+
+def compile_path_patterns(pat, match_type="glob"):
+    """ Combine one or more glob/regex patterns into a single compiled regex.
+
+    Args:
+        pat: A pattern (str or compiled regex), or a list of patterns.
+        match_type: 'glob' (or 'fnmatch') to translate str patterns with `fnmatch.translate`,
+            anything else to use str patterns as regular expressions.
+
+    Returns:
+        (regex, others) tuple, where `regex` is the combined, compiled regex (or None if there were no
+        combinable patterns), and `others` is a list of compiled regexes with non-default flags and
+        custom matching functions, which could not be combined.
+    """
+    pats = pat if isinstance(pat, (list, tuple)) else [pat]
+    regex_strs, others = [], []
+    for pat in pats:
+        regex_str = _pattern_to_regex_str(pat, match_type=match_type)
+        if regex_str is not None:
+            regex_strs.append(regex_str)
+        elif isinstance(pat, SRE_TYPE):
+            others.append(pat)
+        else:
+            # pat is not a string and it is not a compiled regex.
+            # Assume at this point that pat is just a custom callable matching function.
+            others.append(pat)
+    if not regex_strs:
+        regex = None
+    elif len(regex_strs) == 1:
+        regex = re.compile(regex_strs[0])
     else:
-        # pat is not a string and it is not a compiled regex.
-        # Assume at this point that pat is just a custom callable matching function.
-        print("pat is not str or compiled regex, using as callable...")
+        regex = re.compile("|".join("(?:%s)" % regex_str for regex_str in regex_strs))
+    return regex, others
+
+
+def make_path_match_func(pat, match_type="glob"):
+    """ Make a function matching a path (str) against one or more glob/regex patterns.
+
+    All str and regex patterns are combined into a single compiled regex (see `compile_path_patterns()`),
+    so matching a path against many patterns is a single `regex.match` call.
+    Custom callables are called with the path string.
+
+    Args:
+        pat: A pattern (str, compiled regex, or callable), or a list of patterns.
+        match_type: 'glob' or 'regex'.
+
+    Returns:
+        matcher(path_str) -> bool
+    """
+    if callable(pat) and not isinstance(pat, SRE_TYPE):
         return pat
+    regex, others = compile_path_patterns(pat, match_type=match_type)
+    if not others:
+        if regex is None:
+            return lambda path: False
+        regex_match = regex.match
+
+        def matcher(path):
+            return regex_match(path) is not None
+        return matcher
+
+    matchfuncs = [other.match if isinstance(other, SRE_TYPE) else other for other in others]
+    if regex is not None:
+        matchfuncs.insert(0, regex.match)
+
+    def matcher(path):
+        return any(m(path) for m in matchfuncs)
+    return matcher
 
 
 def make_path_filterfunc(
@@ -325,13 +523,8 @@ def make_path_filterfunc(
         file_is_excluded = make_path_match_func(exclude_files, match_type=match_type)
 
     def filterfunc(path):
-        if not os.path.exists(path):
-            print("ERROR: PATH DOES NOT EXISTS:", path)
-        # print("filterfunc(%s):" % (path,))
         if not isinstance(path, pathlib.Path):
             path = pathlib.Path(path)
-        # path_str = path.name if match_name_only else (
-        #     path.relative_to(match_rel_path) if match_rel_path else path).as_posix()
         if match_name_only:
             path_str = path.name
         else:
@@ -339,20 +532,75 @@ def make_path_filterfunc(
                 path_str = path.relative_to(match_rel_path).as_posix()
             else:
                 path_str = path.as_posix()
-        print("path_str: %r (path: %r)" % (path_str, path))
         if path.is_dir():
-            print("Directory %s: dir_is_included(path) is %s and dir_is_excluded(path) is %s" % (
-                path_str, dir_is_included(path_str), dir_is_excluded(path_str)))
             return dir_is_included(path_str) and not dir_is_excluded(path_str)
         if exclude_symlinks and path.is_symlink():
             return False
-        print("File   %s: file_is_included(path) is %s and file_is_excluded(path) is %s" % (
-            path_str, file_is_included(path_str), file_is_excluded(path_str)))
         return file_is_included(path_str) and not file_is_excluded(path_str)
 
     return filterfunc
 
 
+def make_entry_filterfunc(
+        include_dirs=True, include_files=True,
+        exclude_dirs=False, exclude_files=False, exclude_symlinks=False,
+        match_type="glob",
+):
+    """ Like `make_path_filterfunc`, but for entries where the entry type is already known.
+
+    The returned function takes `(path_str, is_dir, is_symlink)` and never touches the filesystem,
+    which makes it suitable for filtering cached directory listings.
+    `path_str` should already be in the form that the patterns are matched against
+    (e.g. the posix path relative to the document root, or just the name).
+
+    Args:
+        include_dirs, include_files, exclude_dirs, exclude_files, exclude_symlinks, match_type:
+            See `make_path_filterfunc()`.
+
+    Returns:
+        filterfunc(path_str, is_dir, is_symlink) -> bool
+    """
+    def make_matcher(pat):
+        if pat in (True, False, None):
+            return lambda path_str: pat
+        return make_path_match_func(pat, match_type=match_type)
+
+    dir_is_included, dir_is_excluded = make_matcher(include_dirs), make_matcher(exclude_dirs)
+    file_is_included, file_is_excluded = make_matcher(include_files), make_matcher(exclude_files)
+
+    def filterfunc(path_str, is_dir, is_symlink=False):
+        if is_dir:
+            return bool(dir_is_included(path_str) and not dir_is_excluded(path_str))
+        if exclude_symlinks and is_symlink:
+            return False
+        return bool(file_is_included(path_str) and not file_is_excluded(path_str))
+
+    return filterfunc
+
+
+def make_file_node(fs_path, url_path, remove_ext_for_files=('.md',)):
+    """ Make a page tree node (dict) for a file. """
+    if remove_ext_for_files and (remove_ext_for_files is True or url_path.endswith(remove_ext_for_files)):
+        url_path = os.path.splitext(url_path)[0]
+    return {
+        'node_type': 'file', 'is_file': True, 'is_dir': False,
+        'fs_path': pathlib.Path(fs_path),
+        'url_path': url_path,
+    }
+
+
+def make_folder_node(fs_path, url_path):
+    """ Make a page tree node (dict) for a folder, with an empty list of children. """
+    fs_path = pathlib.Path(fs_path)
+    return {
+        'node_type': 'folder', 'is_file': False, 'is_dir': True,
+        'fs_path': fs_path,
+        'name': fs_path.name,
+        'url_path': url_path,
+        'children': [],
+    }
+
+
 def get_page_tree_recursive(
         path, rel_root=None,
         depth=99,
@@ -363,12 +611,17 @@ def get_page_tree_recursive(
         remove_ext_for_files=('.md',),
         parse_files=None
 ):
-    """
+    """ Build the page tree (navigation tree) for the folder `path`.
+
+    The tree is built with `os.scandir`, using the entry types cached by `os.DirEntry`.
+    All include/exclude patterns are combined into a single compiled regex per kind (see `make_path_match_func`),
+    and excluded directories are pruned before descending into them.
 
     Args:
         path:
         rel_root:
-        filterfunc:
+        filterfunc: Custom filter function, taking the full path (pathlib.Path) of each entry.
+            If given, the include/exclude arguments are not used.
         include_dirs:
         include_files:
         exclude_dirs:
@@ -397,52 +650,75 @@ def get_page_tree_recursive(
         >>> get_page_tree_recursive(folder, rel_root=folder, include_files="*.md")
 
     """
-    if not isinstance(path, pathlib.Path):
-        path = pathlib.Path(path)
-
-    # print("path:", path)
-    # print("rel_root:", rel_root)
-    # print("path.relative_to(rel_root)", path.relative_to(rel_root) if rel_root else "N/A")
-    # ValueError: relative path can't be expressed as a file URI
-    # uri_path = path.relative_to(rel_root).as_uri() if rel_root else path.as_uri()
-    # print("uri_path:", uri_path)
-    rel_path = path.relative_to(rel_root).as_posix() if rel_root else path.as_posix()
-    url_path = "/" + rel_path
+    path = os.path.normpath(str(path))
+    rel_root = os.path.normpath(str(rel_root)) if rel_root else None
+    rel_path = os.path.relpath(path, rel_root) if rel_root else path
+    rel_path = '' if rel_path == '.' else rel_path.replace(os.sep, '/')
     # url_path aka href - but href is usually the complete path and we may prepend a custom per-site document root.
     # still, "url_path" also indicates "the path part of the url", which is not necessarily correct.
     # we should go with path_relative_to_document_root_url.
 
     if os.path.isfile(path):
-        return {
-            'node_type': 'file', 'is_file': True, 'is_dir': False,
-            'fs_path': path,
-            'url_path': (os.path.splitext(url_path)[0]
-                         if remove_ext_for_files
-                            and (remove_ext_for_files is True or url_path.endswith(remove_ext_for_files))
-                         else url_path),
-        }
+        return make_file_node(path, '/' + rel_path, remove_ext_for_files=remove_ext_for_files)
 
+    match_rel_path = bool(match_rel_path and rel_root)
     if filterfunc is None:
-        filterfunc = make_path_filterfunc(
+        entry_filterfunc = make_entry_filterfunc(
             include_dirs=include_dirs, include_files=include_files,
             exclude_dirs=exclude_dirs, exclude_files=exclude_files, exclude_symlinks=exclude_symlinks,
-            match_type=match_type, match_rel_path=(match_rel_path and rel_root),
-            match_name_only=match_name_only
+            match_type=match_type,
         )
-    childpaths = [path.joinpath(child) for child in os.listdir(path)]
-    # print("\nMatching elements in folder:", path)
-    # for childpath in childpaths:
-    #     print(" - %s --> %s" % (childpath, filterfunc(childpath)))
-    return {
-        'node_type': 'folder', 'is_file': False, 'is_dir': True,
-        'fs_path': path,
-        'name': path.name,
-        'url_path': url_path,
-        'children': [
-            get_page_tree_recursive(childpath, rel_root=rel_root, depth=depth-1, filterfunc=filterfunc)
-            for childpath in childpaths
-            if filterfunc(childpath)
-        ] if depth > 1 else []
-    }
+    else:
+        # Custom (legacy) filterfunc, taking the full path:
+        match_rel_path, match_name_only = False, False
+
+        def entry_filterfunc(path_str, is_dir, is_symlink=False):
+            return filterfunc(pathlib.Path(path_str))
 
+    return _scandir_folder_node(
+        path, rel_path, depth=depth, filterfunc=entry_filterfunc,
+        match_rel_path=match_rel_path, match_name_only=match_name_only,
+        remove_ext_for_files=remove_ext_for_files,
+    )
 
+
+def _scandir_folder_node(dirpath, rel_path, depth, filterfunc, match_rel_path, match_name_only, remove_ext_for_files):
+    """ Build folder node for `get_page_tree_recursive()`, using `os.scandir` to list the directory.
+
+    Entry types are taken from `os.DirEntry` (which caches the type from the directory read),
+    so included files and directories are not stat'ed, and excluded directories are never descended into.
+    """
+    node = make_folder_node(dirpath, '/' + rel_path)
+    if depth <= 1:
+        return node
+    children = node['children']
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+                is_file = not is_dir and entry.is_file()
+                is_symlink = entry.is_symlink()
+            except OSError:
+                continue
+            if not (is_dir or is_file):
+                continue  # Broken symlinks, sockets, etc.
+            child_rel_path = rel_path + '/' + name if rel_path else name
+            if match_name_only:
+                path_str = name
+            elif match_rel_path:
+                path_str = child_rel_path
+            else:
+                path_str = entry.path.replace(os.sep, '/')
+            if not filterfunc(path_str, is_dir, is_symlink):
+                continue  # Pruned; excluded directories are not scanned.
+            if is_dir:
+                children.append(_scandir_folder_node(
+                    entry.path, child_rel_path, depth=depth-1, filterfunc=filterfunc,
+                    match_rel_path=match_rel_path, match_name_only=match_name_only,
+                    remove_ext_for_files=remove_ext_for_files,
+                ))
+            else:
+                children.append(make_file_node(
+                    entry.path, '/' + child_rel_path, remove_ext_for_files=remove_ext_for_files))
+    return node
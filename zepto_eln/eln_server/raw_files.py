@@ -0,0 +1,228 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Sending raw files (e.g. multi-GB microscopy or sequencing data files) with support for
+conditional requests and byte-range requests (RFC 7233).
+
+* Conditional requests: Files are sent with ETag and Last-Modified headers (from the file's mtime and size),
+    and If-None-Match/If-Modified-Since requests are answered with 304 Not Modified.
+* Range requests: A single range is answered with 206 Partial Content, and multiple ranges with a
+    `multipart/byteranges` response. Overlapping and adjacent ranges are merged.
+    If-Range is respected, so a resumed download of a file that has since changed gets the full file.
+    Only the requested ranges are read from the file, so resuming a download or seeking in a video
+    doesn't read the file from the start.
+* Full files are sent using the WSGI server's `wsgi.file_wrapper`, if it offers one, which allows
+    the server to use e.g. `os.sendfile`. Ranges are streamed in chunks of at most `chunk_size` bytes,
+    so memory usage is bounded regardless of the file or range size.
+
+"""
+
+import os
+import mimetypes
+import secrets
+import datetime
+
+from werkzeug.http import is_resource_modified, parse_if_range_header
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+DEFAULT_CHUNK_SIZE = 256 * 2**10
+DEFAULT_MAX_RANGES = 64
+
+
+def file_etag(st):
+    """ Return a strong ETag (without quotes) for a file, from its `os.stat` result. """
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def parse_byte_ranges(value):
+    """ Parse a `Range: bytes=...` header value into a list of (start, stop) tuples.
+
+    Unlike `werkzeug.http.parse_range_header`, ranges may be given in any order and may overlap (RFC 7233),
+    e.g. as requested by some PDF viewers and download managers; they are merged by `resolve_ranges()`.
+
+    Args:
+        value: The Range header value, e.g. "bytes=0-499,-500".
+
+    Returns:
+        List of (start, stop) tuples, where stop is exclusive or None, and start is negative for suffix ranges,
+        or None if the header is malformed or uses a unit other than bytes.
+    """
+    units, _, ranges_str = value.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    byte_ranges = []
+    for item in ranges_str.split(','):
+        first, sep, last = item.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or (not first and last.isdigit())) or (last and not last.isdigit()):
+            return None
+        if not first:
+            if int(last) == 0:
+                return None  # "-0" is an invalid (unsatisfiable) suffix range; ignore it.
+            byte_ranges.append((-int(last), None))
+        elif last:
+            if int(last) < int(first):
+                return None
+            byte_ranges.append((int(first), int(last) + 1))
+        else:
+            byte_ranges.append((int(first), None))
+    return byte_ranges
+
+
+def resolve_ranges(byte_ranges, size):
+    """ Resolve the ranges of a parsed Range header against the file size.
+
+    Suffix ranges (e.g. `bytes=-500`) and open ranges (e.g. `bytes=9500-`) are resolved,
+    ranges are clipped to the file size, and overlapping or adjacent ranges are merged.
+
+    Args:
+        byte_ranges: List of (start, stop) tuples, as returned by `parse_byte_ranges()`.
+        size: The file size.
+
+    Returns:
+        Sorted list of (start, stop) tuples (stop exclusive); empty if none of the ranges are satisfiable.
+    """
+    resolved = []
+    for start, stop in byte_ranges:
+        if stop is None:
+            if start < 0:
+                start = max(size + start, 0)
+            stop = size
+        stop = min(stop, size)
+        if 0 <= start < stop:
+            resolved.append((start, stop))
+    resolved.sort()
+    merged = []
+    for start, stop in resolved:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def iter_file_range(fileobj, start, stop, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the bytes from `start` to `stop` (exclusive) of `fileobj`, in chunks of at most `chunk_size`. """
+    fileobj.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = fileobj.read(min(chunk_size, remaining))
+        if not chunk:
+            break  # The file was truncated while we were reading it.
+        remaining -= len(chunk)
+        yield chunk
+
+
+class _ClosingIterator:
+    """ Iterate over `iterable`, closing `fileobj` when the WSGI server closes the response. """
+
+    def __init__(self, iterable, fileobj):
+        self._iterable = iterable
+        self._fileobj = fileobj
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        self._fileobj.close()
+
+
+def _range_is_current(environ, etag, last_modified):
+    """ Check the If-Range header; the Range header should only be used if the file is unchanged. """
+    if_range = parse_if_range_header(environ.get('HTTP_IF_RANGE'))
+    if if_range.etag is not None:
+        return if_range.etag == etag  # Strong comparison.
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return True
+
+
+def send_raw_file(fs_path, environ, chunk_size=DEFAULT_CHUNK_SIZE, max_ranges=DEFAULT_MAX_RANGES, mimetype=None):
+    """ Create response for sending a raw file, with support for conditional and range requests.
+
+    Args:
+        fs_path: The file to send. Must already be validated to be within the document root.
+        environ: The WSGI environ of the request.
+        chunk_size: Read the file in chunks of this size (bytes).
+        max_ranges: Requests with more ranges than this (after merging) are answered with the full file.
+        mimetype: The mimetype of the file; guessed from the filename if not given.
+
+    Returns:
+        werkzeug Response.
+
+    Raises:
+        OSError if the file cannot be opened.
+    """
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(fs_path)[0] or 'application/octet-stream'
+    fileobj = open(fs_path, 'rb')
+    try:
+        st = os.fstat(fileobj.fileno())
+        size = st.st_size
+        etag = file_etag(st)
+        last_modified = datetime.datetime.fromtimestamp(int(st.st_mtime), tz=datetime.timezone.utc)
+        headers = {'Accept-Ranges': 'bytes'}
+
+        if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+            fileobj.close()
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        byte_ranges = None
+        if environ.get('HTTP_RANGE') and environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD') \
+                and _range_is_current(environ, etag, last_modified):
+            parsed = parse_byte_ranges(environ['HTTP_RANGE'])
+            if parsed is not None:
+                byte_ranges = resolve_ranges(parsed, size)
+                if not byte_ranges:
+                    fileobj.close()
+                    headers['Content-Range'] = f"bytes */{size}"
+                    return Response(status=416, headers=headers)
+                if len(byte_ranges) > max_ranges:
+                    byte_ranges = None
+
+        if not byte_ranges:
+            # Full file; let the WSGI server's file wrapper send it (e.g. using os.sendfile):
+            headers['Content-Length'] = str(size)
+            response = Response(
+                wrap_file(environ, fileobj, buffer_size=chunk_size), status=200, headers=headers,
+                mimetype=mimetype, direct_passthrough=True)
+        elif len(byte_ranges) == 1:
+            start, stop = byte_ranges[0]
+            headers['Content-Length'] = str(stop - start)
+            headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+            response = Response(
+                _ClosingIterator(iter_file_range(fileobj, start, stop, chunk_size), fileobj), status=206,
+                headers=headers, mimetype=mimetype, direct_passthrough=True)
+        else:
+            boundary = secrets.token_hex(16)
+            content_type = Response(mimetype=mimetype).content_type
+            part_headers = [
+                (f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                 f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('latin-1')
+                for start, stop in byte_ranges
+            ]
+            # Each part after the first is preceded by a CRLF (which belongs to the boundary delimiter):
+            part_headers[1:] = [b'\r\n' + part_header for part_header in part_headers[1:]]
+            closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+            headers['Content-Length'] = str(sum(len(part_header) + stop - start for part_header, (start, stop)
+                                                in zip(part_headers, byte_ranges)) + len(closing))
+
+            def iter_parts():
+                for part_header, (start, stop) in zip(part_headers, byte_ranges):
+                    yield part_header
+                    yield from iter_file_range(fileobj, start, stop, chunk_size)
+                yield closing
+
+            response = Response(
+                _ClosingIterator(iter_parts(), fileobj), status=206, headers=headers,
+                content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+    except BaseException:
+        fileobj.close()
+        raise
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
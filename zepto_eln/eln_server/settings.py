@@ -0,0 +1,33 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Loading of the Zepto ELN settings, shared by the server app and the command line interface,
+so e.g. `zepto-eln build` compiles pages with the same navigation tree options as the server.
+
+"""
+
+import os
+
+from flask import Config
+
+from . import default_settings
+
+SETTINGS_ENVVAR = 'ZEPTO_ELN_SERVER_SETTINGS'
+
+
+def load_settings(envvar=SETTINGS_ENVVAR):
+    """ Load the default settings, overridden by the settings file given by the `envvar` environment variable.
+
+    Args:
+        envvar: Name of the environment variable pointing to a settings file. If the variable is not set,
+            only the default settings are used; if it points to a file that doesn't exist, an error is raised.
+
+    Returns:
+        `flask.Config` (dict) with the settings.
+    """
+    config = Config(os.path.dirname(os.path.abspath(__file__)))
+    config.from_object(default_settings)
+    if os.environ.get(envvar):
+        config.from_envvar(envvar)
+    return config
@@ -0,0 +1,68 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Compression of compiled output (e.g. HTML pages) for HTTP `Content-Encoding`.
+
+Compiled pages with the embedded navigation tree are large and repetitive, and compress very well.
+Since compiled pages are cached, each page only has to be compressed once per compile,
+so we can afford high compression levels.
+
+Supported encodings:
+* 'gzip': Using the standard library `gzip` module.
+* 'br': Brotli, if the `brotli` package is installed.
+
+Compression is deterministic (the gzip header timestamp is zero), so compressed files written with
+the 'if-changed' write policy are only re-written (otherwise just touched) if the content actually changed.
+
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Default compression levels; compression is done once per compiled page, so favor size over speed:
+COMPRESSION_LEVELS = {
+    'gzip': 9,
+    'br': 9,  # Brotli quality 10-11 is much slower, for a few percent smaller output.
+}
+
+# File extensions for compressed files, e.g. `RS532.html.gz` (as used by e.g. nginx `gzip_static`):
+ENCODING_EXTENSIONS = {
+    'gzip': '.gz',
+    'br': '.br',
+}
+
+
+def available_encodings(encodings=('br', 'gzip')):
+    """ Return the encodings (in the given order) that are supported, i.e. excluding 'br' if brotli is missing. """
+    return [encoding for encoding in encodings
+            if encoding in ENCODING_EXTENSIONS and (encoding != 'br' or brotli is not None)]
+
+
+def compress(data, encoding, level=None):
+    """ Compress `data` using the given content encoding.
+
+    Args:
+        data: The data to compress (bytes), or str, which is encoded as UTF-8.
+        encoding: The content encoding, 'gzip' or 'br'.
+        level: Compression level (quality, for brotli); defaults to `COMPRESSION_LEVELS[encoding]`.
+
+    Returns:
+        Compressed data (bytes).
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if level is None:
+        level = COMPRESSION_LEVELS.get(encoding)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        if brotli is None:
+            raise ValueError("Content encoding 'br' requires the `brotli` package.")
+        return brotli.compress(data, quality=level, mode=brotli.MODE_TEXT)
+    raise ValueError(f"encoding={encoding!r} - value not recognized; must be one of {tuple(ENCODING_EXTENSIONS)}.")
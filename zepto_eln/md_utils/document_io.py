@@ -11,14 +11,19 @@ Module for loading markdown documents, including parsing of optional YAML frontm
 
 
 import os
+import re
 import sys
 import glob
+import logging
 import yaml
 import yaml.scanner
 from collections import defaultdict
-from pprint import pprint
+from pprint import pformat
 
-from .yfm import parse_yfm
+from .yfm import parse_yfm, YFM_SEP_REGEX
+from .instrumentation import timed, DOCUMENT_BYTES_READ
+
+logger = logging.getLogger(__name__)
 
 WARN_MISSING_YFM = False
 WARN_YAML_SCANNER_ERROR = True
@@ -29,26 +34,54 @@ def find_md_files(basedir='.'):
     return glob.glob(os.path.join(basedir, '**/*.md'))
 
 
-def load_document(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=None):
-    """ Reads a document file and extracts the metadata / YAML front matter and the main content.
+def scan_md_files(basedir='.', ext='.md', exclude_hidden=True):
+    """ Recursively find all Markdown files within `basedir`, using `os.scandir`.
+
+    Unlike `find_md_files`, this searches the full directory tree, and uses the file type information
+    from the directory listing instead of stat'ing every file.
 
     Args:
-        filepath: The document file to read.
-        add_fileinfo_to_meta: Whether to add file info directly into the main document dict.
-            Adding file info like this may clutter/override metadata from the YFM.
-        warn_yaml_scanner_error:
+        basedir: The directory to search.
+        ext: The file extension to look for.
+        exclude_hidden: Skip files and directories starting with '.' (like glob does).
 
-    Returns:
-        document dict, with keys:
-            filename:
-            fileinfo:
-            raw_content: The whole file content.
-            content: The markdown content part of the file.
-            meta: The YFM metadata.
+    Yields:
+        File paths.
+    """
+    dirs = [basedir]
+    while dirs:
+        dirpath = dirs.pop()
+        try:
+            it = os.scandir(dirpath)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if exclude_hidden and entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        dirs.append(entry.path)
+                    elif entry.name.endswith(ext) and entry.is_file():
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+def file_signature(path):
+    """ Return (mtime_ns, size) for `path`, or None if the file doesn't exist.
 
+    Used to record the files a compiled document depends on, and to check if they have changed.
     """
-    if warn_yaml_scanner_error is None:
-        warn_yaml_scanner_error = WARN_YAML_SCANNER_ERROR
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def get_fileinfo(filepath):
+    """ Return dict with file info (filename, dirname, basename, extension, etc.) for a document file. """
     dirname, basename = os.path.split(filepath)
     fnroot, fnext = os.path.splitext(basename)
     filepath_root, fnext = os.path.splitext(filepath)  # filepath_root
@@ -61,21 +94,13 @@ def load_document(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=N
         'fnroot': fnroot, 'filename_noext': fnroot,  # alias
         'filepath_root': filepath_root, 'filepath_noext': filepath_root,  # alias
     }
-    print("fileinfo:")
-    pprint(fileinfo)
+    return fileinfo
 
-    with open(filepath, 'r', encoding='utf-8') as fd:
-        raw_content = fd.read()
-    # try:
-    #     yfm, md_content = parse_yfm(raw_content)
-    # except yaml.scanner.ScannerError as exc:
-    #     if warn_yaml_scanner_error:
-    #         if warn_yaml_scanner_error == 'raise':
-    #             raise exc
-    #         print(f"WARNING: YAML ScannerError while parsing YFM of file {filepath}.", file=sys.stderr)
-    #     yfm, md_content = None, raw_content
 
-    yfm, md_content, err = parse_yfm(raw_content)
+def make_document_meta(yfm, err, fileinfo, add_fileinfo_to_meta=True, warn_yaml_scanner_error=None):
+    """ Make the document 'meta' dict from the parsed YFM and parser errors (as returned by `parse_yfm`). """
+    if warn_yaml_scanner_error is None:
+        warn_yaml_scanner_error = WARN_YAML_SCANNER_ERROR
     if yfm is None:
         yfm = {}
     yfm['yfm_err'] = err
@@ -91,6 +116,48 @@ def load_document(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=N
 
     if add_fileinfo_to_meta and yfm is not None:
         yfm.update(fileinfo)
+    return yfm
+
+
+def load_document(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=None):
+    """ Reads a document file and extracts the metadata / YAML front matter and the main content.
+
+    Args:
+        filepath: The document file to read.
+        add_fileinfo_to_meta: Whether to add file info directly into the main document dict.
+            Adding file info like this may clutter/override metadata from the YFM.
+        warn_yaml_scanner_error:
+
+    Returns:
+        document dict, with keys:
+            filename:
+            fileinfo:
+            raw_content: The whole file content.
+            content: The markdown content part of the file.
+            meta: The YFM metadata.
+
+    """
+    fileinfo = get_fileinfo(filepath)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("fileinfo:\n%s", pformat(fileinfo))
+
+    with timed('read'), open(filepath, 'r', encoding='utf-8') as fd:
+        raw_content = fd.read()
+        DOCUMENT_BYTES_READ.inc(os.fstat(fd.fileno()).st_size)
+    # try:
+    #     yfm, md_content = parse_yfm(raw_content)
+    # except yaml.scanner.ScannerError as exc:
+    #     if warn_yaml_scanner_error:
+    #         if warn_yaml_scanner_error == 'raise':
+    #             raise exc
+    #         print(f"WARNING: YAML ScannerError while parsing YFM of file {filepath}.", file=sys.stderr)
+    #     yfm, md_content = None, raw_content
+
+    with timed('yfm'):
+        yfm, md_content, err = parse_yfm(raw_content)
+        yfm = make_document_meta(
+            yfm, err, fileinfo, add_fileinfo_to_meta=add_fileinfo_to_meta,
+            warn_yaml_scanner_error=warn_yaml_scanner_error)
     document = {
         'filename': filepath,
         'fileinfo': fileinfo,
@@ -106,6 +173,55 @@ def load_document(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=N
     return document
 
 
+def read_document_head(filepath, sep_regex=YFM_SEP_REGEX):
+    """ Read the beginning of a document, up to and including the closing front-matter marker.
+
+    The file is read line by line (using the regular buffered file reading), and reading stops as soon as
+    the closing front-matter marker is found, or when the first non-blank line is not a front-matter marker
+    (i.e. the document doesn't have any front matter).
+    For a typical document, only the first buffer (a few KB) of the file is read.
+
+    Args:
+        filepath: The document file to read.
+        sep_regex: The YFM marker regex, see `parse_yfm()`.
+
+    Returns:
+        The head of the document (str), which can be passed to `parse_yfm()`.
+    """
+    marker = re.compile(sep_regex)
+    lines = []
+    n_markers = 0
+    with open(filepath, 'r', encoding='utf-8') as fd:
+        for line in fd:
+            lines.append(line)
+            if marker.match(line.rstrip('\n')):
+                n_markers += 1
+                if n_markers == 2:
+                    break
+            elif n_markers == 0 and line.strip():
+                break  # The document doesn't start with front matter.
+    return ''.join(lines)
+
+
+def load_document_metadata(filepath, add_fileinfo_to_meta=True, warn_yaml_scanner_error=None):
+    """ Load just the metadata (YAML front matter) of a document, without reading the whole file.
+
+    Args:
+        filepath: The document file to read.
+        add_fileinfo_to_meta: Whether to add file info to the metadata.
+        warn_yaml_scanner_error:
+
+    Returns:
+        metadata dict, same as document['meta'] returned by `load_document()`.
+        Note: For documents without front matter, the 'yfm_err_msg' may differ from `load_document()`,
+        since we don't read the rest of the document.
+    """
+    yfm, _, err = parse_yfm(read_document_head(filepath))
+    return make_document_meta(
+        yfm, err, get_fileinfo(filepath),
+        add_fileinfo_to_meta=add_fileinfo_to_meta, warn_yaml_scanner_error=warn_yaml_scanner_error)
+
+
 def load_all_documents(basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True):
     """ Find all Markdown documents/journals (recursively) within a given base directory.
 
@@ -127,6 +243,27 @@ def load_all_documents(basedir='.', add_fileinfo_to_meta=True, exclude_if_missin
     return documents
 
 
+def iter_all_documents_metadata(basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True):
+    """ Find Markdown documents and yield their YFM metadata, one document at a time.
+
+    Documents are found in the full directory tree with `scan_md_files()` (like the metadata index),
+    only the head of each document (up to the closing front-matter marker) is read,
+    and documents are not kept in memory, so this can be used to scan large document trees.
+
+    Args:
+        basedir: The directory to find journals in.
+        add_fileinfo_to_meta: Whether to add fileinfo (e.g. filename, directory, etc).
+        exclude_if_missing_yfm: Exclude journals/files if they don't have any YAML front-matter.
+
+    Yields:
+        metadata dicts (as read from the document YFM).
+    """
+    for fn in scan_md_files(basedir):
+        meta = load_document_metadata(fn, add_fileinfo_to_meta=add_fileinfo_to_meta)
+        if meta is not None or not exclude_if_missing_yfm:
+            yield meta
+
+
 def load_all_documents_metadata(basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True):
     """ Find and load Markdown documents and extract YFM metadata.
 
@@ -137,11 +274,7 @@ def load_all_documents_metadata(basedir='.', add_fileinfo_to_meta=True, exclude_
 
     Returns:
         List of metadata dicts (as read from the document YFM).
+        Use `iter_all_documents_metadata()` to avoid building the list.
     """
-    documents = load_all_documents(
-        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=exclude_if_missing_yfm)
-    # print("\n".join("{}: {}".format(j['filename'], type(j['meta'])) for j in journals))
-    metadata = [document['meta'] for document in documents]
-    return metadata
-
-
+    return list(iter_all_documents_metadata(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=exclude_if_missing_yfm))
@@ -0,0 +1,570 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Filesystem watcher, publishing file change events to subscribers.
+
+Instead of checking mtimes across the whole document root on every request, caches can subscribe
+to change events and invalidate exactly what has changed.
+
+Backends:
+* 'inotify': Linux inotify, through a small ctypes binding to libc (no extra dependencies).
+* 'watchdog': The `watchdog` package (if installed), which also supports Windows and macOS.
+* 'polling': Periodically scans the watched directories and compares entry mtimes and sizes.
+    Works everywhere, but uses more resources for large trees.
+
+`start_file_watcher(paths, backend='auto')` starts the first backend that works, in the order above.
+
+Events are `FileEvent(event_type, path, is_dir, dest_path)` tuples, where `event_type` is one of
+'created', 'modified', 'deleted', or 'moved'. For 'moved' events, `dest_path` is the new path.
+'modified' events are only published for files; changes to a directory's entries are published as
+events for the entries themselves.
+If the backend loses track of the changes (e.g. inotify queue overflow), a 'modified' event is published
+for each watched root directory, meaning "anything in here may have changed".
+
+Subscribers are called from the watcher thread, and should be fast and thread-safe,
+e.g. invalidate a cache entry or put the event on a queue.
+
+Hidden files and directories (names starting with '.') are not watched by default.
+This also hides the temporary files used for atomic writes (see `output_writer.write_bytes_atomic`).
+
+Example:
+    >>> watcher = start_file_watcher(['/path/to/document_root'])
+    >>> watcher.subscribe(print, patterns=['*.md'])
+    >>> watcher.stop()
+
+"""
+
+import os
+import sys
+import re
+import fnmatch
+import select
+import struct
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CREATED, MODIFIED, DELETED, MOVED = EVENT_TYPES = ('created', 'modified', 'deleted', 'moved')
+
+FileEvent = namedtuple('FileEvent', 'event_type path is_dir dest_path')
+FileEvent.__new__.__defaults__ = (None,)
+
+
+def _is_hidden(name):
+    return name.startswith('.')
+
+
+class _Subscription:
+
+    __slots__ = ('callback', 'match', 'include_dirs')
+
+    def __init__(self, callback, patterns=None, include_dirs=True):
+        self.callback = callback
+        if patterns is None:
+            self.match = None
+        else:
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            self.match = re.compile("|".join("(?:%s)" % fnmatch.translate(pat) for pat in patterns)).match
+        self.include_dirs = include_dirs
+
+    def matches(self, event):
+        if event.is_dir:
+            return self.include_dirs
+        if self.match is None:
+            return True
+        return any(path is not None and self.match(os.path.basename(path))
+                   for path in (event.path, event.dest_path))
+
+
+class FileWatcher:
+    """ Base class for file watchers. Watches one or more directories recursively.
+
+    Args:
+        paths: The directories to watch (recursively).
+        exclude_hidden: Do not watch or report hidden files and directories.
+
+    """
+
+    backend = None
+
+    def __init__(self, paths, exclude_hidden=True):
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        # Event paths are relative if the watched paths are (not made absolute, to match cache keys):
+        self.paths = [os.path.normpath(os.fspath(path)) for path in paths]
+        self.exclude_hidden = exclude_hidden
+        self._subscriptions = []
+        self._subscriptions_lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def subscribe(self, callback, patterns=None, include_dirs=True):
+        """ Call `callback(event)` for every change event.
+
+        Args:
+            callback: Function taking a single `FileEvent` argument.
+            patterns: Only call `callback` for files whose name matches one of these glob patterns,
+                e.g. `['*.md']`. None means all files.
+            include_dirs: Also call `callback` for events for directories.
+
+        Returns:
+            callback, so it can be passed to `unsubscribe()` later.
+        """
+        with self._subscriptions_lock:
+            self._subscriptions = self._subscriptions + [_Subscription(callback, patterns, include_dirs)]
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._subscriptions_lock:
+            self._subscriptions = [sub for sub in self._subscriptions if sub.callback is not callback]
+
+    def publish(self, event):
+        """ Send `event` to all matching subscribers. """
+        for sub in self._subscriptions:
+            if sub.matches(event):
+                try:
+                    sub.callback(event)
+                except Exception:
+                    logger.exception("Error in file watcher subscriber %r for event %s:", sub.callback, event)
+
+    def _publish_overflow(self):
+        for path in self.paths:
+            self.publish(FileEvent(MODIFIED, path, True))
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """ Start watching. Changes made after `start()` returns are reported.
+
+        Raises:
+            OSError if the watcher cannot be started (e.g. too many inotify watches).
+        """
+        self._stop_event.clear()
+        self._setup()
+        self._thread = threading.Thread(target=self._run, name=f'zepto-eln-watcher-{self.backend}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._teardown()
+
+    def _setup(self):
+        pass
+
+    def _teardown(self):
+        pass
+
+    def _wakeup(self):
+        pass
+
+    def _run(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        if not self.running:
+            self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class InotifyWatcher(FileWatcher):
+    """ File watcher using Linux inotify, through ctypes. One inotify watch is added per directory. """
+
+    backend = 'inotify'
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    _libc = None
+
+    @classmethod
+    def _get_libc(cls):
+        if cls._libc is None:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            cls._libc = libc
+        return cls._libc
+
+    @classmethod
+    def is_available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            cls._get_libc()
+        except (OSError, AttributeError):
+            return False  # libc not found, or doesn't have inotify functions.
+        return True
+
+    def __init__(self, paths, exclude_hidden=True):
+        super().__init__(paths, exclude_hidden=exclude_hidden)
+        self._fd = None
+        self._wakeup_pipe = None
+        self._wd_paths = {}  # watch descriptor -> directory path
+
+    def _check(self, result, path=None):
+        if result < 0:
+            import ctypes
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return result
+
+    def _setup(self):
+        libc = self._get_libc()
+        self._fd = self._check(libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC))
+        self._wakeup_pipe = os.pipe()
+        try:
+            for path in self.paths:
+                self._add_watches(path)
+        except OSError:
+            self._teardown()
+            raise
+
+    def _teardown(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._wakeup_pipe is not None:
+            for fd in self._wakeup_pipe:
+                os.close(fd)
+            self._wakeup_pipe = None
+        self._wd_paths.clear()
+
+    def _wakeup(self):
+        if self._wakeup_pipe is not None:
+            os.write(self._wakeup_pipe[1], b'x')
+
+    def _add_watches(self, dirpath, new_entries=None):
+        """ Add watches for `dirpath` and all sub-directories.
+
+        If `new_entries` is a list, the paths of all entries found below `dirpath` are appended to it,
+        as (path, is_dir) tuples; these may have been created before the watch was added.
+        """
+        try:
+            wd = self._check(self._get_libc().inotify_add_watch(
+                self._fd, os.fsencode(dirpath), self.WATCH_MASK), dirpath)
+        except FileNotFoundError:
+            return  # Removed again before we got to it.
+        except NotADirectoryError:
+            return
+        self._wd_paths[wd] = dirpath
+        try:
+            with os.scandir(dirpath) as it:
+                entries = [(entry.path, entry.is_dir(follow_symlinks=False)) for entry in it
+                           if not (self.exclude_hidden and _is_hidden(entry.name))]
+        except OSError:
+            return
+        for path, is_dir in entries:
+            if new_entries is not None:
+                new_entries.append((path, is_dir))
+            if is_dir:
+                self._add_watches(path, new_entries)
+
+    def _rename_watched_dirs(self, src, dest):
+        src_prefix = src + os.sep
+        for wd, path in list(self._wd_paths.items()):
+            if path == src:
+                self._wd_paths[wd] = dest
+            elif path.startswith(src_prefix):
+                self._wd_paths[wd] = dest + path[len(src):]
+
+    def _remove_watched_dirs(self, dirpath):
+        prefix = dirpath + os.sep
+        for wd, path in list(self._wd_paths.items()):
+            if path == dirpath or path.startswith(prefix):
+                self._get_libc().inotify_rm_watch(self._fd, wd)
+                self._wd_paths.pop(wd, None)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset, header = 0, self.EVENT_HEADER
+        while offset < len(data):
+            wd, mask, cookie, length = header.unpack_from(data, offset)
+            offset += header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def _run(self):
+        fd, wakeup_fd = self._fd, self._wakeup_pipe[0]
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd, wakeup_fd], [], [])
+            if self._stop_event.is_set():
+                break
+            if fd in readable:
+                self._handle_events(self._read_events())
+
+    def _handle_events(self, raw_events):
+        moved_from = {}  # cookie -> (path, is_dir)
+        for wd, mask, cookie, name in raw_events:
+            if mask & self.IN_Q_OVERFLOW:
+                self._publish_overflow()
+                continue
+            if mask & self.IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                continue
+            dirpath = self._wd_paths.get(wd)
+            if dirpath is None or not name:
+                continue  # Events for the watched directory itself (e.g. IN_DELETE_SELF).
+            if self.exclude_hidden and _is_hidden(name):
+                continue
+            path = os.path.join(dirpath, name)
+            is_dir = bool(mask & self.IN_ISDIR)
+            if mask & self.IN_CREATE:
+                self.publish(FileEvent(CREATED, path, is_dir))
+                if is_dir:
+                    self._add_new_dir(path)
+            elif mask & self.IN_CLOSE_WRITE:
+                self.publish(FileEvent(MODIFIED, path, False))
+            elif mask & self.IN_DELETE:
+                self.publish(FileEvent(DELETED, path, is_dir))
+            elif mask & self.IN_MOVED_FROM:
+                moved_from[cookie] = (path, is_dir)
+            elif mask & self.IN_MOVED_TO:
+                if cookie in moved_from:
+                    src, _ = moved_from.pop(cookie)
+                    if is_dir:
+                        self._rename_watched_dirs(src, path)
+                    self.publish(FileEvent(MOVED, src, is_dir, path))
+                else:
+                    # Moved into the watched tree from somewhere else:
+                    self.publish(FileEvent(CREATED, path, is_dir))
+                    if is_dir:
+                        self._add_new_dir(path)
+        # Entries moved out of the watched tree:
+        for src, is_dir in moved_from.values():
+            if is_dir:
+                self._remove_watched_dirs(src)
+            self.publish(FileEvent(DELETED, src, is_dir))
+
+    def _add_new_dir(self, dirpath):
+        # Entries may have been created in the new directory before the watch was added:
+        new_entries = []
+        self._add_watches(dirpath, new_entries)
+        for path, is_dir in new_entries:
+            self.publish(FileEvent(CREATED, path, is_dir))
+
+
+class WatchdogWatcher(FileWatcher):
+    """ File watcher using the `watchdog` package. """
+
+    backend = 'watchdog'
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import watchdog.observers  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, paths, exclude_hidden=True):
+        super().__init__(paths, exclude_hidden=exclude_hidden)
+        self._observer = None
+
+    @property
+    def running(self):
+        return self._observer is not None and self._observer.is_alive()
+
+    def _is_excluded(self, path):
+        if not self.exclude_hidden or path is None:
+            return False
+        for root in self.paths:
+            if path.startswith(root + os.sep):
+                return any(_is_hidden(part) for part in path[len(root) + 1:].split(os.sep))
+        return _is_hidden(os.path.basename(path))
+
+    def start(self):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type not in EVENT_TYPES:
+                    return  # e.g. 'opened' and 'closed'
+                if event.event_type == MODIFIED and event.is_directory:
+                    return
+                path, dest_path = os.fsdecode(event.src_path), getattr(event, 'dest_path', None) or None
+                dest_path = os.fsdecode(dest_path) if dest_path else None
+                if watcher._is_excluded(path) and (dest_path is None or watcher._is_excluded(dest_path)):
+                    return
+                watcher.publish(FileEvent(event.event_type, path, event.is_directory, dest_path))
+
+        observer = Observer()
+        handler = _Handler()
+        for path in self.paths:
+            observer.schedule(handler, path, recursive=True)
+        observer.start()
+        self._observer = observer
+        return self
+
+    def stop(self, timeout=5.0):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout)
+            self._observer = None
+
+
+class PollingWatcher(FileWatcher):
+    """ File watcher that periodically scans the watched directories and compares with the previous scan.
+
+    Moves are detected by matching the inode numbers of deleted and created entries.
+
+    Args:
+        paths, exclude_hidden: See `FileWatcher`.
+        poll_interval: Time (in seconds) between scans.
+    """
+
+    backend = 'polling'
+
+    def __init__(self, paths, exclude_hidden=True, poll_interval=1.0):
+        super().__init__(paths, exclude_hidden=exclude_hidden)
+        self.poll_interval = poll_interval
+        self._snapshot = {}
+
+    def scan(self):
+        """ Return dict of path -> (is_dir, mtime_ns, size, inode) for all entries in the watched directories. """
+        snapshot = {}
+        stack = list(self.paths)
+        while stack:
+            dirpath = stack.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    for entry in it:
+                        if self.exclude_hidden and _is_hidden(entry.name):
+                            continue
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        snapshot[entry.path] = (is_dir, st.st_mtime_ns, st.st_size, entry.inode())
+                        if is_dir:
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return snapshot
+
+    def _setup(self):
+        self._snapshot = self.scan()
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            snapshot = self.scan()
+            for event in self.diff(self._snapshot, snapshot):
+                self.publish(event)
+            self._snapshot = snapshot
+
+    @staticmethod
+    def diff(old, new):
+        """ Return list of change events between two snapshots (see `scan()`). """
+        created = {path: new[path] for path in new.keys() - old.keys()}
+        deleted = {path: old[path] for path in old.keys() - new.keys()}
+        events = []
+        # Moves, matched by inode. Moved directories are reported as a single event (like inotify),
+        # so the entries within moved directories are not reported individually.
+        created_by_inode = {(info[0], info[3]): path for path, info in created.items()}
+        moved = []
+        for src in sorted(deleted):
+            dest = created_by_inode.get((deleted[src][0], deleted[src][3]))
+            if dest is not None:
+                moved.append((src, dest, deleted[src][0]))
+        moved_dirs = [(src + os.sep, dest + os.sep) for src, dest, is_dir in moved if is_dir]
+        for src, dest, is_dir in moved:
+            if any(src.startswith(s) and dest.startswith(d) for s, d in moved_dirs):
+                pass  # Moved along with the parent directory.
+            else:
+                events.append(FileEvent(MOVED, src, is_dir, dest))
+            deleted.pop(src)
+            created.pop(dest)
+        for path in sorted(deleted):
+            events.append(FileEvent(DELETED, path, deleted[path][0]))
+        for path in sorted(created):
+            events.append(FileEvent(CREATED, path, created[path][0]))
+        for path in sorted(new.keys() & old.keys()):
+            is_dir, mtime_ns, size, _ = new[path]
+            if not is_dir and old[path][1:3] != (mtime_ns, size):
+                events.append(FileEvent(MODIFIED, path, False))
+        return events
+
+
+WATCHER_BACKENDS = {
+    'inotify': InotifyWatcher,
+    'watchdog': WatchdogWatcher,
+    'polling': PollingWatcher,
+}
+
+
+def start_file_watcher(paths, backend='auto', exclude_hidden=True, poll_interval=1.0):
+    """ Create and start a file watcher for `paths`.
+
+    Args:
+        paths: Directory (or list of directories) to watch recursively.
+        backend: 'inotify', 'watchdog', 'polling', or 'auto' to use the first backend that is available
+            and can be started, in that order.
+        exclude_hidden: Do not watch hidden files and directories.
+        poll_interval: Time (in seconds) between scans, for the 'polling' backend.
+
+    Returns:
+        The started `FileWatcher`.
+    """
+    if backend == 'auto':
+        candidates = list(WATCHER_BACKENDS)
+    elif backend in WATCHER_BACKENDS:
+        candidates = [backend]
+    else:
+        raise ValueError(f"backend={backend!r} - value not recognized; must be 'auto' or one of "
+                         f"{tuple(WATCHER_BACKENDS)}.")
+    for name in candidates:
+        cls = WATCHER_BACKENDS[name]
+        if not cls.is_available():
+            if backend != 'auto':
+                raise RuntimeError(f"File watcher backend {name!r} is not available on this system.")
+            continue
+        kwargs = {'poll_interval': poll_interval} if cls is PollingWatcher else {}
+        watcher = cls(paths, exclude_hidden=exclude_hidden, **kwargs)
+        try:
+            return watcher.start()
+        except OSError as exc:
+            if backend != 'auto' or name == candidates[-1]:
+                raise
+            logger.warning("Could not start %s file watcher (%s); trying next backend.", name, exc)
@@ -0,0 +1,116 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Module for bulk indexing of the document tree, i.e. loading the metadata of all documents.
+
+Indexing pipeline stages:
+1. Discover: Find all Markdown files with `os.scandir` (`scan_md_files`).
+2. Parse: Load the metadata of each file (`load_document_metadata`), using a process pool.
+    Files are sent to the worker processes in chunks, to amortize the inter-process communication overhead.
+3. Merge: Merge the results from all chunks into a single index dict, keyed by file path.
+
+Each stage is timed, and the stats are returned together with the index.
+
+"""
+
+import os
+import time
+import functools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .document_io import scan_md_files, load_document_metadata
+
+
+def _chunks(items, chunksize):
+    for i in range(0, len(items), chunksize):
+        yield items[i:i+chunksize]
+
+
+def load_metadata_batch(filepaths, add_fileinfo_to_meta=True):
+    """ Load metadata for a batch of files (used by the worker processes).
+
+    Returns:
+        List of (filepath, metadata) tuples, and list of (filepath, error message) tuples
+        for files that could not be read.
+    """
+    results, errors = [], []
+    for filepath in filepaths:
+        try:
+            meta = load_document_metadata(filepath, add_fileinfo_to_meta=add_fileinfo_to_meta)
+        except (OSError, UnicodeDecodeError) as exc:
+            errors.append((filepath, repr(exc)))
+        else:
+            results.append((filepath, meta))
+    return results, errors
+
+
+def build_metadata_index(basedir='.', processes=None, chunksize=64, add_fileinfo_to_meta=True, filepaths=None):
+    """ Load the metadata for all Markdown documents in `basedir`, in parallel.
+
+    Args:
+        basedir: The document root to index.
+        processes: Number of worker processes. None = number of CPUs; 1 = parse in the current process.
+        chunksize: Number of files per batch sent to a worker process.
+        add_fileinfo_to_meta: Add file info to each document's metadata.
+        filepaths: Index these files instead of discovering all files in `basedir`.
+
+    Returns:
+        Two-tuple of (index, stats), where index is a dict of filepath -> metadata,
+        and stats is a dict with the number of files, errors, per-stage timings (seconds),
+        and overall throughput (files per second).
+    """
+    t_start = time.perf_counter()
+    if filepaths is None:
+        filepaths = list(scan_md_files(basedir))
+    else:
+        filepaths = list(filepaths)
+    t_discovered = time.perf_counter()
+
+    index, errors = {}, []
+    merge_time = 0.0
+    if processes is None:
+        processes = os.cpu_count() or 1
+    batches = _chunks(filepaths, chunksize)
+    load_batch = functools.partial(load_metadata_batch, add_fileinfo_to_meta=add_fileinfo_to_meta)
+    with contextlib.ExitStack() as stack:
+        if processes == 1 or len(filepaths) <= chunksize:
+            batch_results = map(load_batch, batches)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=processes))
+            batch_results = pool.map(load_batch, batches)
+        for results, batch_errors in batch_results:
+            t_merge = time.perf_counter()
+            index.update(results)
+            errors.extend(batch_errors)
+            merge_time += time.perf_counter() - t_merge
+    t_done = time.perf_counter()
+
+    total_time = t_done - t_start
+    stats = {
+        'files': len(filepaths),
+        'indexed': len(index),
+        'errors': errors,
+        'processes': processes,
+        'chunksize': chunksize,
+        'stages': {
+            'discover': t_discovered - t_start,
+            'parse': t_done - t_discovered - merge_time,
+            'merge': merge_time,
+        },
+        'total_time': total_time,
+        'files_per_second': len(filepaths) / total_time if total_time > 0 else float('inf'),
+    }
+    return index, stats
+
+
+def format_index_stats(stats):
+    """ Format the stats returned by `build_metadata_index` as a short human-readable report. """
+    lines = [
+        f"Indexed {stats['indexed']} of {stats['files']} files in {stats['total_time']:.2f} s"
+        f" ({stats['files_per_second']:.0f} files/s, {stats['processes']} processes, chunksize {stats['chunksize']}).",
+    ]
+    lines += [f" - {stage:<10} {seconds:8.3f} s" for stage, seconds in stats['stages'].items()]
+    lines += [f" - ERROR: {filepath}: {err}" for filepath, err in stats['errors']]
+    return "\n".join(lines)
@@ -0,0 +1,329 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Lightweight instrumentation of the request hot path: per-request timing breakdowns and in-process histograms.
+
+* `RequestTimer()` starts collecting the `Timings` of the current request (stored in a context variable,
+    so concurrent requests in different threads don't mix).
+* `timed(stage)` adds the duration of a block to the current request's timings, under `stage`, e.g. 'read',
+    'yfm', 'pico', 'markdown', 'template', or 'write'. Outside of a request (e.g. when building the static site),
+    it does nothing except a single context variable lookup.
+* When the request is finished, the duration of each stage (and the total) is recorded in `STAGE_DURATIONS`,
+    a histogram per stage. The timings can also be sent to the client in a `Server-Timing` header
+    (`Timings.server_timing()`), and slow requests logged with their breakdown (`SlowRequestLog`).
+
+Histograms and counters (e.g. `DOCUMENT_BYTES_READ`) are updated without locks: Each thread updates
+its own shard of the values, and the shards are only summed when the metric is read,
+e.g. when formatting the metrics in the Prometheus text format with `format_prometheus()`.
+
+"""
+
+import time
+import bisect
+import datetime
+import threading
+import contextvars
+
+# Histogram bucket upper bounds (seconds), from 0.1 ms to 10 s:
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_timings = contextvars.ContextVar('zepto_eln_timings', default=None)
+
+
+class _ThreadShards:
+    """ Per-thread lists of values, which each thread can update without locking.
+
+    Shards are keyed by thread identifier, which the OS re-uses after a thread has finished,
+    so the number of shards is bounded by the number of concurrent threads, even when a server
+    creates a new thread for every request.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._shards = {}  # thread ident -> list of values
+        self._lock = threading.Lock()  # Only used when adding a new shard.
+
+    def get(self):
+        """ Return the current thread's shard (list). """
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            with self._lock:
+                shard = self._shards.setdefault(threading.get_ident(), [0] * self._size)
+        return shard
+
+    def sum(self):
+        """ Return the element-wise sum of all shards. """
+        totals = [0] * self._size
+        for shard in list(self._shards.values()):
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class Histogram:
+    """ Histogram of observed values (e.g. durations in seconds), with fixed buckets.
+
+    Args:
+        buckets: Sorted bucket upper bounds; values larger than the last bound go into an overflow (+Inf) bucket.
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Per-thread shard: count per bucket (incl. the +Inf bucket), followed by the total count and sum.
+        self._shards = _ThreadShards(len(self.buckets) + 3)
+
+    def observe(self, value):
+        shard = self._shards.get()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """ Return dict with the cumulative bucket counts as a list of (upper bound, count), 'count', and 'sum'. """
+        totals = self._shards.sum()
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals):
+            running += count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'count': totals[-2], 'sum': totals[-1]}
+
+    def quantile(self, q):
+        """ Estimate the `q` quantile (e.g. 0.95) as the upper bound of the bucket containing it (None if empty). """
+        snapshot = self.snapshot()
+        if not snapshot['count']:
+            return None
+        rank = q * snapshot['count']
+        return next(bound for bound, count in snapshot['buckets'] if count >= rank)
+
+
+class Counter:
+    """ Monotonically increasing counter, e.g. number of requests or bytes written. """
+
+    def __init__(self):
+        self._shards = _ThreadShards(1)
+
+    def inc(self, amount=1):
+        self._shards.get()[0] += amount
+
+    def value(self):
+        return self._shards.sum()[0]
+
+
+class Labeled:
+    """ A metric (e.g. `Counter` or `Histogram`) per label value, e.g. per stage; created on first use.
+
+    Args:
+        factory: Function creating a new metric, e.g. `Counter`.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._metrics = {}
+        self._lock = threading.Lock()  # Only used when adding a new label value.
+
+    def get(self, label):
+        metric = self._metrics.get(label)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(label)
+                if metric is None:
+                    metric = self._metrics[label] = self._factory()
+        return metric
+
+    def items(self):
+        return sorted(self._metrics.items())
+
+
+# Duration (seconds) of each stage per request, incl. 'total':
+STAGE_DURATIONS = Labeled(Histogram)
+# Bytes read from document (Markdown) files, and bytes written to output (HTML) files:
+DOCUMENT_BYTES_READ = Counter()
+OUTPUT_BYTES_WRITTEN = Counter()
+OUTPUT_FILES_WRITTEN = Counter()
+
+
+class Timings:
+    """ The timing breakdown of a single request: stage -> accumulated duration (seconds). """
+
+    __slots__ = ('start', 'stages', 'total')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.total = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        """ Set the total duration (if not already set), and return it. """
+        if self.total is None:
+            self.total = time.perf_counter() - self.start
+        return self.total
+
+    def server_timing(self):
+        """ Return the timings as a `Server-Timing` header value (durations in milliseconds). """
+        parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items()]
+        if self.total is not None:
+            parts.append(f"total;dur={self.total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def format(self):
+        """ Return the timings as a short human-readable string, e.g. 'total=12.3ms tree=1.2ms read=0.3ms'. """
+        parts = [f"total={self.total * 1000:.1f}ms"] if self.total is not None else []
+        parts += [f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.stages.items()]
+        return " ".join(parts)
+
+
+class timed:
+    """ Context manager adding the duration of the block to the current request's timings under `stage`.
+
+    Example:
+        >>> with timed('read'):
+        ...     content = fd.read()
+    """
+
+    __slots__ = ('stage', '_timings', '_start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._timings = _current_timings.get()
+        if self._timings is not None:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._timings is not None:
+            self._timings.add(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+def get_current_timings():
+    """ Return the `Timings` of the current request, or None if not in a timed request. """
+    return _current_timings.get()
+
+
+class RequestTimer:
+    """ Collect the timings of a request, from `start()` until `finish()`.
+
+    `finish()` records the durations in `STAGE_DURATIONS` and returns the `Timings`.
+    """
+
+    __slots__ = ('timings', '_token')
+
+    def __init__(self):
+        self.timings = None
+        self._token = None
+
+    def start(self):
+        self.timings = Timings()
+        self._token = _current_timings.set(self.timings)
+        return self.timings
+
+    def finish(self):
+        timings = self.timings
+        if timings is None:
+            return None
+        if self._token is not None:
+            try:
+                _current_timings.reset(self._token)
+            except ValueError:
+                # Finished in another context than it was started in (e.g. a streamed response).
+                _current_timings.set(None)
+            self._token = None
+        total = timings.finish()
+        for stage, seconds in timings.stages.items():
+            STAGE_DURATIONS.get(stage).observe(seconds)
+        STAGE_DURATIONS.get('total').observe(total)
+        return timings
+
+
+class SlowRequestLog:
+    """ Log requests slower than `threshold` seconds, with their timing breakdown, one line per request.
+
+    Args:
+        threshold: Minimum total duration (seconds) for a request to be logged.
+        filename: Append to this file; None = write to `stream`.
+        stream: The stream to write to if no filename is given, e.g. sys.stderr.
+
+    """
+
+    def __init__(self, threshold=1.0, filename=None, stream=None):
+        self.threshold = threshold
+        self.filename = filename
+        self.stream = stream
+        self.count = 0
+        self._lock = threading.Lock()  # Only used for slow requests.
+
+    def log(self, method, path, status, timings):
+        """ Log the request if it was slow; returns True if it was logged. """
+        if timings.total is None or timings.total < self.threshold:
+            return False
+        line = (f"{datetime.datetime.now().isoformat(timespec='milliseconds')} SLOW {method} {path} {status}"
+                f" {timings.format()}\n")
+        with self._lock:
+            self.count += 1
+            if self.filename:
+                with open(self.filename, 'a', encoding='utf-8') as fh:
+                    fh.write(line)
+            elif self.stream is not None:
+                self.stream.write(line)
+                self.stream.flush()
+        return True
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2**53:
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_samples(name, metric, labels):
+    """ Yield the sample lines for a single (unlabeled or labeled) metric. """
+    label_str = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+    if isinstance(metric, Histogram):
+        snapshot = metric.snapshot()
+        for bound, count in snapshot['buckets']:
+            le = f'le="{_format_value(bound)}"'
+            yield f"{name}_bucket{{{label_str + ',' if label_str else ''}{le}}} {count}"
+        suffix = f"{{{label_str}}}" if label_str else ""
+        yield f"{name}_sum{suffix} {_format_value(snapshot['sum'])}"
+        yield f"{name}_count{suffix} {snapshot['count']}"
+        return
+    value = metric.value() if isinstance(metric, Counter) else metric
+    yield f"{name}{{{label_str}}} {_format_value(value)}" if label_str else f"{name} {_format_value(value)}"
+
+
+def format_prometheus(families):
+    """ Format metrics in the Prometheus text exposition format.
+
+    Args:
+        families: Iterable of (name, type, help, metric, label_name) tuples, where `type` is 'counter', 'gauge',
+            or 'histogram', and `metric` is a `Counter`, `Histogram`, or number (e.g. for gauges computed when the
+            metrics are requested). For labeled metrics, `metric` is a `Labeled` or a dict of label value -> metric,
+            and `label_name` is the name of the label, e.g. 'route'; otherwise `label_name` is None.
+
+    Returns:
+        str
+    """
+    lines = []
+    for name, kind, help_text, metric, label_name in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if label_name is None:
+            lines.extend(_format_samples(name, metric, ()))
+        else:
+            items = metric.items() if isinstance(metric, Labeled) else sorted(metric.items())
+            for label_value, labeled_metric in items:
+                lines.extend(_format_samples(name, labeled_metric, ((label_name, label_value),)))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,43 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Logging setup for the `zepto_eln` package.
+
+All modules log to `logging.getLogger(__name__)`, i.e. loggers below the 'zepto_eln' logger.
+Per-document and per-request details (e.g. the file info, YFM text, and template lookups) are logged at
+DEBUG level, using lazy %-formatting (and `logger.isEnabledFor()` guards where the arguments themselves are
+expensive to produce), so running at INFO level costs (almost) nothing for the debug output.
+
+"""
+
+import sys
+import logging
+
+PACKAGE_LOGGER_NAME = 'zepto_eln'
+
+DEFAULT_LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+def configure_logging(level='INFO', fmt=DEFAULT_LOG_FORMAT, stream=None):
+    """ Set the log level of the 'zepto_eln' logger, and make sure its messages are written somewhere.
+
+    If the logging system has not been configured by the application (i.e. the root logger has no handlers,
+    e.g. when not running under gunicorn with a logging config), a stream handler is added to the
+    'zepto_eln' logger. Calling this more than once only updates the level.
+
+    Args:
+        level: Log level, e.g. 'DEBUG', 'INFO', 'WARNING', or a `logging` level number.
+        fmt: Log record format, used if a handler is added.
+        stream: The stream for the added handler; default is sys.stderr.
+
+    Returns:
+        The 'zepto_eln' logger.
+    """
+    logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+        handler.setFormatter(logging.Formatter(fmt))
+        logger.addHandler(handler)
+    return logger
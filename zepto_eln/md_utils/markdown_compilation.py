@@ -36,16 +36,32 @@ Python-Markdown extensions: https://python-markdown.github.io/extensions/
 """
 
 import sys
+import logging
+import threading
 import requests
 import markdown
-import pdb
 
-from .document_io import load_document
+from .document_io import load_document, file_signature
 from .pico_utils import substitute_pico_variables
 from .templating import apply_template_file_to_document
+from .output_writer import write_output_file
+from .instrumentation import timed
+
+logger = logging.getLogger(__name__)
 
 GITHUB_API_URL = 'https://api.github.com'
 
+DEFAULT_MARKDOWN_EXTENSIONS = (
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.attr_list',
+    'markdown.extensions.tables',
+    'markdown.extensions.sane_lists',
+    # 'markdown.extensions.toc',
+)
+
+# Per-thread cache of `markdown.Markdown` converters, keyed by extension set:
+_converters = threading.local()
+
 
 def github_markdown(markdown, verbose=None):
     """ Takes raw markdown, returns html result from GitHub api """
@@ -56,6 +72,33 @@ def github_markdown(markdown, verbose=None):
     return res.text
 
 
+def get_markdown_converter(extensions=None):
+    """ Get a reusable `markdown.Markdown` converter instance for the given extensions.
+
+    Creating a `Markdown` instance loads and configures all extensions, which is relatively expensive.
+    Instead, we keep one instance per thread and extension set, and `reset()` it before each conversion.
+    `Markdown` instances are not thread-safe, hence the per-thread cache.
+
+    Args:
+        extensions: A list of extensions (names or instances), or None for the default extensions set.
+
+    Returns:
+        markdown.Markdown instance (already reset and ready to use).
+
+    """
+    if extensions is None:
+        extensions = DEFAULT_MARKDOWN_EXTENSIONS
+    key = tuple(ext if isinstance(ext, str) else id(ext) for ext in extensions)
+    try:
+        cache = _converters.cache
+    except AttributeError:
+        cache = _converters.cache = {}
+    converter = cache.get(key)
+    if converter is None:
+        converter = cache[key] = markdown.Markdown(extensions=list(extensions))
+    return converter.reset()
+
+
 def compile_markdown_to_html(content, parser='python-markdown', extensions=None, template=None, template_type='jinja'):
     """ Convert markdown to HTML, using the specified parser/generator.
 
@@ -76,16 +119,8 @@ def compile_markdown_to_html(content, parser='python-markdown', extensions=None,
     if parser is None:
         parser = 'python-markdown'
     if parser == 'python-markdown':
-        if extensions is None:
-            extensions = [
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.attr_list',
-                'markdown.extensions.tables',
-                'markdown.extensions.sane_lists',
-                # 'markdown.extensions.toc',
-            ]
-        print("\nExtensions:", extensions)
-        html_content = markdown.markdown(content, extensions=extensions)
+        logger.debug("Compiling Markdown with python-markdown, extensions: %s", extensions)
+        html_content = get_markdown_converter(extensions).convert(content)
     elif parser in ('github', 'ghmarkdown'):
         try:
             # Try to use the `ghmarkdown` package, and fall back to a primitive github api call
@@ -99,50 +134,43 @@ def compile_markdown_to_html(content, parser='python-markdown', extensions=None,
     return html_content
 
 
-def compile_markdown_document(
-        path, outputfn="{filepath_noext}.html",
-        parser='python-markdown', extensions=None,
-        do_pico_substitution=True, do_apply_template=True,
-        template_type='jinja2', template=None, template_dir=None, default_template_name='index',
-        template_vars=None,
-):
-    """ Compile a single markdown file and apply template, return compiled HTML, optionally save HTML output to a file.
+def parse_markdown_document(path, parser='python-markdown', extensions=None, do_pico_substitution=True):
+    """ Load a markdown file and compile the Markdown content to HTML, without applying a template.
+
+    The parsed document can be kept (e.g. by a watch-mode builder), and `apply_document_template()` can be
+    applied repeatedly to it when only the templates or template variables (navigation tree) have changed.
 
     Args:
         path: Filepath to the markdown file.
-        outputfn: Save compiled HTML to this file. If '-', write HTML to stdout.
         parser: The Markdown parser to use to generate HTML.
         extensions: The Markdown extensions to use when compiling HTML.
         do_pico_substitution: Do Pico substitutions on the Markdown before compiling Markdown to HTML.
-        do_apply_template: Apply a template (e.g. Jinja template).
-        template_type: The templating system to use, e.g. 'jinja2'.
-        template: The template (name or filename) to apply.
-        template_dir: The directory to look for, if template is a name (rather than a file).
-        default_template_name: The default template (name) to apply.
 
     Returns:
-        HTML-compiled markdown.
-
-    C.f. rsenv.eln.eln_md_to_html
-
-    Returns:
-        Document dict, with 'html' entry storing the compiled HTML.
-
+        Document dict, with 'html_content' entry storing the HTML-compiled Markdown content.
+        The signature of the Markdown source is recorded in document['source_dependencies'].
     """
+    # Take the source signature before reading, so changes made while compiling makes the result stale:
+    source_signature = file_signature(path)
     document = load_document(path)  # dict with 'content', 'meta', 'filename', etc.
+    document['source_dependencies'] = {path: source_signature}
 
     if not document['content']:
-        print("ERROR: document['content'] is %r; this shouldn't happen!" % (document['content'],), file=sys.stderr)
-        pdb.set_trace()
+        # E.g. a new, still empty document, or one with only front matter; compile it as an empty page:
+        logger.warning("Document %s has no content (%r); compiling an empty document.", path, document['content'])
+        document['content'] = ''
 
     if do_pico_substitution:
         # Perform %pico_variable% substitution:
-        print("Performing %pico_variable% substitution...", file=sys.stderr)
-        pico_vars = document.copy()
-        pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
-        document['content'] = substitute_pico_variables(document['content'], template_vars=pico_vars, errors='print')
-
-    html_content = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
+        logger.debug("Performing %pico_variable% substitution...")
+        with timed('pico'):
+            pico_vars = document.copy()
+            pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
+            document['content'] = substitute_pico_variables(
+                document['content'], template_vars=pico_vars, errors='log')
+
+    with timed('markdown'):
+        html_content = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
     document['html_content_raw'] = html_content
     document['html_content'] = html_content
     document['html_body'] = html_content
@@ -154,14 +182,84 @@ def compile_markdown_document(
     if document['meta'].get('yfm_err_detail'):
         document['meta']['yfm_err_detail_html'] = compile_markdown_to_html(
             document['meta']['yfm_err_detail'], parser=parser, extensions=extensions)
+    return document
+
 
+def apply_document_template(
+        document, do_apply_template=True,
+        template_type='jinja2', template=None, template_dir=None, default_template_name='index',
+        template_vars=None, template_bytecode_cache_dir=None,
+):
+    """ Apply template to a document from `parse_markdown_document()`, updating document['html'].
+
+    Args:
+        document: The parsed document.
+        do_apply_template: Apply a template (e.g. Jinja template); if False, the HTML is just the compiled content.
+        template_type, template, template_dir, default_template_name, template_vars, template_bytecode_cache_dir:
+            See `compile_markdown_document()`.
+
+    Returns:
+        HTML (str). The files the HTML depends on (source and templates) are recorded in document['dependencies'].
+    """
+    document['dependencies'] = dict(document['source_dependencies'])
     if do_apply_template:
         # apply_template_file_to_document updates document['html']
         html = apply_template_file_to_document(
             document, template_type=template_type, template=template, template_dir=template_dir,
-            default_template_name=default_template_name, template_vars=template_vars)
+            default_template_name=default_template_name, template_vars=template_vars,
+            bytecode_cache_dir=template_bytecode_cache_dir)
+        for template_file in document['template_files']:
+            document['dependencies'][template_file] = file_signature(template_file)
     else:
-        html = document['html'] = html_content
+        html = document['html'] = document['html_content']
+        document['template_files'] = []
+        document['template_variables'] = set()
+    return html
+
+
+def compile_markdown_document(
+        path, outputfn="{filepath_noext}.html",
+        parser='python-markdown', extensions=None,
+        do_pico_substitution=True, do_apply_template=True,
+        template_type='jinja2', template=None, template_dir=None, default_template_name='index',
+        template_vars=None, write_policy='if-changed', template_bytecode_cache_dir=None,
+):
+    """ Compile a single markdown file and apply template, return compiled HTML, optionally save HTML output to a file.
+
+    Args:
+        path: Filepath to the markdown file.
+        outputfn: Save compiled HTML to this file. If '-', write HTML to stdout.
+        write_policy: How to write `outputfn`: 'always', 'if-changed' (default), or 'deferred'.
+            See `output_writer` module.
+        parser: The Markdown parser to use to generate HTML.
+        extensions: The Markdown extensions to use when compiling HTML.
+        do_pico_substitution: Do Pico substitutions on the Markdown before compiling Markdown to HTML.
+        do_apply_template: Apply a template (e.g. Jinja template).
+        template_type: The templating system to use, e.g. 'jinja2'.
+        template: The template (name or filename) to apply.
+        template_dir: The directory to look for, if template is a name (rather than a file).
+        default_template_name: The default template (name) to apply.
+        template_bytecode_cache_dir: Directory to cache compiled templates in (optional).
+
+    Returns:
+        HTML-compiled markdown.
+
+    C.f. rsenv.eln.eln_md_to_html
+
+    Returns:
+        Document dict, with 'html' entry storing the compiled HTML.
+        The files the compiled HTML depends on are recorded in document['dependencies'], as a dict of
+        filepath -> (mtime_ns, size): The Markdown source, and the applied template (incl. included templates).
+        The variables used by the templates (e.g. 'navigation_tree') are recorded in document['template_variables'].
+
+    """
+    document = parse_markdown_document(
+        path, parser=parser, extensions=extensions, do_pico_substitution=do_pico_substitution)
+    html = apply_document_template(
+        document, do_apply_template=do_apply_template,
+        template_type=template_type, template=template, template_dir=template_dir,
+        default_template_name=default_template_name, template_vars=template_vars,
+        template_bytecode_cache_dir=template_bytecode_cache_dir)
 
     if outputfn:
         if outputfn == '-':
@@ -170,9 +268,9 @@ def compile_markdown_document(
             fmt_params = document['fileinfo'].copy()
             fmt_params.update(document['meta'])
             outputfn = outputfn.format(**fmt_params)
-            with open(outputfn, mode='w', encoding='utf-8') as fd:
-                print("Writing HTML to file:", outputfn)
-                fd.write(html)
+            logger.debug("Writing HTML to file: %s", outputfn)
+            with timed('write'):
+                write_output_file(outputfn, html, write_policy=write_policy)
 
     return document
 
@@ -182,6 +280,7 @@ def compile_markdown_file_to_html(
         do_pico_substitution=True, do_apply_template=True,
         parser='python-markdown', extensions=None,
         template_type='jinja2', template=None, template_dir=None, default_template_name='index',
+        write_policy='if-changed',
 ):
     """
 
@@ -196,6 +295,6 @@ def compile_markdown_file_to_html(
         path=path, outputfn=outputfn, do_pico_substitution=do_pico_substitution, do_apply_template=do_apply_template,
         parser=parser, extensions=extensions,
         template_type=template_type, template=template, template_dir=template_dir,
-        default_template_name=default_template_name,
+        default_template_name=default_template_name, write_policy=write_policy,
     )
     return document['html']
@@ -0,0 +1,224 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Persistent (on-disk) index of document metadata, using SQLite.
+
+The index stores the YAML front-matter fields of every Markdown document within a document root,
+so documents can be looked up by metadata field, e.g. `expid: RS532`, with a single indexed query
+instead of parsing every document in the tree.
+
+The index is updated incrementally: Only documents whose mtime or size have changed since they were
+last indexed are parsed again, and documents that no longer exist are removed.
+
+Tables:
+* documents: path (relative to the document root, with forward slashes), basename, mtime_ns, size.
+* fields: path, key, value - one row per YFM field (and one row per item for list values).
+
+Only scalar values (and lists of scalar values) are indexed. Values are stored as strings,
+and compared case-insensitively.
+
+Updates can be run in a background thread (`schedule_update()`, `start_background_updates()`), so lookups
+never have to wait for a scan of the document root. The database lock is only held while reading and
+writing rows, not while scanning the tree and parsing changed documents.
+
+"""
+
+import os
+import logging
+import datetime
+import sqlite3
+import threading
+import time
+
+from .document_io import scan_md_files
+from .indexing import build_metadata_index
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    basename TEXT,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS fields (
+    path TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS fields_key_value ON fields (key, value);
+CREATE INDEX IF NOT EXISTS fields_path ON fields (path);
+"""
+
+INDEXED_VALUE_TYPES = (str, int, float, bool, datetime.date)
+
+
+def get_default_index_file(basedir):
+    """ Return the default index file for a given document root, in the user's cache directory.
+
+    The index is not stored within the document root, since the document root is often synced
+    (e.g. by Dropbox), and syncing a database file while it is being written is a bad idea.
+    """
+    import hashlib
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    root_hash = hashlib.sha1(os.path.abspath(basedir).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, 'zepto_eln', f'metadata_index_{root_hash}.sqlite')
+
+
+def _field_rows(path, meta):
+    """ Yield (path, key, value) rows for all indexable fields in the metadata dict. """
+    for key, value in meta.items():
+        if key.startswith('yfm_err'):
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for value in values:
+            if isinstance(value, INDEXED_VALUE_TYPES):
+                yield path, str(key), str(value)
+
+
+class MetadataIndex:
+    """ Persistent SQLite index of the YFM metadata of all documents within `basedir`.
+
+    Args:
+        basedir: The document root.
+        index_file: The SQLite database file. Defaults to a per-document-root file in the user's cache dir.
+        processes: Number of processes used to parse changed documents, see `build_metadata_index`.
+        timeout: Seconds to wait for a lock on the database file, e.g. held by another server process.
+
+    """
+
+    def __init__(self, basedir, index_file=None, processes=1, timeout=30):
+        self.basedir = basedir
+        self.index_file = index_file or get_default_index_file(basedir)
+        self.processes = processes
+        self.last_updated = None  # time.monotonic() of last update, or None if not updated by this process.
+        if self.index_file != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+        self._conn = sqlite3.connect(self.index_file, check_same_thread=False, timeout=timeout)
+        if self.index_file != ':memory:':
+            # Readers (e.g. other worker processes) are not blocked while an update is being written:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()  # Guards the connection.
+        self._update_lock = threading.Lock()  # Only one update at a time.
+        self._schedule_lock = threading.Lock()
+        self._update_pending = False
+        self._update_thread = None
+        self._closed = threading.Event()
+
+    def _relpath(self, filepath):
+        return os.path.relpath(filepath, self.basedir).replace(os.sep, '/')
+
+    def update(self):
+        """ Update the index: (re-)index new and changed documents, and remove deleted documents.
+
+        The document root is scanned, and changed documents parsed, without holding the database lock,
+        so lookups are not blocked while the index is being updated.
+
+        Returns:
+            dict with number of 'added_or_changed' and 'removed' documents, and 'time' (seconds).
+        """
+        t_start = time.perf_counter()
+        with self._update_lock:
+            with self._lock:
+                indexed = {path: (mtime_ns, size) for path, mtime_ns, size
+                           in self._conn.execute("SELECT path, mtime_ns, size FROM documents")}
+            changed = {}  # filepath -> (relpath, mtime_ns, size)
+            found = set()
+            for filepath in scan_md_files(self.basedir):
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                relpath = self._relpath(filepath)
+                found.add(relpath)
+                if indexed.get(relpath) != (st.st_mtime_ns, st.st_size):
+                    changed[filepath] = (relpath, st.st_mtime_ns, st.st_size)
+            removed = [path for path in indexed if path not in found]
+
+            metadata, _ = build_metadata_index(
+                filepaths=list(changed), processes=self.processes, add_fileinfo_to_meta=False)
+            with self._lock, self._conn:  # transaction
+                stale = [(path,) for path in removed] + [(relpath,) for relpath, _, _ in changed.values()]
+                self._conn.executemany("DELETE FROM documents WHERE path = ?", stale)
+                self._conn.executemany("DELETE FROM fields WHERE path = ?", stale)
+                for filepath, meta in metadata.items():
+                    relpath, mtime_ns, size = changed[filepath]
+                    self._conn.execute(
+                        "INSERT INTO documents (path, basename, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                        (relpath, os.path.basename(filepath), mtime_ns, size))
+                    self._conn.executemany(
+                        "INSERT INTO fields (path, key, value) VALUES (?, ?, ?)", _field_rows(relpath, meta))
+            self.last_updated = time.monotonic()
+        return {'added_or_changed': len(metadata), 'removed': len(removed), 'time': time.perf_counter() - t_start}
+
+    def update_if_stale(self, max_age):
+        """ Update the index if it hasn't been updated (by this process) within the last `max_age` seconds. """
+        if self.last_updated is None or time.monotonic() - self.last_updated > max_age:
+            return self.update()
+
+    def schedule_update(self, min_interval=0):
+        """ Update the index in a background thread, and return immediately.
+
+        If an update is already running, another update is run after it completes, so changes made
+        while the running update was scanning the document root are not missed.
+
+        Args:
+            min_interval: Do nothing if the index has been updated within the last `min_interval` seconds.
+        """
+        if self._closed.is_set():
+            return
+        if self.last_updated is not None and time.monotonic() - self.last_updated < min_interval:
+            return
+        with self._schedule_lock:
+            self._update_pending = True
+            if self._update_thread is None:
+                self._update_thread = threading.Thread(
+                    target=self._run_scheduled_updates, name='metadata-index-update', daemon=True)
+                self._update_thread.start()
+
+    def _run_scheduled_updates(self):
+        while True:
+            with self._schedule_lock:
+                if not self._update_pending or self._closed.is_set():
+                    self._update_thread = None
+                    return
+                self._update_pending = False
+            try:
+                stats = self.update()
+                logger.debug("Metadata index updated: %s", stats)
+            except Exception:
+                logger.exception("Error updating metadata index for %s", self.basedir)
+
+    def start_background_updates(self, interval):
+        """ Start a daemon thread calling `schedule_update()` every `interval` seconds, until `close()`. """
+        def run():
+            while not self._closed.wait(interval):
+                self.schedule_update()
+        thread = threading.Thread(target=run, name='metadata-index-timer', daemon=True)
+        thread.start()
+        return thread
+
+    def lookup(self, key, value):
+        """ Find documents where metadata field `key` has the given value (case-insensitive).
+
+        Returns:
+            List of document paths (relative to basedir, with forward slashes), most recently modified first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT documents.path FROM fields JOIN documents ON fields.path = documents.path"
+                " WHERE fields.key = ? AND fields.value = ? ORDER BY documents.mtime_ns DESC",
+                (key, str(value))).fetchall()
+        return [path for path, in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self):
+        self._closed.set()
+        with self._update_lock, self._lock:
+            self._conn.close()
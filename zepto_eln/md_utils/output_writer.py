@@ -0,0 +1,200 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Module for writing compiled output (e.g. HTML) files.
+
+Writing the compiled HTML on every page view makes every read a write, which is especially bad
+when the document root is synced by e.g. Dropbox. Write policies:
+
+* 'always': Always write the file (atomically).
+* 'if-changed': Only write the file if the content has changed, compared by content hash.
+    If the content is unchanged, the file's mtime is updated ("touched"), so the mtime still tells
+    when the file was last known to be current (which the on-disk compiled pages cache relies on).
+* 'deferred': Like 'if-changed', but the write is done by a background writer thread,
+    which coalesces repeated writes to the same file.
+
+Files are written atomically, by writing to a temporary file in the same directory
+and then renaming it to the final filename, so readers never see a partially written file.
+
+"""
+
+import os
+import atexit
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+
+from .instrumentation import OUTPUT_BYTES_WRITTEN, OUTPUT_FILES_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+WRITE_POLICIES = ('always', 'if-changed', 'deferred')
+
+# Process umask, used to give atomically-written files the same permissions as files created with `open()`:
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Content digests of files we have written or checked: filepath -> (mtime_ns, size, digest)
+_file_digests = {}
+
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=20).digest()
+
+
+def write_bytes_atomic(filepath, data):
+    """ Write `data` to `filepath` atomically (write to temporary file, then rename). """
+    dirname, basename = os.path.split(filepath)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or '.', prefix=f'.{basename}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        try:
+            mode = os.stat(filepath).st_mode & 0o7777
+        except OSError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, filepath)
+        OUTPUT_BYTES_WRITTEN.inc(len(data))
+        OUTPUT_FILES_WRITTEN.inc()
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_if_changed(filepath, text, encoding='utf-8', force=False, touch=True):
+    """ Write `text` to `filepath` atomically, but only if the file content is different.
+
+    Args:
+        filepath: The file to write.
+        text: The text (str) or data (bytes) to write.
+        encoding: The encoding to use if `text` is a str.
+        force: Write the file even if the content is unchanged.
+        touch: If the content is unchanged, update the file's mtime instead of writing it.
+
+    Returns:
+        True if the file was written, False if the file already had the given content.
+    """
+    data = text.encode(encoding) if isinstance(text, str) else text
+    digest = content_digest(data)
+    if not force:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            st = None
+        if st is not None and st.st_size == len(data):
+            known = _file_digests.get(filepath)
+            if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+                existing_digest = known[2]
+            else:
+                # We don't know the file's digest (or the file was changed by someone else); read and hash:
+                with open(filepath, 'rb') as fh:
+                    existing_digest = content_digest(fh.read())
+                _file_digests[filepath] = (st.st_mtime_ns, st.st_size, existing_digest)
+            if existing_digest == digest:
+                if touch:
+                    os.utime(filepath)
+                    st = os.stat(filepath)
+                    _file_digests[filepath] = (st.st_mtime_ns, st.st_size, digest)
+                return False
+    write_bytes_atomic(filepath, data)
+    st = os.stat(filepath)
+    _file_digests[filepath] = (st.st_mtime_ns, st.st_size, digest)
+    return True
+
+
+class BackgroundWriter:
+    """ Background writer thread, writing files with `write_if_changed`.
+
+    Writes are delayed by `delay` seconds, and repeated writes to the same file within that time are
+    coalesced, so only the latest content is written.
+
+    Args:
+        delay: Time (in seconds) to wait before writing, allowing writes to be batched and coalesced.
+    """
+
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self._pending = {}  # filepath -> (text, encoding, submitted_time)
+        self._cond = threading.Condition()
+        self._busy = False
+        self._thread = threading.Thread(target=self._run, name='zepto-eln-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, filepath, text, encoding='utf-8'):
+        """ Schedule `text` to be written to `filepath`, replacing any pending write to the same file. """
+        with self._cond:
+            submitted = self._pending[filepath][2] if filepath in self._pending else time.monotonic()
+            self._pending[filepath] = (text, encoding, submitted)
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """ Block until all pending writes have been written. """
+        with self._cond:
+            for filepath in self._pending:
+                text, encoding, _ = self._pending[filepath]
+                self._pending[filepath] = (text, encoding, float('-inf'))
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                oldest = min(submitted for _, _, submitted in self._pending.values())
+                wait = oldest + self.delay - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                batch, self._pending = self._pending, {}
+                self._busy = True
+            for filepath, (text, encoding, _) in batch.items():
+                try:
+                    write_if_changed(filepath, text, encoding=encoding)
+                except OSError as exc:
+                    logger.error("Error writing file %r: %r", filepath, exc)
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+_background_writer = None
+_background_writer_lock = threading.Lock()
+
+
+def get_background_writer():
+    """ Return the shared background writer, starting it if needed. """
+    global _background_writer
+    with _background_writer_lock:
+        if _background_writer is None:
+            _background_writer = BackgroundWriter()
+        return _background_writer
+
+
+def write_output_file(filepath, text, write_policy='if-changed', encoding='utf-8'):
+    """ Write `text` to `filepath` according to the given write policy.
+
+    Args:
+        filepath: The file to write.
+        text: The content to write.
+        write_policy: One of 'always', 'if-changed', or 'deferred', see module docstring.
+        encoding: Text encoding.
+
+    Returns:
+        True if the file was written, False if unchanged, or None if the write was deferred.
+    """
+    if write_policy == 'always':
+        return write_if_changed(filepath, text, encoding=encoding, force=True)
+    elif write_policy == 'if-changed':
+        return write_if_changed(filepath, text, encoding=encoding)
+    elif write_policy == 'deferred':
+        get_background_writer().submit(filepath, text, encoding=encoding)
+        return None
+    raise ValueError(f"write_policy={write_policy!r} - value not recognized; must be one of {WRITE_POLICIES}.")
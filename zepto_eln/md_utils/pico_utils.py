@@ -6,19 +6,22 @@ Module for dealing with `Pico` markdown stuff, mostly just %variable% substituti
 
 """
 
-import sys
 import re
+import logging
 from collections import defaultdict
 
+logger = logging.getLogger(__name__)
+
 NODEFAULT = object()
 
+PICO_VARIABLE_REGEX = r"%[\w\.]+%"
+_pico_variable_pattern = re.compile(PICO_VARIABLE_REGEX)
+
 
-def pico_find_variable_placeholders(content, pat=r"%[\w\.]+%"):
+def pico_find_variable_placeholders(content, pat=_pico_variable_pattern):
     if isinstance(pat, str):
         pat = re.compile(pat)
-    print("type(content):", type(content))
     res = pat.findall(content)
-    print("type(res):", type(res))
     return set(res)  # Set to remove duplicates
 
 
@@ -59,40 +62,62 @@ def get_attrs_string_value(dct, attrs, default=NODEFAULT):
 
 
 def substitute_pico_variables(content, template_vars, errors='pass', varfmt="{sub}"):
-    """ Perform Pico-style %variable% substitution. """
+    """ Perform Pico-style %variable% substitution.
+
+    All placeholders are substituted in a single `re.sub` pass over the content,
+    and each unique placeholder is only resolved once.
+
+    Args:
+        content: The text (Markdown) with %variable.attribute% placeholders.
+        template_vars: dict with variables, e.g. the document with 'meta' entry.
+        errors: What to do if a placeholder cannot be resolved: 'raise', 'log' (or 'print'), or 'pass'.
+            Unresolved placeholders are left as-is.
+        varfmt: Format string for the substituted values, or a dict of varname -> format string.
+
+    Returns:
+        content with placeholders substituted.
+    """
     # variable members are available as %variable.attribute%
-    # Two approaches:
-    #   a. Extract variables from document and substitute them. [we use this one]
-    #   b. Generate all possible variable placeholder strings and do str.replace(placeholder, value).
-    placeholders = pico_find_variable_placeholders(content)
     if isinstance(varfmt, str):
         _varfmt = varfmt
         varfmt = defaultdict(lambda: _varfmt)
-    for placeholder in placeholders:
-        # Note: We probably shouldn't do replacements inside comments, but whatever.
-        varname = placeholder.strip('%')
+    resolved = {}  # placeholder -> substitution (or None if the placeholder could not be resolved).
+
+    def resolve(match):
+        placeholder = match.group(0)
         try:
-            print(f" - Trying to replace varname {varname!r}", file=sys.stderr)
-            sub = get_attrs_string_value(template_vars, varname)
-        except KeyError as exc:
-            # E.g. if you have a comment explaining %meta.variable%:
-            if errors == 'raise':
-                raise exc
-            elif errors == 'print':
-                print(f"{exc.__class__.__name__}: {exc}")
-            elif errors == 'pass':
-                pass
-            else:
-                raise ValueError(f"Value {errors!r} for parameter `errors` not recognized.")
+            sub = resolved[placeholder]
+        except KeyError:
+            sub = resolved[placeholder] = _resolve_placeholder(placeholder, template_vars, errors, varfmt)
+        return placeholder if sub is None else sub
+
+    # Note: We probably shouldn't do replacements inside comments, but whatever.
+    return _pico_variable_pattern.sub(resolve, content)
+
+
+def _resolve_placeholder(placeholder, template_vars, errors, varfmt):
+    """ Return the substitution string for a single placeholder, or None if it could not be resolved. """
+    varname = placeholder.strip('%')
+    try:
+        sub = get_attrs_string_value(template_vars, varname)
+    except KeyError as exc:
+        # E.g. if you have a comment explaining %meta.variable%:
+        if errors == 'raise':
+            raise exc
+        elif errors in ('log', 'print'):
+            logger.debug("Could not resolve %s: %s: %s", placeholder, exc.__class__.__name__, exc)
+        elif errors == 'pass':
+            pass
         else:
-            print(f"Replacing {placeholder!r} -> {sub!r}")
-            # sub can be e.g. lists or dicts; the format string can be customized for each variable.
-            content = content.replace(placeholder, varfmt[varname].format(sub, var=sub, sub=sub))
-    return content
+            raise ValueError(f"Value {errors!r} for parameter `errors` not recognized.")
+        return None
+    logger.debug("Replacing %r -> %r", placeholder, sub)
+    # sub can be e.g. lists or dicts; the format string can be customized for each variable.
+    return varfmt[varname].format(sub, var=sub, sub=sub)
 
 
 def document_substitute_pico_vars(document):
     # Perform %pico_variable% substitution:
     pico_vars = document.copy()
     pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
-    document['content'] = substitute_pico_variables(document['content'], template_vars=pico_vars, errors='print')
+    document['content'] = substitute_pico_variables(document['content'], template_vars=pico_vars, errors='log')
@@ -0,0 +1,194 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Request coalescing ("single-flight"): When many requests for the same page arrive at once
+(e.g. everyone opening the same experiment page during a lab meeting), only one of them should
+compile the page, and the others should wait for its result.
+
+* Within a process, the first caller for a key (the leader) runs the function, and concurrent callers
+    for the same key wait for the leader and share its result (or exception).
+* Across processes (e.g. multiple gunicorn workers), if a `lock_dir` is given, the leader of each process
+    also takes an exclusive lock on the key's lock file in `lock_dir`, so only one process works on a key
+    at a time.
+    A process that had to wait for the lock can check (with `after_wait`) whether the other process'
+    result is available, e.g. as a freshly written `.html` file, instead of doing the work again.
+    Either way, the work and the file writes of the processes no longer race.
+
+File locks use `fcntl.flock` (POSIX) or `msvcrt.locking` (Windows). Lock files are not deleted, since removing
+a lock file another process is waiting on would break the lock. Instead, keys are hashed into a fixed number
+of lock "stripes" (lock files), so the number of lock files is bounded, regardless of the number of pages.
+Two keys sharing a stripe are worked on one at a time, which is rare with enough stripes, and harmless.
+
+"""
+
+import os
+import hashlib
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def get_default_lock_dir():
+    """ Return the default lock file directory, in the user's cache directory. """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'zepto_eln', 'locks')
+
+
+def _lock_fd(fd):
+    """ Take an exclusive lock on the open file `fd`, blocking until it is available.
+
+    Returns:
+        True if we had to wait for another process to release the lock.
+    """
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return True
+    if msvcrt is not None:
+        waited = False
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return waited
+            except OSError:
+                waited = True
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # Retries for up to 10 seconds before raising.
+                    return waited
+                except OSError:
+                    continue
+    return False  # No file locking available; only coalesce within the process.
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class _Call:
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Coalesce concurrent calls for the same key, so only one caller does the work.
+
+    Args:
+        lock_dir: Directory for lock files, for coalescing across processes.
+            None = only coalesce within this process.
+        lock_stripes: The number of lock files in `lock_dir`; keys are hashed into these.
+
+    Attributes:
+        calls: The number of calls to `do()`.
+        shared: The number of calls that got the result of another (concurrent) call in this process.
+        lock_waits: The number of calls that had to wait for the release of the key's lock file
+            (by another process, or by another key sharing the lock file).
+
+    """
+
+    def __init__(self, lock_dir=None, lock_stripes=256):
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+        self.calls = 0
+        self.shared = 0
+        self.lock_waits = 0
+        self._calls = {}  # key -> _Call, for calls in progress.
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def get_lock_file(self, key):
+        """ Return the lock file used for `key` (a str); one of `lock_stripes` files. """
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).digest()
+        stripe = int.from_bytes(digest[:8], 'big') % self.lock_stripes
+        return os.path.join(self.lock_dir, f'stripe-{stripe:04x}.lock')
+
+    @contextlib.contextmanager
+    def _file_lock(self, key):
+        if not self.lock_dir:
+            yield False
+            return
+        fd = os.open(self.get_lock_file(key), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            waited = _lock_fd(fd)
+            try:
+                yield waited
+            finally:
+                _unlock_fd(fd)
+        finally:
+            os.close(fd)
+
+    def do(self, key, func, after_wait=None):
+        """ Call `func()`, unless a call for `key` is already in progress, in which case its result is returned.
+
+        Args:
+            key: The key (str) identifying the work, e.g. the path of the page to compile.
+            func: Function doing the work, called without arguments.
+                Since a previous call may have finished just before this one, `func` should check
+                for an existing result (e.g. in a cache) before doing the work.
+            after_wait: Optional function, called (without arguments) instead of `func` if we had to wait for
+                the key's lock file to be released; if it returns a value other than None, that value is
+                used as the result, and `func` is not called.
+
+        Returns:
+            (result, shared) tuple, where `shared` is True if the result was produced by another caller.
+
+        Raises:
+            Any exception raised by `func` (also in callers sharing the result).
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error.with_traceback(None)
+            return call.result, True
+        try:
+            with self._file_lock(key) as waited:
+                result = None
+                if waited:
+                    with self._lock:
+                        self.lock_waits += 1
+                    if after_wait is not None:
+                        result = after_wait()
+                if result is None:
+                    result = func()
+                call.result = result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """ Return a dict with the call counters. """
+        return {'calls': self.calls, 'shared': self.shared, 'lock_waits': self.lock_waits}
@@ -0,0 +1,622 @@
+# Copyright 2018, Rasmus S. Sorensen, rasmusscholer@gmail.com
+
+"""
+
+Static site builder: Compile all Markdown documents in a document root to HTML files,
+so the notebook can be served by a plain web server (e.g. nginx with `try_files $uri $uri.html`).
+
+Build pipeline stages:
+1. Discover: Find all Markdown files with `os.scandir` (`scan_md_files`).
+2. Plan: Compare each file against the build manifest, and only schedule pages that are out of date.
+    A page is up to date if its source, its templates, and (if the page uses it) the navigation tree
+    are unchanged since the last build, and the output file still exists.
+    Sources are compared by content hash; the hash is only re-computed if the file's (mtime_ns, size)
+    signature has changed, so an incremental build doesn't read unchanged files.
+3. Compile: Compile the scheduled pages with `compile_markdown_document`, using a process pool.
+    Pages are sent to the worker processes in chunks; the navigation tree is sent once per worker.
+    Output files are written atomically, and only if their content changed (see `output_writer`).
+4. Finalize: Remove the output of deleted sources, and write the updated manifest (atomically).
+
+The manifest is a JSON file with the source hash, templates, and output file of every page.
+By default it is stored in the user's cache directory, not in the (often synced) document root.
+Pages that fail to compile are not recorded in the manifest, so they are retried on the next build.
+
+Each stage is timed, and the stats are returned, e.g. for `format_build_stats`.
+
+`WatchBuilder` keeps the site up to date after the initial build: It keeps the parsed documents and the
+navigation tree in memory, and re-compiles only the pages affected by each file change event
+(see `fs_watcher`), measuring the latency from saving a file to the fresh HTML file.
+
+"""
+
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from .document_io import scan_md_files, file_signature
+from .markdown_compilation import compile_markdown_document, parse_markdown_document, apply_document_template
+from .templating import invalidate_templates_in_dir
+from .output_writer import write_output_file, write_bytes_atomic
+from .compression import compress, available_encodings, ENCODING_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+
+# Worker process state (template dir, navigation tree, etc.), set once per worker by `_init_worker`:
+_worker_options = {}
+
+
+def _chunks(items, chunksize):
+    for i in range(0, len(items), chunksize):
+        yield items[i:i+chunksize]
+
+
+def content_hash(data):
+    """ Return the hash (hex str) used in the build manifest for `data` (bytes). """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_hash(path):
+    """ Return the `content_hash` of a file, or None if it cannot be read. """
+    try:
+        with open(path, 'rb') as fh:
+            return content_hash(fh.read())
+    except OSError:
+        return None
+
+
+def get_default_manifest_file(output_root):
+    """ Return the default build manifest file for the given output root, in the user's cache directory. """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    root_hash = hashlib.sha1(os.path.abspath(output_root).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, 'zepto_eln', f'build_manifest_{root_hash}.json')
+
+
+def load_manifest(manifest_file):
+    """ Load a build manifest; returns an empty manifest if the file is missing, invalid, or of another format. """
+    try:
+        with open(manifest_file, encoding='utf-8') as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        manifest = None
+    if not isinstance(manifest, dict) or manifest.get('format') != MANIFEST_FORMAT:
+        manifest = {'format': MANIFEST_FORMAT, 'build_key': None, 'tree_digest': None, 'templates': {}, 'pages': {}}
+    return manifest
+
+
+def save_manifest(manifest_file, manifest):
+    """ Write the build manifest atomically. """
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+    write_bytes_atomic(manifest_file, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def _init_worker(options):
+    _worker_options.clear()
+    _worker_options.update(options)
+
+
+def _page_template_vars(relpath, navigation_tree):
+    return {
+        'navigation_tree': navigation_tree,
+        'request_path': '/' + os.path.splitext(relpath)[0],
+        'documents_root_url': '/',
+    }
+
+
+def _write_page(output_path, html, encodings):
+    """ Write a compiled page (and its compressed variants), if changed; returns True if the page was written. """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    written = write_output_file(output_path, html, write_policy='if-changed')
+    for encoding in encodings:
+        write_output_file(output_path + ENCODING_EXTENSIONS[encoding], compress(html, encoding))
+    return written
+
+
+def _make_page_record(document, signature, source_hash, output_path):
+    return {
+        'signature': list(signature) if signature else None,
+        'hash': source_hash,
+        'templates': sorted(document['template_files']),
+        'uses_navigation_tree': 'navigation_tree' in document['template_variables'],
+        'output': output_path,
+    }
+
+
+def _get_output_path(relpath, source_path, output_dir):
+    if output_dir is None:
+        return os.path.splitext(source_path)[0] + '.html'
+    return os.path.join(output_dir, *os.path.splitext(relpath)[0].split('/')) + '.html'
+
+
+def _get_build_key(template_dir, output_dir, encodings):
+    """ Key for the build options; if they change, all pages must be re-built. """
+    return content_hash(json.dumps([template_dir, output_dir, sorted(encodings)]).encode('utf-8'))
+
+
+def _get_tree_digest(navigation_tree):
+    return content_hash(json.dumps(navigation_tree, sort_keys=True, default=str).encode('utf-8'))
+
+
+def compile_pages_batch(jobs):
+    """ Compile a batch of pages (used by the worker processes, after `_init_worker`).
+
+    Args:
+        jobs: List of (relpath, source_path, output_path) tuples.
+
+    Returns:
+        List of (relpath, page record, number of bytes written or None if unchanged) tuples,
+        and list of (relpath, error message) tuples for pages that could not be compiled.
+    """
+    options = _worker_options
+    results, errors = [], []
+    for relpath, source_path, output_path in jobs:
+        try:
+            # Signature and hash are taken before compiling, so changes made while compiling makes the page stale:
+            signature = file_signature(source_path)
+            source_hash = file_hash(source_path)
+            document = compile_markdown_document(
+                path=source_path,
+                outputfn=False,
+                template_dir=options['template_dir'],
+                template_vars=_page_template_vars(relpath, options['navigation_tree']),
+                template_bytecode_cache_dir=options['template_bytecode_cache_dir'],
+            )
+            html = document['html']
+            written = _write_page(output_path, html, options['encodings'])
+        except Exception as exc:
+            errors.append((relpath, repr(exc)))
+            continue
+        record = _make_page_record(document, signature, source_hash, output_path)
+        results.append((relpath, record, len(html.encode('utf-8')) if written else None))
+    return results, errors
+
+
+def _remove_output(output_path):
+    """ Remove an output file and its compressed variants; returns the number of files removed. """
+    removed = 0
+    for path in [output_path] + [output_path + ext for ext in ENCODING_EXTENSIONS.values()]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def build_site(
+        document_root, navigation_tree=None, template_dir=None, output_dir=None,
+        processes=None, chunksize=16, encodings=(), manifest_file=None, force=False,
+        template_bytecode_cache_dir=None,
+):
+    """ Compile all Markdown documents in `document_root` to HTML files, skipping pages that are up to date.
+
+    Args:
+        document_root: The document root to build.
+        navigation_tree: The navigation tree (list of page tree nodes) passed to the templates,
+            e.g. the 'children' of `get_page_tree_recursive()`.
+        template_dir: The template directory, see `compile_markdown_document`.
+        output_dir: Write the HTML files to this directory (mirroring the document root),
+            instead of next to the Markdown files.
+        processes: Number of worker processes. None = number of CPUs; 1 = compile in the current process.
+        chunksize: Number of pages per batch sent to a worker process.
+        encodings: Also write compressed variants of each page, e.g. ('gzip', 'br'), for nginx `gzip_static`.
+        manifest_file: The build manifest file; defaults to `get_default_manifest_file(output root)`.
+        force: Re-compile all pages, ignoring the manifest.
+        template_bytecode_cache_dir: Directory to cache compiled templates in (optional).
+
+    Returns:
+        Build stats dict, with the number of pages, compiled, skipped, written and removed pages,
+        errors, per-stage timings (seconds), and throughput.
+    """
+    t_start = time.perf_counter()
+    document_root = os.path.abspath(document_root)
+    output_dir = os.path.abspath(output_dir) if output_dir else None
+    template_dir = os.path.abspath(template_dir) if template_dir else None
+    encodings = available_encodings(encodings)
+    if manifest_file is None:
+        manifest_file = get_default_manifest_file(output_dir or document_root)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    sources = {}  # relpath -> source path
+    for source_path in scan_md_files(document_root):
+        sources[os.path.relpath(source_path, document_root).replace(os.sep, '/')] = source_path
+    t_discovered = time.perf_counter()
+
+    manifest = load_manifest(manifest_file)
+    build_key = _get_build_key(template_dir, output_dir, encodings)
+    tree_digest = _get_tree_digest(navigation_tree)
+    old_pages = manifest['pages'] if manifest['build_key'] == build_key and not force else {}
+    tree_changed = manifest['tree_digest'] != tree_digest
+    # Templates are few and small, so they are always hashed:
+    old_templates = manifest['templates']
+    changed_templates = {path for path, digest in old_templates.items() if file_hash(path) != digest}
+
+    pages, jobs = {}, []
+    for relpath, source_path in sorted(sources.items()):
+        output_path = _get_output_path(relpath, source_path, output_dir)
+        record = old_pages.get(relpath)
+        if record is not None and record['output'] == output_path and os.path.isfile(output_path) and not (
+                (record['uses_navigation_tree'] and tree_changed)
+                or changed_templates.intersection(record['templates'])):
+            signature = file_signature(source_path)
+            if signature is not None and list(signature) == record['signature']:
+                pages[relpath] = record
+                continue
+            source_hash = file_hash(source_path)
+            if source_hash is not None and source_hash == record['hash']:
+                # E.g. touched, or synced by Dropbox: Content unchanged, only the signature needs updating.
+                pages[relpath] = dict(record, signature=list(signature))
+                continue
+        jobs.append((relpath, source_path, output_path))
+    t_planned = time.perf_counter()
+
+    errors, written, written_bytes = [], 0, 0
+    worker_options = {
+        'template_dir': template_dir,
+        'navigation_tree': navigation_tree,
+        'encodings': encodings,
+        'template_bytecode_cache_dir': template_bytecode_cache_dir,
+    }
+    with contextlib.ExitStack() as stack:
+        batches = _chunks(jobs, chunksize)
+        if processes == 1 or len(jobs) <= chunksize:
+            _init_worker(worker_options)
+            batch_results = map(compile_pages_batch, batches)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_worker, initargs=(worker_options,)))
+            batch_results = pool.map(compile_pages_batch, batches)
+        for results, batch_errors in batch_results:
+            for relpath, record, nbytes in results:
+                pages[relpath] = record
+                if nbytes is not None:
+                    written += 1
+                    written_bytes += nbytes
+            errors.extend(batch_errors)
+    t_compiled = time.perf_counter()
+
+    # Remove the output of pages whose source has been deleted (only files we have written ourselves):
+    removed = 0
+    for relpath, record in manifest['pages'].items():
+        if relpath not in sources:
+            removed += bool(_remove_output(record['output']))
+    templates = {path for record in pages.values() for path in record['templates']}
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'build_key': build_key,
+        'tree_digest': tree_digest,
+        'templates': {path: old_templates[path] if path in old_templates and path not in changed_templates
+                      else file_hash(path) for path in sorted(templates)},
+        'pages': pages,
+    }
+    save_manifest(manifest_file, manifest)
+    t_done = time.perf_counter()
+
+    total_time = t_done - t_start
+    compile_time = t_compiled - t_planned
+    return {
+        'pages': len(sources),
+        'compiled': len(jobs) - len(errors),
+        'skipped': len(sources) - len(jobs),
+        'written': written,
+        'removed': removed,
+        'errors': errors,
+        'processes': processes,
+        'chunksize': chunksize,
+        'manifest_file': manifest_file,
+        'stages': {
+            'discover': t_discovered - t_start,
+            'plan': t_planned - t_discovered,
+            'compile': compile_time,
+            'finalize': t_done - t_compiled,
+        },
+        'total_time': total_time,
+        'pages_per_second': len(jobs) / compile_time if compile_time > 0 else float('inf'),
+        'written_bytes': written_bytes,
+    }
+
+
+def format_build_stats(stats):
+    """ Format the stats returned by `build_site` as a short human-readable report. """
+    lines = [
+        f"Built {stats['pages']} pages in {stats['total_time']:.2f} s: {stats['compiled']} compiled"
+        f" ({stats['pages_per_second']:.0f} pages/s, {stats['processes']} processes, chunksize {stats['chunksize']}),"
+        f" {stats['skipped']} unchanged, {stats['written']} files written"
+        f" ({stats['written_bytes'] / 2**20:.1f} MiB), {stats['removed']} removed, {len(stats['errors'])} errors.",
+    ]
+    lines += [f" - {stage:<10} {seconds:8.3f} s" for stage, seconds in stats['stages'].items()]
+    lines += [f" - ERROR: {relpath}: {err}" for relpath, err in stats['errors']]
+    return "\n".join(lines)
+
+
+class WatchBuilder:
+    """ Incremental watch-mode builder, re-compiling only the pages affected by each file change.
+
+    Parsed documents, templates (in the long-lived Jinja environment), and the navigation tree are kept in memory:
+    * A changed Markdown file is re-parsed, and its page re-rendered.
+    * A changed template only re-renders the pages that depend on it, from the already parsed documents.
+    * Creating, deleting, or moving pages or folders rebuilds the navigation tree, and if the tree has changed,
+        re-renders the pages that use it.
+    Documents are parsed on first use, and are pre-loaded by `run()` while there are no changes to process.
+
+    For every change, the latency from saving the file (the file's mtime) until the fresh HTML has been written
+    is measured, see `latency_stats()`.
+
+    Example:
+        >>> builder = WatchBuilder(document_root, get_navigation_tree, template_dir=template_dir)
+        >>> watcher = start_file_watcher([document_root, template_dir])
+        >>> watcher.subscribe(builder.on_event)
+        >>> builder.run()  # Until `builder.stop()` is called (or KeyboardInterrupt).
+
+    Args:
+        document_root: The document root.
+        get_navigation_tree: Callable returning the current navigation tree (see `build_site`).
+        invalidate_navigation_tree: Optional callable(dirpath, recursive=False), called for directories whose
+            entries have changed before calling `get_navigation_tree` again, e.g. `PageTreeIndex.invalidate`.
+        template_dir, output_dir, encodings, template_bytecode_cache_dir: See `build_site`.
+        manifest_file: The build manifest, see `build_site`. The page dependencies are read from the manifest
+            at start, and the manifest is updated after every change, so the next `build_site` is up to date.
+        debounce: Time (seconds) to wait for more events after the first event of a change, since editors
+            often save a file in several steps (e.g. write a temporary file, then rename it).
+
+    """
+
+    def __init__(
+            self, document_root, get_navigation_tree, invalidate_navigation_tree=None,
+            template_dir=None, output_dir=None, encodings=(), template_bytecode_cache_dir=None,
+            manifest_file=None, debounce=0.05,
+    ):
+        self.document_root = os.path.abspath(document_root)
+        self.get_navigation_tree = get_navigation_tree
+        self.invalidate_navigation_tree = invalidate_navigation_tree
+        self.template_dir = os.path.abspath(template_dir) if template_dir else None
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.encodings = available_encodings(encodings)
+        self.template_bytecode_cache_dir = template_bytecode_cache_dir
+        self.manifest_file = manifest_file or get_default_manifest_file(self.output_dir or self.document_root)
+        self.debounce = debounce
+        self.latencies = collections.deque(maxlen=1000)  # Recent save-to-HTML latencies (seconds).
+        self.navigation_tree = get_navigation_tree()
+        self._sources = {
+            os.path.relpath(source_path, self.document_root).replace(os.sep, '/'): source_path
+            for source_path in scan_md_files(self.document_root)
+        }
+        self._documents = {}  # relpath -> parsed document
+        manifest = load_manifest(self.manifest_file)
+        build_key = _get_build_key(self.template_dir, self.output_dir, self.encodings)
+        self._manifest_pages = manifest['pages'] if manifest['build_key'] == build_key else {}
+        self._manifest = {
+            'format': MANIFEST_FORMAT,
+            'build_key': build_key,
+            'tree_digest': manifest['tree_digest'],
+            'templates': manifest['templates'],
+            'pages': self._manifest_pages,
+        }
+        self._events = queue.Queue()
+        self._stopped = threading.Event()
+
+    def on_event(self, event):
+        """ File watcher subscriber; queues the event for `run()`. """
+        self._events.put((time.time(), event))
+
+    def stop(self):
+        """ Stop `run()`. """
+        self._stopped.set()
+
+    def run(self):
+        """ Process change events until `stop()` is called; pre-load documents while idle. """
+        preload = iter(sorted(self._sources))
+        while not self._stopped.is_set():
+            try:
+                events = [self._events.get(block=preload is None, timeout=0.2)]
+            except queue.Empty:
+                relpath = next(preload, None) if preload is not None else None
+                if relpath is None:
+                    preload = None
+                elif relpath in self._sources and relpath not in self._documents:
+                    try:
+                        self._get_document(relpath)
+                    except Exception as exc:
+                        logger.error("Error parsing %s: %r", relpath, exc)
+                continue
+            time.sleep(self.debounce)
+            while True:
+                try:
+                    events.append(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            stats = self.process_events(events)
+            if stats['rendered'] or stats['removed'] or stats['errors']:
+                logger.info("%s", format_update_stats(stats))
+
+    def _relpath(self, path):
+        """ Return the path relative to the document root (with '/' separators), or None if outside the root. """
+        relpath = os.path.relpath(path, self.document_root)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return None
+        return '' if relpath == os.curdir else relpath.replace(os.sep, '/')
+
+    def _get_document(self, relpath, reparse=False):
+        document = self._documents.get(relpath)
+        if document is None or reparse:
+            document = self._documents[relpath] = parse_markdown_document(self._sources[relpath])
+        return document
+
+    def _render_page(self, relpath, reparse=False):
+        """ Render a page, from the parsed document unless `reparse`; returns True if the HTML file changed. """
+        source_path = self._sources[relpath]
+        signature = file_signature(source_path)
+        source_hash = file_hash(source_path) if reparse or relpath not in self._manifest_pages \
+            else self._manifest_pages[relpath]['hash']
+        document = self._get_document(relpath, reparse=reparse)
+        html = apply_document_template(
+            document, template_dir=self.template_dir,
+            template_vars=_page_template_vars(relpath, self.navigation_tree),
+            template_bytecode_cache_dir=self.template_bytecode_cache_dir)
+        output_path = _get_output_path(relpath, source_path, self.output_dir)
+        written = _write_page(output_path, html, self.encodings)
+        self._manifest_pages[relpath] = _make_page_record(document, signature, source_hash, output_path)
+        return written
+
+    def _remove_page(self, relpath):
+        self._sources.pop(relpath, None)
+        self._documents.pop(relpath, None)
+        record = self._manifest_pages.pop(relpath, None)
+        if record is not None:
+            _remove_output(record['output'])
+
+    def _changed_sources(self, relpath):
+        """ Find added, changed, and removed sources within the directory `relpath` (e.g. after a watcher overflow). """
+        dirpath = os.path.join(self.document_root, *relpath.split('/')) if relpath else self.document_root
+        prefix = relpath + '/' if relpath else ''
+        found = {os.path.relpath(source_path, self.document_root).replace(os.sep, '/')
+                 for source_path in scan_md_files(dirpath)}
+        changed = set()
+        for child in found:
+            record = self._manifest_pages.get(child)
+            signature = file_signature(os.path.join(self.document_root, *child.split('/')))
+            if record is None or signature is None or list(signature) != record['signature']:
+                changed.add(child)
+        removed = {child for child in self._sources if child.startswith(prefix) and child not in found}
+        return changed, removed
+
+    def process_events(self, events):
+        """ Re-compile the pages affected by a batch of file change events.
+
+        Args:
+            events: List of (received time, FileEvent) tuples, as queued by `on_event()`.
+
+        Returns:
+            dict with the number of 'rendered', 'reparsed', and 'removed' pages, 'errors',
+            'time' (seconds spent compiling), and 'latency' (seconds from the first save to fresh HTML).
+        """
+        t_start = time.perf_counter()
+        changed, removed, structure_dirs = set(), set(), set()
+        changed_templates, templates_added_or_removed = set(), False
+        saved = []  # Time of each change, from the file mtime if possible.
+        for received, event in events:
+            for path, exists in ((event.path, event.event_type not in ('deleted', 'moved')),
+                                 (event.dest_path, True)):
+                if path is None:
+                    continue
+                path = os.path.abspath(path)
+                try:
+                    saved.append(min(os.stat(path).st_mtime, received) if exists else received)
+                except OSError:
+                    saved.append(received)
+                if self.template_dir and os.path.dirname(path) == self.template_dir:
+                    if event.event_type == 'modified':
+                        changed_templates.add(path)
+                    else:
+                        templates_added_or_removed = True
+                    continue
+                relpath = self._relpath(path)
+                if relpath is None:
+                    continue
+                if event.is_dir:
+                    if event.event_type == 'modified':
+                        # The watcher lost track of changes, anything in here may have changed:
+                        dir_changed, dir_removed = self._changed_sources(relpath)
+                        changed |= dir_changed
+                        removed |= dir_removed
+                        structure_dirs.add((path, True))
+                        continue
+                    structure_dirs.add((os.path.dirname(path), False))
+                    structure_dirs.add((path, True))
+                    if exists:
+                        changed.update(os.path.relpath(source_path, self.document_root).replace(os.sep, '/')
+                                       for source_path in scan_md_files(path))
+                    else:
+                        removed.update(child for child in self._sources if child.startswith(relpath + '/'))
+                elif path.endswith('.md'):
+                    if event.event_type != 'modified':
+                        structure_dirs.add((os.path.dirname(path), False))
+                    (changed if exists else removed).add(relpath)
+
+        errors = []
+        for relpath in changed:
+            source_path = os.path.join(self.document_root, *relpath.split('/'))
+            if os.path.isfile(source_path):
+                self._sources[relpath] = source_path
+            else:
+                removed.add(relpath)  # E.g. created and deleted again within the same batch.
+        changed -= removed
+        for relpath in removed:
+            self._remove_page(relpath)
+
+        tree_changed = False
+        if structure_dirs:
+            if self.invalidate_navigation_tree is not None:
+                for dirpath, recursive in structure_dirs:
+                    self.invalidate_navigation_tree(dirpath, recursive=recursive)
+            navigation_tree = self.get_navigation_tree()
+            if navigation_tree is not self.navigation_tree and navigation_tree != self.navigation_tree:
+                self.navigation_tree = navigation_tree
+                tree_changed = True
+        if changed_templates or templates_added_or_removed:
+            invalidate_templates_in_dir(self.template_dir)
+
+        rerender = set()
+        for relpath, record in self._manifest_pages.items():
+            if (templates_added_or_removed or (tree_changed and record['uses_navigation_tree'])
+                    or changed_templates.intersection(record['templates'])):
+                rerender.add(relpath)
+        rerender -= changed
+        rendered = 0
+        for relpath, reparse in [(relpath, True) for relpath in sorted(changed)] + \
+                                [(relpath, False) for relpath in sorted(rerender)]:
+            try:
+                self._render_page(relpath, reparse=reparse)
+                rendered += 1
+            except Exception as exc:
+                errors.append((relpath, repr(exc)))
+        t_done = time.perf_counter()
+        latency = time.time() - min(saved) if saved and (rendered or removed) else None
+        if latency is not None:
+            self.latencies.append(latency)
+
+        if rendered or removed:
+            self._manifest['tree_digest'] = _get_tree_digest(self.navigation_tree)
+            templates = {path for record in self._manifest_pages.values() for path in record['templates']}
+            self._manifest['templates'] = {path: file_hash(path) for path in sorted(templates)}
+            save_manifest(self.manifest_file, self._manifest)
+        return {
+            'rendered': rendered,
+            'reparsed': len(changed),
+            'removed': len(removed),
+            'errors': errors,
+            'time': t_done - t_start,
+            'latency': latency,
+        }
+
+    def latency_stats(self):
+        """ Return dict with statistics of the recent save-to-HTML latencies (seconds). """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {'count': 0}
+        return {
+            'count': len(latencies),
+            'mean': sum(latencies) / len(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+            'max': latencies[-1],
+        }
+
+
+def format_update_stats(stats):
+    """ Format the stats returned by `WatchBuilder.process_events` as a one-line report. """
+    line = (f"Updated {stats['rendered']} pages ({stats['reparsed']} re-parsed), removed {stats['removed']},"
+            f" in {stats['time']:.3f} s")
+    if stats['latency'] is not None:
+        line += f"; save to HTML: {stats['latency']:.3f} s"
+    lines = [line + "."] + [f" - ERROR: {relpath}: {err}" for relpath, err in stats['errors']]
+    return "\n".join(lines)
@@ -8,27 +8,161 @@ See notes/templating.md
 """
 
 import os
-import sys
 import pathlib
 import glob
-from pprint import pprint
+import logging
+import threading
+from pprint import pformat
+
+from .instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+
+# Template file extensions to try when looking up templates by name (e.g. YFM `template: RS_experiment`):
+TEMPLATE_EXTENSIONS = ('.jinja',)
+
+# Long-lived Jinja environments, one per (template_dir, bytecode_cache_dir):
+_environments = {}
+_environments_lock = threading.Lock()
+
+# Cached template lists, see `get_templates_in_dir`: (template_dir, glob_patterns) -> (dir mtime_ns, templates)
+_template_lists = {}
+
+# Parsed template references, see `get_template_dependencies`: filename -> (mtime_ns, referenced names, variables)
+_template_references = {}
+
+
+def get_template_environment(template_dir, bytecode_cache_dir=None, auto_reload=True):
+    """ Get a long-lived Jinja environment for loading templates from `template_dir`.
+
+    The environment caches compiled templates; with `auto_reload`, the template file's mtime is checked
+    when a template is requested, and the template is only re-compiled if it has changed.
+
+    Args:
+        template_dir: The directory to load templates from.
+        bytecode_cache_dir: If given, use a `jinja2.FileSystemBytecodeCache` in this directory,
+            so templates don't have to be compiled again after a server restart.
+        auto_reload: Check if templates have changed when they are requested.
+
+    Returns:
+        jinja2.Environment
+    """
+    key = (os.path.abspath(template_dir), bytecode_cache_dir, auto_reload)
+    env = _environments.get(key)
+    if env is None:
+        import jinja2
+        with _environments_lock:
+            env = _environments.get(key)
+            if env is None:
+                if bytecode_cache_dir:
+                    os.makedirs(bytecode_cache_dir, exist_ok=True)
+                env = jinja2.Environment(
+                    loader=jinja2.FileSystemLoader(template_dir),
+                    auto_reload=auto_reload,
+                    bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_cache_dir) if bytecode_cache_dir else None,
+                )
+                _environments[key] = env
+    return env
+
+
+def get_template_by_name(env, template_name, extensions=None):
+    """ Get a (compiled) template from a Jinja environment by name, e.g. 'RS_experiment' or 'RS_experiment.jinja'.
+
+    Args:
+        env: The jinja2.Environment to load the template from.
+        template_name: The template name, with or without extension; other files in the template directory
+            (without one of the template `extensions`) are never selected.
+        extensions: The template file extensions to try, defaults to `TEMPLATE_EXTENSIONS`.
+
+    Returns:
+        jinja2.Template
+
+    Raises:
+        FileNotFoundError, if no template could be found.
+    """
+    import jinja2
+    if extensions is None:
+        extensions = TEMPLATE_EXTENSIONS
+    # Only files with one of the template extensions can be selected (e.g. by a document's YFM `template:`):
+    names = [template_name if template_name.endswith(ext) else template_name + ext for ext in extensions]
+    try:
+        return env.select_template(names)
+    except jinja2.TemplatesNotFound:
+        raise FileNotFoundError(
+            f"WARNING: Template_dir does not contain any templates matching {template_name!r} (case sensitive).")
+
+
+def get_template_dependencies(env, template_name):
+    """ Find all template files a template depends on, and the (undeclared) variables they use.
+
+    Referenced templates, i.e. templates that are included, imported, or extended,
+    are followed recursively. Each template file is only parsed again if it has changed.
+
+    Args:
+        env: The jinja2.Environment the template is loaded from.
+        template_name: The name of the template, e.g. `jinja_template.name`.
+
+    Returns:
+        (template_files, variables) tuple, where `template_files` is a list of template filenames,
+        starting with the template itself, and `variables` is a set of the variables used by the templates,
+        e.g. {'content', 'navigation_tree'}.
+        If a template references other templates dynamically (e.g. `{% include some_variable %}`),
+        the referenced templates cannot be known and `template_files` will include None.
+    """
+    import jinja2
+    import jinja2.meta
+    template_files, variables = [], set()
+    pending, seen = [template_name], set()
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        if name is None:
+            template_files.append(None)
+            continue
+        try:
+            source, filename, _ = env.loader.get_source(env, name)
+        except jinja2.TemplateNotFound:
+            continue
+        try:
+            mtime_ns = os.stat(filename).st_mtime_ns
+        except (OSError, TypeError):
+            mtime_ns = None
+        references = _template_references.get(filename)
+        if references is None or mtime_ns is None or references[0] != mtime_ns:
+            ast = env.parse(source)
+            references = (mtime_ns, tuple(jinja2.meta.find_referenced_templates(ast)),
+                          frozenset(jinja2.meta.find_undeclared_variables(ast)))
+            _template_references[filename] = references
+        template_files.append(filename)
+        variables.update(references[2])
+        pending.extend(references[1])
+    return template_files, variables
 
 
 def apply_template_file_to_document(
         document, template_type='jinja2', template=None, template_dir=None, default_template_name='index',
-        template_vars=None,
+        template_vars=None, bytecode_cache_dir=None,
 ):
     """ Locate the proper template file to use and apply it to the document.
 
     Args:
         document:
         template_type:
-        template:
+        template: A template file (used as-is, regardless of its extension), or the name of a template
+            in `template_dir`. If None, the YFM `template` field (or `default_template_name`) is used.
         template_dir:
         default_template_name:
+        bytecode_cache_dir: Directory for caching compiled templates (optional).
 
     Returns:
         html (str) and also updates document['html'] in-place.
+        The path of the applied template is stored in document['template_file'],
+        and the paths of all templates the page depends on (incl. included and extended templates) in
+        document['template_files']. The variables used by the templates are stored in
+        document['template_variables'].
 
     See also:
 
@@ -36,35 +170,44 @@ def apply_template_file_to_document(
     """
     if template_vars is None:
         template_vars = {}
-    print("\nApplying template file to document...")
-    print(" - template_dir:", template_dir)
+    logger.debug("Applying template file to document (template_dir %r)...", template_dir)
+    if not template_type.startswith('jinja'):
+        raise ValueError(f"Value {template_type!r} for `template_type` not recognized.")
 
-    if template is None or not os.path.isfile(template):  # and template_dir is not None:
+    template_is_file = template is not None and os.path.isfile(template)
+    if template_is_file:
+        template_dir, template_name = os.path.split(os.path.abspath(template))
+    else:
         # Template can be e.g. 'ProjectTemplate', which should map to the 'ProjectTemplate' template in template_dir.
-        print("\n(template is None or not os.path.isfile(template)) and template_dir is not None.\n", file=sys.stderr)
         if template is None:
             template_name = document['meta'].get('template', default_template_name)
-            print(f"No template given, using template name from YFM (or default): {template_name!r}.", file=sys.stderr)
+            logger.debug("No template given, using template name from YFM (or default): %r.", template_name)
         else:
             template_name = template
-        print(f"Locating template {template!r} in template_dir {template_dir!r}.")
+        logger.debug("Locating template %r in template_dir %r.", template_name, template_dir)
         assert template_dir is not None
-        assert os.path.isdir(template_dir)
-        template_selection = get_templates_in_dir(template_dir, glob_patterns=("*.jinja",))
-        # glob_patterns=("*.html", "*.j2.html", "*.j2", "*.twig"))
-        try:
-            template = template_selection[template_name]
-        except KeyError:
-            raise FileNotFoundError(
-                f"WARNING: Template_dir does not contain any templates matching {template_name!r} (case sensitive).")
+    with timed('template'):
+        env = get_template_environment(template_dir, bytecode_cache_dir=bytecode_cache_dir)
+        if template_is_file:
+            # An explicitly given template file is used as-is, whatever its extension:
+            jinja_template = env.get_template(template_name)
         else:
-            print(f"Using template {template_name!r} from template directory {template_dir!r}.", file=sys.stderr)
+            # Names from the YFM (or the default) can only select files with a template extension:
+            jinja_template = get_template_by_name(env, template_name)
 
-    print("Applying template:", template)
-    template_vars.update(document)
-    template_vars['content'] = document['html_content']  # Default document "content" entry is the Markdown.
-    html = apply_template(template=pathlib.Path(template), template_type=template_type, template_vars=template_vars)
+        logger.debug("Applying template: %s", jinja_template.filename)
+        template_vars.update(document)
+        template_vars['content'] = document['html_content']  # Default document "content" entry is the Markdown.
+        html = jinja_template.render(**template_vars)
     document['html'] = html
+    document['template_file'] = jinja_template.filename  # Used to track which template a compiled page depends on.
+    template_files, template_variables = get_template_dependencies(env, jinja_template.name)
+    if None in template_files:
+        # Dynamic include/import/extends; the page may depend on any template in the template dir:
+        template_files = [fn for fn in template_files if fn is not None]
+        template_files += sorted(set(get_templates_in_dir(template_dir).values()) - set(template_files))
+    document['template_files'] = template_files
+    document['template_variables'] = template_variables
     return html
 
 
@@ -86,12 +229,12 @@ def apply_template(template, template_vars, template_type='jinja2'):
     if isinstance(template, pathlib.Path):
         template = open(template, encoding='utf-8').read()
 
-    print("Performing template variable subsubstitution...", file=sys.stderr)
+    logger.debug("Performing template variable substitution...")
     # Twig/Jinja template interpolation:
 
     if template_type.startswith('jinja'):
         import jinja2
-        print("template length:", len(template))
+        logger.debug("template length: %s", len(template))
         template = jinja2.Template(template)
         html = template.render(**template_vars)
     else:
@@ -100,14 +243,44 @@ def apply_template(template, template_vars, template_type='jinja2'):
     return html
 
 
-def get_templates_in_dir(template_dir, glob_patterns=('*.jinja',)):
+def get_templates_in_dir(template_dir, glob_patterns=('*.jinja',), use_cache=True):
+    """ Get all template files in `template_dir`, as a dict of template name -> template file.
 
-    files = [fn for pat in glob_patterns for fn in sorted(glob.iglob(os.path.join(template_dir, pat)))]
-    print(f"\nTemplate files in {template_dir!r}:", file=sys.stderr)
-    print("\n".join(f" - {fn!r}" for fn in files), file=sys.stderr)
+    Both the template name without extension and the full filename are included as keys.
 
+    Args:
+        template_dir: The directory to look for templates in.
+        glob_patterns: Glob patterns matching template files.
+        use_cache: Re-use the result of the last call, as long as the template directory's mtime
+            is unchanged (templates added, removed, or renamed), or until `invalidate_templates_in_dir()`
+            is called (e.g. by a file watcher).
+
+    Returns:
+        dict; must not be modified by the caller if `use_cache` is True.
+    """
+    key = (template_dir, tuple(glob_patterns))
+    try:
+        dir_mtime_ns = os.stat(template_dir).st_mtime_ns
+    except OSError:
+        dir_mtime_ns = None
+    if use_cache:
+        cached = _template_lists.get(key)
+        if cached is not None and cached[0] == dir_mtime_ns:
+            return cached[1]
+
+    files = [fn for pat in glob_patterns for fn in sorted(glob.iglob(os.path.join(template_dir, pat)))]
     templates_by_name = {os.path.splitext(os.path.basename(fn))[0]: fn for fn in files}
     templates_by_name.update({fn: fn for fn in files})
-    pprint(templates_by_name)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Template files in %r:\n%s", template_dir, pformat(templates_by_name))
+
+    if use_cache:
+        _template_lists[key] = (dir_mtime_ns, templates_by_name)
+    return templates_by_name
+
 
-    return templates_by_name
\ No newline at end of file
+def invalidate_templates_in_dir(template_dir=None):
+    """ Forget the cached template list for `template_dir` (or for all directories). """
+    for key in list(_template_lists):
+        if template_dir is None or key[0] == template_dir:
+            _template_lists.pop(key, None)
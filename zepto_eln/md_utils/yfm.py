@@ -7,17 +7,40 @@ Module for extracting and parsing YAML Front-Matter from documents.
 """
 
 import re
+import copy
+import functools
+import logging
 import yaml
-import sys
-try:
-    import frontmatter
-except ImportError:
-    print("`frontmatter` package not available; using local routines.")
-    frontmatter = None
 
+logger = logging.getLogger(__name__)
+
+# Use the LibYAML-based C loader when available (much faster than the pure-Python loader):
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+YFM_SEP_REGEX = r'^-{3,}$'
+
+# Parsed YFM metadata is memoized by front-matter text, since many documents share identical headers:
+YFM_CACHE_SIZE = 4096
+
+_LEADING_WHITESPACE = re.compile(r'\s*')
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_sep_regex(sep_regex):
+    return re.compile(sep_regex, re.MULTILINE)
+
+
+def split_yfm(raw_content, sep_regex=YFM_SEP_REGEX, require_leading_marker='raise', require_empty_pre='raise'):
+    yfm_sep_regex = _compile_sep_regex(sep_regex)
 
-def split_yfm(raw_content, sep_regex=r'^-{3,}$', require_leading_marker='raise', require_empty_pre='raise'):
-    yfm_sep_regex = re.compile(sep_regex, re.MULTILINE)
+    # Fast path: Document starts with a YFM marker (ignoring whitespace); just find the closing marker.
+    start_marker = yfm_sep_regex.match(raw_content, _LEADING_WHITESPACE.match(raw_content).end())
+    if start_marker:
+        end_marker = yfm_sep_regex.search(raw_content, start_marker.end())
+        if end_marker:
+            return raw_content[start_marker.end():end_marker.start()], raw_content[end_marker.end():]
+
+    # Otherwise, split the document to find out what is wrong:
     splitted = yfm_sep_regex.split(raw_content, 2)  # Split at most two times (into three parts) on regex matches.
 
     if len(splitted) == 1:
@@ -27,7 +50,7 @@ def split_yfm(raw_content, sep_regex=r'^-{3,}$', require_leading_marker='raise',
             if require_leading_marker == 'raise':
                 raise ValueError(f"Only found one YFM marker ({sep_regex!r}).")
             else:
-                print(f"WARNING: Only found one YFM marker ({sep_regex!r}).", file=sys.stderr)
+                logger.warning("Only found one YFM marker (%r).", sep_regex)
         yfm_text, md_text = splitted
     else:
         pre, yfm_text, md_text = splitted
@@ -71,7 +94,21 @@ class FrontmatterParserError(Exception):
         self.n_errors += 1
 
 
-def parse_yfm(raw_content, sep_regex=r'^-{3,}$', require_leading_marker='raise', require_empty_pre='raise'):
+@functools.lru_cache(maxsize=YFM_CACHE_SIZE)
+def _load_yfm_text(yfm_text):
+    return yaml.load(yfm_text, Loader=YAML_LOADER)
+
+
+def load_yfm_text(yfm_text):
+    """ Load YAML front-matter text, memoized by the text.
+
+    Returns a (deep) copy of the memoized metadata, so the caller is free to modify it.
+    Exceptions are not memoized; YAML errors are raised as usual.
+    """
+    return copy.deepcopy(_load_yfm_text(yfm_text))
+
+
+def parse_yfm(raw_content, sep_regex=YFM_SEP_REGEX, require_leading_marker='raise', require_empty_pre='raise'):
     """ Parse Yaml Front Matter from text and return metadata dict and stripped content.
 
     Args:
@@ -86,58 +123,50 @@ def parse_yfm(raw_content, sep_regex=r'^-{3,}$', require_leading_marker='raise',
     """
     err = FrontmatterParserError()
 
-    if frontmatter:
-        print("Parsing `raw_content` with frontmatter package...")
-        yfm, md_content = parse_with_frontmatter(raw_content)
-
     try:
         yfm_text, md_content = split_yfm(
             raw_content, sep_regex=sep_regex,
             require_leading_marker=require_leading_marker, require_empty_pre=require_empty_pre)
     except ValueError as exc:
         err.add_error("Error splitting document front-matter: " + str(exc), exception=exc)
-        return {}, md_content, err
+        return {}, raw_content, err
     if not yfm_text:
         err_msg = f"WARNING: yfm_text is empty, {yfm_text!r}. Setting yfm to an empty dict."
-        print(err_msg, file=sys.stderr)
+        logger.warning("yfm_text is empty, %r. Setting yfm to an empty dict.", yfm_text)
         err.add_error(err_msg)
         return {}, md_content, err
     try:
-        print("Loading yfm_text with yaml.load:", file=sys.stderr)
-        print(yfm_text, file=sys.stderr)
-        yfm = yaml.load(yfm_text)  # Exception caught in outer functions that has knowledge about filename.
-    except (yaml.scanner.ScannerError, yaml.parser.ParserError) as exc:
+        logger.debug("Loading yfm_text with yaml.load:\n%s", yfm_text)
+        yfm = load_yfm_text(yfm_text)
+    except yaml.MarkedYAMLError as exc:  # ScannerError, ParserError, ConstructorError, etc.
         err_msg = f"ERROR: `{exc.__class__.__module__}.{exc.__class__.__name__}`  during `yaml.load(yfm_text)`."
-        print(err_msg, file=sys.stderr)
         details = []
         yfm_lines = yfm_text.split('\n')
 
         info = f"> Exception message: {exc}"
-        print(info, file=sys.stderr)
         details.append(info)
 
         for marker_name, marker in (('Context', exc.context_mark), ('Problem', exc.problem_mark)):
             if marker is None:
-                print(f"> ({marker_name} is {marker})", file=sys.stderr)
                 continue
             context_before, context_after = 2, 2
-            context_lines_start, context_lines_stop = marker.line - context_before, marker.line + 1 + context_after
+            context_lines_start = max(marker.line - context_before, 0)
+            context_lines_stop = marker.line + 1 + context_after
             context_lines = yfm_lines[context_lines_start:context_lines_stop]
             context_lines = [line.replace('\t', '⭾' ).replace(' ', '·') for line in context_lines]
-            context_lines[context_before] += "    ⚠️"
+            if marker.line - context_lines_start < len(context_lines):
+                context_lines[marker.line - context_lines_start] += "    ⚠️"
             context_lines = "\n".join(context_lines)
             info = (f"\n> {marker_name} marker at line {marker.line}," 
                     f" showing lines {context_lines_start}–{context_lines_stop} below" 
                     " (⭾ and · indicates TAB and SPACE characters)"
                     f":\n\n{context_lines}\n")
-            print(info, file=sys.stderr)
             details.append(info)
         # except yaml.parser.ParserError as exc:
         #     import pdbpp; pdbpp.set_trace()
 
         yfm_text_visible_tabs = yfm_text.replace(r'\t', r'\\t')
         info = f"\n> Full yfm_text (with visible tabs) is:\n\n{yfm_text_visible_tabs}\n"
-        print(info, file=sys.stderr)
         details.append(info)
 
         info = "\n> Checking yfm_text for common errors..."
@@ -148,8 +177,8 @@ def parse_yfm(raw_content, sep_regex=r'^-{3,}$', require_leading_marker='raise',
         info += ("\n - Lines with tabs at the end:" +
                  ("YES! Lines: " + ", ".join(space_eol_lines) if space_eol_lines else "No."))
 
-        print(info, file=sys.stderr)
         details.append(info)
+        logger.error("%s\n%s", err_msg, "\n".join(details))
 
         err.add_error(err_msg, err_detail="\n"+"\n------\n".join(details)+"\n\n", exception=exc)
         yfm = {}